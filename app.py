@@ -1,11 +1,18 @@
 import logging.config
+import os
+import time
 import traceback
 
 import sqlalchemy.exc
-from flask import Flask, render_template, request
+from flask import Flask, Response, g, jsonify, render_template, request
 
 # For setting up the Flask-SQLAlchemy database session
-from src.animal_manager import RecommendationManager, Recommendations
+from src.animal_manager import RecommendationManager
+from src.api import batch_response, parse_batch_request, parse_k
+from src.metrics import CONTENT_TYPE, ServingMetrics
+from src.rec_cache import RecommendationCache
+from src.rec_store import RecommendationStore
+from src.similarity import SimilarityIndex
 
 # Initialize the Flask application
 app = Flask(__name__, template_folder="app/templates",
@@ -27,9 +34,101 @@ logger.debug(
     'go to 127.0.0.1 instead of 0.0.0.0.', app.config["HOST"]
     , app.config["PORT"])
 
-# Initialize the database session
-recommendation_manager = RecommendationManager(app)
-logger.debug('The database dialect is %s', app.config['SQLALCHEMY_DATABASE_URI'])
+if app.config["REC_BACKEND"] == "mmap":
+    # Serve from the memory-mapped store written by the recommendation stage,
+    # its pages are shared by all the workers
+    recommendation_store = RecommendationStore(app.config["REC_STORE_PATH"])
+    logger.debug('Recommendations are served from %s', app.config['REC_STORE_PATH'])
+
+    def query_recommendations(user_input: str) -> list:
+        """Look up the recommendations for a villager in the recommendation store.
+
+        Args:
+            user_input (str): the villager name
+
+        Returns:
+            list: the recommendations as dictionaries, ordered by rank
+
+        """
+        return recommendation_store.lookup(user_input, limit=app.config["MAX_ROWS_SHOW"])
+
+    def query_recommendations_batch(user_inputs: list) -> dict:
+        """Look up the recommendations for several villagers in the recommendation store.
+
+        Args:
+            user_inputs (list): the villager names
+
+        Returns:
+            dict: villager name -> recommendations, for the villagers that were found
+
+        """
+        return {name: query_recommendations(name) for name in user_inputs}
+
+    get_version = recommendation_store.get_version
+else:
+    # Initialize the database session, scoped to every request and retried after a lost
+    # connection (pool and retry settings in flaskconfig.py)
+    recommendation_manager = RecommendationManager(app)
+    logger.debug('The database dialect is %s', app.config['SQLALCHEMY_DATABASE_URI'])
+
+    def query_recommendations(user_input: str) -> list:
+        """Query the recommendations for a villager from the database.
+
+        Args:
+            user_input (str): the villager name
+
+        Returns:
+            list: the recommendations as dictionaries, ordered by rank
+
+        """
+        return recommendation_manager.get_recommendations(user_input, app.config["MAX_ROWS_SHOW"])
+
+    def query_recommendations_batch(user_inputs: list) -> dict:
+        """Query the recommendations for several villagers with one IN (...) query.
+
+        Args:
+            user_inputs (list): the villager names
+
+        Returns:
+            dict: villager name -> recommendations ordered by rank, for the villagers that were found
+
+        """
+        return recommendation_manager.get_recommendations_many(user_inputs, app.config["MAX_ROWS_SHOW"])
+
+    get_version = recommendation_manager.get_version
+
+
+# Serve popular villagers without a database round trip
+recommendation_cache = RecommendationCache(query_recommendations,
+                                           get_version,
+                                           max_size=app.config["REC_CACHE_SIZE"],
+                                           version_ttl=app.config["REC_CACHE_VERSION_TTL"],
+                                           batch_loader=query_recommendations_batch)
+
+# Latency, outcomes and cache hits of the requests, exposed on /metrics
+metrics = ServingMetrics(recommendation_cache)
+
+# The similarity index answers from memory; the route is disabled until it is built
+similarity_index = None
+if os.path.isfile(app.config["SIMILARITY_INDEX_PATH"]):
+    similarity_index = SimilarityIndex.load(app.config["SIMILARITY_INDEX_PATH"])
+else:
+    logger.warning("No similarity index at %s, /similar is not available",
+                   app.config["SIMILARITY_INDEX_PATH"])
+
+@app.before_request
+def start_timer():
+    """Remember when the request started."""
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    """Record the latency and status of the request."""
+    if "request_start" in g:
+        metrics.observe_request(request.endpoint, response.status_code, time.perf_counter() - g.request_start)
+    return response
+
 
 @app.route('/')
 def index():
@@ -50,15 +149,85 @@ def data():
     if request.method == 'POST':
         user_input = request.form.to_dict()['Name']
         try:
-            recommendations = recommendation_manager.session.query(Recommendations).filter_by(Name_villager=user_input).limit(
-                app.config["MAX_ROWS_SHOW"]).all()
-            if len(recommendations) == 0:
-                return render_template('not_found.html', user_input=user_input)
-            return render_template('result.html', recommendations=recommendations, user_input=user_input)
+            with metrics.phase("data", "lookup"):
+                recommendations = recommendation_cache.get(user_input)
         except sqlalchemy.exc.OperationalError:
             traceback.print_exc()
             logger.warning("Not able to display villagers, error page returned")
+            metrics.count("data", "error")
             return render_template('error.html')
+        metrics.count("data", "found" if recommendations else "not_found")
+        with metrics.phase("data", "render"):
+            if len(recommendations) == 0:
+                return render_template('not_found.html', user_input=user_input)
+            return render_template('result.html', recommendations=recommendations, user_input=user_input)
+
+@app.route('/api/recommendations', methods=['POST'])
+def api_recommendations():
+    """The recommendations of several villagers, as json.
+
+    The body is {"names": [...], "limit": n}; limit is the number of recommendations per
+    villager, at most (and by default) MAX_ROWS_SHOW. The villagers that are not cached
+    are looked up together in one query.
+
+    Returns:
+        json {"results": [{"name", "recommendations"}], "not_found": [...]}, in the order
+        of the names
+    """
+    try:
+        names, limit = parse_batch_request(request.get_json(silent=True),
+                                           app.config["API_MAX_NAMES"], app.config["MAX_ROWS_SHOW"])
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    try:
+        with metrics.phase("api_recommendations", "lookup"):
+            found = recommendation_cache.get_many(names)
+    except sqlalchemy.exc.OperationalError:
+        logger.warning("Not able to look up the villagers, error returned", exc_info=True)
+        metrics.count("api_recommendations", "error", len(names))
+        return jsonify(error="The recommendations are not available."), 503
+    n_found = sum(1 for rows in found.values() if rows)
+    metrics.count("api_recommendations", "found", n_found)
+    metrics.count("api_recommendations", "not_found", len(found) - n_found)
+    with metrics.phase("api_recommendations", "render"):
+        return jsonify(batch_response(found, limit))
+
+@app.route('/similar/<name>')
+def similar(name):
+    """The villagers most similar to a villager, as json.
+
+    The query string takes k (number of villagers, a positive integer, MAX_ROWS_SHOW by
+    default) and same_cluster (1 to only return villagers from the same cluster).
+
+    Returns:
+        json list of {"Name", "Cluster", "Similarity"}, most similar first
+    """
+    if similarity_index is None:
+        return jsonify(error="The similarity index is not built."), 503
+    try:
+        k = parse_k(request.args.get("k"), app.config["MAX_ROWS_SHOW"])
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    same_cluster = request.args.get("same_cluster", "0") == "1"
+    try:
+        with metrics.phase("similar", "lookup"):
+            similar_villagers = similarity_index.query(name, k=k, same_cluster=same_cluster)
+    except KeyError:
+        metrics.count("similar", "not_found")
+        return jsonify(error=f"{name} is not in the similarity index."), 404
+    metrics.count("similar", "found")
+    with metrics.phase("similar", "render"):
+        return jsonify(similar_villagers)
+
+@app.route('/metrics')
+def metrics_view():
+    """The request metrics of this process, in the Prometheus text format.
+
+    Returns:
+        text with the latency histograms of the requests and of their lookup and render
+        phases, the responses by status, the lookups by outcome and the cache hits
+    """
+    return Response(metrics.expose(), content_type=CONTENT_TYPE)
 
 if __name__ == '__main__':
     app.run(debug=app.config["DEBUG"], port=app.config["PORT"],
@@ -0,0 +1,210 @@
+"""Async (ASGI) version of the web app in app.py. It serves the same pages and json
+routes with the same templates and configuration, but the lookups do not block a worker:
+the database is read with an async driver, or the recommendations come from the
+memory-mapped store (REC_BACKEND = "mmap" in config/flaskconfig.py).
+
+Run it with `uvicorn asgi:app --host 0.0.0.0 --port 5000`."""
+import logging.config
+import os
+import time
+
+import sqlalchemy.exc
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+
+from config import flaskconfig as config
+from src.animal_manager import AsyncRecommendationManager, pool_options
+from src.api import batch_response, parse_batch_request, parse_k
+from src.metrics import CONTENT_TYPE, ServingMetrics
+from src.rec_cache import AsyncRecommendationCache
+from src.rec_store import RecommendationStore
+from src.similarity import SimilarityIndex
+
+logging.config.fileConfig(config.LOGGING_CONFIG)
+logger = logging.getLogger(config.APP_NAME)
+
+templates = Jinja2Templates(directory="app/templates")
+
+if config.REC_BACKEND == "mmap":
+    # the store is in memory, a lookup never waits
+    recommendation_store = RecommendationStore(config.REC_STORE_PATH)
+    recommendation_manager = None
+    logger.debug('Recommendations are served from %s', config.REC_STORE_PATH)
+
+    async def query_recommendations_batch(user_inputs: list) -> dict:
+        """Look up the recommendations for several villagers in the recommendation store."""
+        return {name: recommendation_store.lookup(name, limit=config.MAX_ROWS_SHOW) for name in user_inputs}
+
+    async def get_version():
+        """The version of the recommendation store."""
+        return recommendation_store.get_version()
+else:
+    recommendation_manager = AsyncRecommendationManager(config.SQLALCHEMY_DATABASE_URI,
+                                                        pool=pool_options(vars(config)),
+                                                        retries=config.DB_RETRIES,
+                                                        backoff=config.DB_RETRY_BACKOFF)
+    logger.debug('The database dialect is %s', recommendation_manager.engine.dialect.name)
+
+    async def query_recommendations_batch(user_inputs: list) -> dict:
+        """Query the recommendations for several villagers with one IN (...) query."""
+        return await recommendation_manager.query_many(user_inputs, limit=config.MAX_ROWS_SHOW)
+
+    get_version = recommendation_manager.get_version
+
+async def query_recommendations(user_input: str) -> list:
+    """Query the recommendations for a villager."""
+    found = await query_recommendations_batch([user_input])
+    return found.get(user_input, [])
+
+recommendation_cache = AsyncRecommendationCache(query_recommendations, get_version,
+                                                max_size=config.REC_CACHE_SIZE,
+                                                version_ttl=config.REC_CACHE_VERSION_TTL,
+                                                batch_loader=query_recommendations_batch)
+
+metrics = ServingMetrics(recommendation_cache)
+
+similarity_index = None
+if os.path.isfile(config.SIMILARITY_INDEX_PATH):
+    similarity_index = SimilarityIndex.load(config.SIMILARITY_INDEX_PATH)
+
+
+class RequestMetrics:
+    """ASGI middleware recording the latency and status of every request, by the name
+    of the view that handled it (the same names as in app.py)."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # the router adds the view to the scope
+            endpoint = getattr(scope.get("endpoint"), "__name__", None)
+            metrics.observe_request(endpoint, status["code"], time.perf_counter() - start)
+
+
+async def index(request):
+    """Main view with the search form.
+
+    Returns:
+        Rendered html template
+
+    """
+    return templates.TemplateResponse('index.html', {'request': request})
+
+
+async def data(request):
+    """The recommendations of the villager entered in the form.
+
+    Returns:
+        Rendered html template
+
+    """
+    form = await request.form()
+    user_input = form['Name']
+    try:
+        with metrics.phase("data", "lookup"):
+            recommendations = await recommendation_cache.get(user_input)
+    except sqlalchemy.exc.OperationalError:
+        logger.warning("Not able to display villagers, error page returned", exc_info=True)
+        metrics.count("data", "error")
+        return templates.TemplateResponse('error.html', {'request': request})
+    metrics.count("data", "found" if recommendations else "not_found")
+    with metrics.phase("data", "render"):
+        if len(recommendations) == 0:
+            return templates.TemplateResponse('not_found.html', {'request': request, 'user_input': user_input})
+        return templates.TemplateResponse('result.html', {'request': request, 'recommendations': recommendations,
+                                                          'user_input': user_input})
+
+
+async def api_recommendations(request):
+    """The recommendations of several villagers, as json (see app.py).
+
+    Returns:
+        json {"results": [{"name", "recommendations"}], "not_found": [...]}
+
+    """
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    try:
+        names, limit = parse_batch_request(payload, config.API_MAX_NAMES, config.MAX_ROWS_SHOW)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        with metrics.phase("api_recommendations", "lookup"):
+            found = await recommendation_cache.get_many(names)
+    except sqlalchemy.exc.OperationalError:
+        logger.warning("Not able to look up the villagers, error returned", exc_info=True)
+        metrics.count("api_recommendations", "error", len(names))
+        return JSONResponse({"error": "The recommendations are not available."}, status_code=503)
+    n_found = sum(1 for rows in found.values() if rows)
+    metrics.count("api_recommendations", "found", n_found)
+    metrics.count("api_recommendations", "not_found", len(found) - n_found)
+    with metrics.phase("api_recommendations", "render"):
+        return JSONResponse(batch_response(found, limit))
+
+
+async def similar(request):
+    """The villagers most similar to a villager, as json (see app.py).
+
+    Returns:
+        json list of {"Name", "Cluster", "Similarity"}, most similar first
+
+    """
+    if similarity_index is None:
+        return JSONResponse({"error": "The similarity index is not built."}, status_code=503)
+    name = request.path_params["name"]
+    try:
+        k = parse_k(request.query_params.get("k"), config.MAX_ROWS_SHOW)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    same_cluster = request.query_params.get("same_cluster", "0") == "1"
+    try:
+        with metrics.phase("similar", "lookup"):
+            similar_villagers = similarity_index.query(name, k=k, same_cluster=same_cluster)
+    except KeyError:
+        metrics.count("similar", "not_found")
+        return JSONResponse({"error": f"{name} is not in the similarity index."}, status_code=404)
+    metrics.count("similar", "found")
+    with metrics.phase("similar", "render"):
+        return JSONResponse(similar_villagers)
+
+
+async def metrics_view(request): # pylint: disable=unused-argument
+    """The request metrics of this process, in the Prometheus text format (see app.py)."""
+    # as a header, so that starlette does not append a second charset
+    return Response(metrics.expose(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def shutdown():
+    """Close the connections to the database."""
+    if recommendation_manager is not None:
+        await recommendation_manager.close()
+
+
+app = Starlette(debug=config.DEBUG,
+                routes=[Route('/', index, methods=['GET']),
+                        Route('/', data, methods=['POST']),
+                        Route('/api/recommendations', api_recommendations, methods=['POST']),
+                        Route('/similar/{name}', similar),
+                        Route('/metrics', metrics_view),
+                        Mount('/static', app=StaticFiles(directory="app/static"), name='static')],
+                middleware=[Middleware(RequestMetrics)],
+                on_shutdown=[shutdown])
@@ -0,0 +1,81 @@
+"""Benchmark the kmodes package against the numpy engine in src/kmodes_engine.py on the
+villager modeling data scaled up by tiling it. Each copy gets a fraction of its cells
+replaced by other values of the same column so that the copies are not identical.
+
+Usage:
+    python benchmarks/bench_kmodes_engine.py --scales 10 100 1000
+"""
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.artifacts import read_table # pylint: disable=wrong-import-position
+from src.kmodes_engine import ENGINES, make_model # pylint: disable=wrong-import-position
+
+logger = logging.getLogger("bench_kmodes_engine")
+
+def scale_data(df: pd.DataFrame, scale: int, noise: float, random_state: int) -> pd.DataFrame:
+    """tile the data scale times and replace a fraction of the cells of the copies
+
+    Args:
+        df (pd.DataFrame): the data used for modeling
+        scale (int): number of copies
+        noise (float): fraction of cells of the copies replaced by a random value of the column
+        random_state (int): seed of the noise
+
+    Returns:
+        pd.DataFrame: the scaled data
+    """
+    rng = np.random.RandomState(random_state)
+    scaled = pd.concat([df] * scale, ignore_index=True)
+    for column in scaled.columns:
+        replace = rng.random_sample(len(scaled)) < noise
+        replace[:len(df)] = False
+        scaled.loc[replace, column] = rng.choice(df[column].to_numpy(), replace.sum())
+    return scaled
+
+def main():
+    """run the benchmark and print one row per (scale, engine)"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--data_path", default="data/interim/for_model.parquet",
+                        help="the data used for modeling.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000],
+                        help="how many times the data is tiled.")
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=ENGINES,
+                        help="the engines to compare.")
+    parser.add_argument("--max_rows_kmodes", type=int, default=None,
+                        help="skip the kmodes package above this number of rows.")
+    parser.add_argument("--n_clusters", type=int, default=10)
+    parser.add_argument("--n_init", type=int, default=1)
+    parser.add_argument("--init", default="random")
+    parser.add_argument("--noise", type=float, default=0.1)
+    parser.add_argument("--random_state", type=int, default=42)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    df = read_table(args.data_path)
+    rows = []
+    for scale in args.scales:
+        data = scale_data(df, scale, args.noise, args.random_state)
+        for engine in args.engines:
+            if engine == "kmodes" and args.max_rows_kmodes and len(data) > args.max_rows_kmodes:
+                continue
+            model = make_model(engine, n_clusters=args.n_clusters, init=args.init,
+                               n_init=args.n_init, random_state=args.random_state)
+            start = time.perf_counter()
+            model.fit(data)
+            seconds = time.perf_counter() - start
+            rows.append({"scale": scale, "rows": len(data), "engine": engine,
+                         "seconds": round(seconds, 3), "cost": model.cost_,
+                         "cost_per_row": round(model.cost_ / len(data), 4)})
+            logger.warning("scale %i, %s: %.3f s", scale, engine, seconds)
+    print(pd.DataFrame(rows).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Benchmark the requests per second of the sync web app (app.py on the threaded Flask
+server, as in dockerfiles/Dockerfile.app) against the async one (asgi.py on uvicorn).
+Each app is started in its own process on a free port and a number of concurrent
+keep-alive clients send requests to it for a fixed time, cycling through the villager
+names. The backend is the one of config/flaskconfig.py (REC_BACKEND and
+SQLALCHEMY_DATABASE_URI can be set in the environment).
+
+Usage:
+    python benchmarks/bench_serving.py --concurrency 1 16 64 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+from urllib.parse import quote_plus
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from src.artifacts import read_table # pylint: disable=wrong-import-position
+
+logger = logging.getLogger("bench_serving")
+
+# the command starting every app, {port} is filled in
+SERVERS = {"sync": [sys.executable, "-c",
+                    "from app import app; app.run(host='127.0.0.1', port={port}, threaded=True, debug=False)"],
+           "async": [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1",
+                     "--port", "{port}", "--log-level", "warning"]}
+
+def free_port() -> int:
+    """a port nobody listens on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(command: List[str], port: int, timeout: float = 30) -> subprocess.Popen:
+    """start an app and wait until it accepts connections
+
+    Args:
+        command (List): the command, with {port} in place of the port
+        port (int): the port of the app
+        timeout (float): seconds to wait for the app
+
+    Raises:
+        RuntimeError: if the app does not accept connections in time
+
+    Returns:
+        subprocess.Popen: the process of the app
+    """
+    process = subprocess.Popen([part.format(port=port) for part in command], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{' '.join(command)} did not start.")
+
+def form_request(name: str) -> Tuple[str, str, bytes]:
+    """the html form lookup of one villager"""
+    return "/", "application/x-www-form-urlencoded", f"Name={quote_plus(name)}".encode()
+
+def api_request(names: List[str]) -> Tuple[str, str, bytes]:
+    """the json batch lookup of several villagers"""
+    return "/api/recommendations", "application/json", json.dumps({"names": names}).encode()
+
+async def client(port: int, requests: List[Tuple[str, str, bytes]], start: int,
+                 deadline: float, latencies: List[float]) -> None:
+    """send the requests one after the other over a keep-alive connection until the
+    deadline, reconnecting when the server closes the connection"""
+    reader = writer = None
+    i = start
+    while time.monotonic() < deadline:
+        path, content_type, body = requests[i % len(requests)]
+        i += 1
+        if writer is None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        sent = time.monotonic()
+        writer.write(f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+                     f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+        status = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            key, _, value = line.decode().partition(":")
+            headers[key.strip().lower()] = value.strip()
+        if "content-length" in headers:
+            await reader.readexactly(int(headers["content-length"]))
+        else:
+            await reader.read()
+        latencies.append(time.monotonic() - sent)
+        if not status.split()[1:2] == [b"200"]:
+            raise RuntimeError(f"{path} returned {status.decode().strip()}")
+        if headers.get("connection", "").lower() == "close" or status.startswith(b"HTTP/1.0"):
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+async def load(port: int, requests: List, concurrency: int, duration: float) -> Dict:
+    """run concurrent clients against an app
+
+    Returns:
+        Dict: requests per second and the 50th and 99th percentile latency in ms
+    """
+    latencies = []
+    started = time.monotonic()
+    await asyncio.gather(*(client(port, requests, i * 7, started + duration, latencies)
+                           for i in range(concurrency)))
+    elapsed = time.monotonic() - started
+    return {"req/s": len(latencies) / elapsed,
+            "p50 ms": float(np.percentile(latencies, 50)) * 1000,
+            "p99 ms": float(np.percentile(latencies, 99)) * 1000}
+
+def main():
+    """run the benchmark and print one row per (endpoint, concurrency, app)"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rec_path", default="data/final/recommendation.arrow",
+                        help="the recommendation table, for the villager names.")
+    parser.add_argument("--servers", nargs="+", default=list(SERVERS), choices=SERVERS,
+                        help="the apps to compare.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64],
+                        help="numbers of concurrent clients.")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per measurement.")
+    parser.add_argument("--batch_size", type=int, default=20, help="names per json batch request.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    names = sorted(read_table(os.path.join(ROOT, args.rec_path))["Name_villager"].astype(str).unique())
+    endpoints = {"form": [form_request(name) for name in names],
+                 "api": [api_request(names[i:i + args.batch_size])
+                         for i in range(0, len(names), args.batch_size)]}
+
+    results = []
+    for server in args.servers:
+        port = free_port()
+        process = start_server(SERVERS[server], port)
+        try:
+            for endpoint, requests in endpoints.items():
+                # one pass to fill the caches of the app
+                asyncio.run(load(port, requests, 1, 0.5))
+                for concurrency in args.concurrency:
+                    result = asyncio.run(load(port, requests, concurrency, args.duration))
+                    results.append({"endpoint": endpoint, "concurrency": concurrency, "app": server, **result})
+        finally:
+            process.terminate()
+            process.wait()
+
+    print(f"{'endpoint':>8} {'clients':>8} {'app':>6} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for row in sorted(results, key=lambda row: (row["endpoint"], row["concurrency"], row["app"])):
+        print(f"{row['endpoint']:>8} {row['concurrency']:>8} {row['app']:>6} {row['req/s']:>9.0f} "
+              f"{row['p50 ms']:>8.2f} {row['p99 ms']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
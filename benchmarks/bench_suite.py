@@ -0,0 +1,211 @@
+"""Time the stages of the model pipeline and the app lookups on synthetic villager
+catalogues of growing size (see benchmarks/synthetic.py), and write the timings to a
+json report. Every stage runs the functions of src with the settings of
+config/model_config.yaml, on files in a temporary directory:
+
+- feature_engineering: drop_cols and feature_engineering of the raw catalogue
+- encode_data: integer coding of the cleaned catalogue
+- kmodes_modeling: the elbow sweep over --k (written like the train stage)
+- form_final_model: the final model with modeling.form_final_model.final_n_cluster
+- create_rec_table: the ranked recommendations of every villager
+- ingest_raw / ingest_rec: bulk ingestion into a SQLite database
+- lookup_db / lookup_store: recommendation lookups of random villagers, from the
+  database and from the memory-mapped store
+
+Passing an earlier report with --compare prints the ratio of every timing to it.
+
+Usage:
+    python benchmarks/bench_suite.py --sizes 1000 10000 100000 --report benchmarks/report.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+import yaml
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from src.animal_manager import AnimalManager, RecommendationManager, create_db # pylint: disable=wrong-import-position
+from src.artifacts import read_table # pylint: disable=wrong-import-position
+from src.encoding import decode_df, save_vocabulary # pylint: disable=wrong-import-position
+from src.kmodes_engine import ENGINES, engine_config # pylint: disable=wrong-import-position
+from src.modeling import form_final_model, kmodes_modeling, load_model # pylint: disable=wrong-import-position
+from src.modeling_helper import create_rec_table # pylint: disable=wrong-import-position
+from src.preprocess import drop_cols, encode_data, feature_engineering, load_dataset, save_df # pylint: disable=wrong-import-position
+from src.rec_store import RecommendationStore, write_rec_store # pylint: disable=wrong-import-position
+from synthetic import generate_villagers # pylint: disable=wrong-import-position
+
+logger = logging.getLogger("bench_suite")
+
+# version of the layout of the report
+REPORT_VERSION = 1
+
+def timed(func: Callable, *args, **kwargs):
+    """call func and return its result and the seconds it took"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def lookup_timings(lookup: Callable, names: List[str]) -> Dict:
+    """latency of one lookup per name
+
+    Returns:
+        Dict: lookups, seconds, lookups per second and the 50th and 99th percentile in ms
+    """
+    latencies = []
+    for name in names:
+        start = time.perf_counter()
+        lookup(name)
+        latencies.append(time.perf_counter() - start)
+    seconds = float(np.sum(latencies))
+    return {"lookups": len(names), "seconds": round(seconds, 4),
+            "lookups_per_second": round(len(names) / max(seconds, 1e-9), 1),
+            "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 4),
+            "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 4)}
+
+def run_size(n_rows: int, config: Dict, args: argparse.Namespace, workdir: Path) -> List[Dict]:
+    """run every benchmark on one synthetic catalogue
+
+    Returns:
+        List: one result per benchmark
+    """
+    results = []
+    def record(benchmark: str, seconds: float, rows: int, **extra):
+        results.append({"benchmark": benchmark, "rows": rows, "seconds": round(seconds, 4),
+                        "rows_per_second": round(rows / max(seconds, 1e-9), 1), **extra})
+        logger.warning("%8i rows  %-18s %9.3f s", n_rows, benchmark, seconds)
+
+    paths = {name: str(workdir / f"{name}_{n_rows}{ext}") for name, ext in
+             [("raw", ".csv"), ("encoded", ".parquet"), ("vocab", ".json"), ("df_model", ".parquet"),
+              ("png", ".png"), ("result", ".csv"), ("model", ".joblib"), ("store", ".store"), ("db", ".db")]}
+    raw = generate_villagers(n_rows, load_dataset(args.source), args.random_state)
+    raw.to_csv(paths["raw"], index=False)
+
+    pre = config["preprocess"]
+    dropped = drop_cols(load_dataset(paths["raw"]), **pre["drop_cols"])
+    cleaned, seconds = timed(feature_engineering, dropped, **pre["feature_engineering"])
+    record("feature_engineering", seconds, n_rows)
+    (encoded, vocabulary), seconds = timed(encode_data, cleaned, **pre["encode_data"])
+    record("encode_data", seconds, n_rows)
+    save_df(encoded, paths["encoded"])
+    save_vocabulary(vocabulary, paths["vocab"])
+
+    modeling = config["modeling"]
+    sweep = {**modeling["kmodes_modeling"], "k_start": args.k[0], "k_end": args.k[1],
+             "n_init": args.n_init, "n_jobs": args.n_jobs, "search": "exhaustive"}
+    engine_options = engine_config({**modeling, "engine": args.engine})[1]
+    _, seconds = timed(kmodes_modeling, **sweep, filename=paths["encoded"], vocab_path=paths["vocab"],
+                       pngpath=paths["png"], df_model_path=paths["df_model"], result_path=paths["result"],
+                       engine=args.engine, engine_options=engine_options)
+    record("kmodes_modeling", seconds, n_rows, k=list(args.k), n_init=args.n_init, engine=args.engine)
+    final = {**modeling["form_final_model"], "n_init": args.n_init}
+    _, seconds = timed(form_final_model, **final, model_path=paths["model"], filename_model=paths["df_model"],
+                       engine=args.engine, engine_options=engine_options)
+    record("form_final_model", seconds, n_rows, k=final["final_n_cluster"], engine=args.engine)
+
+    if n_rows > args.max_rows_rec:
+        return results
+    df_model = read_table(paths["df_model"])
+    model = load_model(paths["model"], df_model)
+    rec, seconds = timed(create_rec_table, encoded, model.labels_, features=df_model.columns.tolist(),
+                         **modeling["recommendation"])
+    record("create_rec_table", seconds, n_rows, rec_rows=len(rec))
+    rec = decode_df(rec, vocabulary, suffix="_villager")
+
+    names = list(np.random.RandomState(args.random_state).choice(raw["Name"], args.lookups))
+    write_rec_store(rec, paths["store"])
+    store = RecommendationStore(paths["store"])
+    lookups = lookup_timings(lambda name: store.lookup(name, limit=10), names)
+    results.append({"benchmark": "lookup_store", "rows": n_rows, **lookups})
+
+    if n_rows > args.max_rows_ingest:
+        return results
+    engine_string = f"sqlite:///{paths['db']}"
+    create_db(engine_string)
+    animal_manager = AnimalManager(engine_string=engine_string)
+    _, seconds = timed(animal_manager.bulk_ingest_from_csv, paths["raw"])
+    animal_manager.close()
+    record("ingest_raw", seconds, n_rows)
+    rec_manager = RecommendationManager(engine_string=engine_string)
+    _, seconds = timed(rec_manager.bulk_ingest_df_rec, rec)
+    record("ingest_rec", seconds, n_rows, rec_rows=len(rec))
+    lookups = lookup_timings(lambda name: rec_manager.get_recommendations(name, 10), names)
+    results.append({"benchmark": "lookup_db", "rows": n_rows, **lookups})
+    rec_manager.close()
+    return results
+
+def compare(results: List[Dict], previous_path: str) -> None:
+    """print the ratio of every timing to the one of an earlier report"""
+    with open(previous_path, "r") as f:
+        previous = {(row["benchmark"], row["rows"]): row["seconds"] for row in json.load(f)["results"]}
+    print(f"{'benchmark':<20} {'rows':>9} {'seconds':>9} {'before':>9} {'ratio':>7}")
+    for row in results:
+        before = previous.get((row["benchmark"], row["rows"]))
+        before_text = "" if before is None else f"{before:9.3f}"
+        ratio = "" if not before else f"{row['seconds'] / before:7.2f}"
+        print(f"{row['benchmark']:<20} {row['rows']:>9} {row['seconds']:>9.3f} {before_text:>9} {ratio:>7}")
+
+def git_commit() -> str:
+    """the commit of the benchmarked code, empty outside of a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def main():
+    """run the benchmarks for every size and write the report"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="numbers of synthetic villagers.")
+    parser.add_argument("--config", default="config/model_config.yaml", help="Path to configuration file")
+    parser.add_argument("--source", default="data/raw/villagers.csv",
+                        help="the real catalogue the synthetic ones are sampled from.")
+    parser.add_argument("--engine", default="numpy", choices=ENGINES, help="the clustering engine.")
+    parser.add_argument("--k", type=int, nargs=2, default=[8, 12], help="k range of the elbow sweep.")
+    parser.add_argument("--n_init", type=int, default=1, help="restarts per k.")
+    parser.add_argument("--n_jobs", type=int, default=1, help="processes of the elbow sweep.")
+    parser.add_argument("--max_rows_rec", type=int, default=100000,
+                        help="skip the recommendations, lookups and ingestion above this number of rows.")
+    parser.add_argument("--max_rows_ingest", type=int, default=100000,
+                        help="skip the ingestion and database lookups above this number of rows.")
+    parser.add_argument("--lookups", type=int, default=1000, help="number of timed lookups.")
+    parser.add_argument("--random_state", type=int, default=42)
+    parser.add_argument("--report", default="benchmarks/report.json", help="the path of the json report.")
+    parser.add_argument("--compare", default=None, help="an earlier report to compare with.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    os.chdir(ROOT)
+
+    with open(args.config, "r") as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_rows in args.sizes:
+            results += run_size(n_rows, config, args, Path(workdir))
+
+    report = {"version": REPORT_VERSION,
+              "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+              "git_commit": git_commit(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "cpu_count": os.cpu_count(),
+              "settings": {key: value for key, value in vars(args).items() if key not in ("report", "compare")},
+              "results": results}
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.warning("The report is written to %s", args.report)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
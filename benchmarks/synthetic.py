@@ -0,0 +1,79 @@
+"""Generate synthetic villager catalogues with the schema of data/raw/villagers.csv for
+scaling tests. Every column is sampled from its distribution in the real data. Columns
+that depend on each other (e.g. the personality on the gender) are sampled together so
+the generated rows keep their combinations. Names and ids are unique.
+
+Usage:
+    python benchmarks/synthetic.py --rows 100000 --output data/external/synthetic_villagers.csv
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.preprocess import load_dataset # pylint: disable=wrong-import-position
+
+logger = logging.getLogger("synthetic")
+
+# columns sampled together, as whole combinations seen in the real data
+JOINT_COLUMNS = [["Species", "Filename"], ["Gender", "Personality"],
+                 ["Style_1", "Style_2"], ["Color_1", "Color_2"]]
+
+def generate_villagers(n_rows: int,
+                       source: pd.DataFrame,
+                       random_state: int = 42,
+                       joint_columns: Optional[List[List[str]]] = None) -> pd.DataFrame:
+    """sample a synthetic catalogue from the distributions of a real one
+
+    Args:
+        n_rows (int): number of villagers
+        source (pd.DataFrame): the real catalogue
+        random_state (int): seed of the sampling
+        joint_columns (List): groups of columns sampled together. Defaults to JOINT_COLUMNS.
+
+    Returns:
+        pd.DataFrame: the synthetic catalogue, with the columns of source
+    """
+    rng = np.random.RandomState(random_state)
+    groups = JOINT_COLUMNS if joint_columns is None else joint_columns
+    grouped = {col for group in groups for col in group}
+    groups = [[col for col in group if col in source.columns] for group in groups]
+    groups += [[col] for col in source.columns if col not in grouped]
+
+    columns = {}
+    for group in groups:
+        if not group:
+            continue
+        # drawing source rows keeps the frequency of every combination of the group
+        rows = rng.randint(0, len(source), size=n_rows)
+        for col in group:
+            columns[col] = source[col].to_numpy()[rows]
+    synthetic = pd.DataFrame(columns)[source.columns.tolist()]
+    if "Name" in synthetic.columns:
+        synthetic["Name"] = [f"Villager {i}" for i in range(n_rows)]
+    if "Unique_Entry_ID" in synthetic.columns:
+        synthetic["Unique_Entry_ID"] = [f"SYN{i:014d}" for i in range(n_rows)]
+    return synthetic
+
+def main():
+    """write a synthetic catalogue to a csv"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", type=int, default=100000, help="number of villagers.")
+    parser.add_argument("--source", default="data/raw/villagers.csv", help="the real catalogue.")
+    parser.add_argument("--output", default="data/external/synthetic_villagers.csv",
+                        help="the path of the synthetic catalogue.")
+    parser.add_argument("--random_state", type=int, default=42)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    synthetic = generate_villagers(args.rows, load_dataset(args.source), args.random_state)
+    synthetic.to_csv(args.output, index=False)
+    logger.info("%i synthetic villagers are written to %s", len(synthetic), args.output)
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,12 @@ SQLALCHEMY_TRACK_MODIFICATIONS = True
 HOST = "0.0.0.0"
 SQLALCHEMY_ECHO = False  # If true, SQL for queries made will be printed
 MAX_ROWS_SHOW = 10
+API_MAX_NAMES = 100  # Maximum number of villagers per request of /api/recommendations
+REC_CACHE_SIZE = 1024  # Number of villagers kept in the in-process recommendation cache
+REC_CACHE_VERSION_TTL = 30  # Seconds between checks of the recommendation table version stamp
+REC_BACKEND = os.environ.get('REC_BACKEND', 'database')  # 'database' or 'mmap' (no database round trips)
+REC_STORE_PATH = "data/final/recommendation.store"  # Written by the recommendation stage, used by the mmap backend
+SIMILARITY_INDEX_PATH = "models/similarity_index.joblib"  # Built by `python run.py similarity_index`
 
 DB_HOST = os.environ.get('MYSQL_HOST')
 DB_PORT = os.environ.get('MYSQL_PORT')
@@ -16,6 +22,14 @@ DB_PW = os.environ.get('MYSQL_PASSWORD')
 DATABASE = os.environ.get('MYSQL_DATABASE')
 DB_DIALECT = 'mysql+pymysql'
 
+# Connection pool of the app; SQLite only uses the pre-ping and recycle settings
+DB_POOL_SIZE = 5  # Connections kept open
+DB_MAX_OVERFLOW = 10  # Extra connections opened under load
+DB_POOL_PRE_PING = True  # Test connections before use, replacing the ones the server closed
+DB_POOL_RECYCLE = 1800  # Seconds before a connection is replaced, below the server idle timeout
+DB_RETRIES = 3  # Retries of a lookup after a lost connection
+DB_RETRY_BACKOFF = 0.1  # Seconds before the first retry, doubled for every next one
+
 SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI')
 if SQLALCHEMY_DATABASE_URI is not None:
     pass
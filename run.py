@@ -1,12 +1,24 @@
 """Configures the subparsers for receiving command line arguments for each
  stage in the model pipeline and orchestrates their execution."""
 import argparse
+import atexit
 import logging.config
+import sys
 import yaml
-from src.animal_manager import AnimalManager, RecommendationManager, create_db
+from src import instrumentation
+from src.animal_manager import AnimalManager, RecommendationManager, create_db, migrate_db
 from src.modeling import form_final_model, get_metric, kmodes_modeling, recommendation
 from src.s3 import upload_file_to_s3, download_file_from_s3
-from src.preprocess import drop_cols, load_dataset, feature_engineering, save_df
+from src.artifact_store import ArtifactStore, backend_from_uri
+from src.artifacts import artifact_path, stage_options
+from src.encoding import save_vocabulary
+from src.pipeline import STAGES, run_pipeline
+from src.stage_cache import StageCache
+from src.kmodes_engine import engine_config
+from src.incremental import add_villagers
+from src.similarity import SimilarityIndex, build_similarity_index
+from src.preprocess import drop_cols, load_dataset, feature_engineering, encode_data, save_df, \
+    preprocess_stream
 from config.flaskconfig import SQLALCHEMY_DATABASE_URI
 
 # add logging configuration
@@ -17,6 +29,10 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
         description="The main parser for the animal crossing recommender")
+    parser.add_argument("--profile", default=None,
+                        help="write the time, CPU time, memory and rows of every stage to this json report.")
+    parser.add_argument("--profile_memory", default="rss", choices=instrumentation.MEMORY_MODES,
+                        help="peak process memory (rss) or exact per stage allocations (tracemalloc, slower).")
 
     subparsers = parser.add_subparsers(dest="subparser_name")
 
@@ -36,6 +52,17 @@ if __name__ == "__main__":
     sp_download.add_argument("--local_path", default="data/raw/villagers.csv",
                            help="local path to the data")
 
+    # Sub-parsers for syncing the stage outputs with the artifact store
+    for name, help_text in [("push_artifacts", "Upload the changed stage outputs to the artifact store"),
+                            ("pull_artifacts", "Download the changed stage outputs from the artifact store")]:
+        sp_artifacts = subparsers.add_parser(name, help=help_text)
+        sp_artifacts.add_argument("--config", default="config/model_config.yaml",
+                                  help="Path to configuration file")
+        sp_artifacts.add_argument("--uri", default=None,
+                                  help="s3://bucket/prefix or directory of the store, instead of the configured one.")
+        sp_artifacts.add_argument("--paths", nargs="+", default=None,
+                                  help="files or directories to sync, instead of the configured ones.")
+
     # Sub-parser for preprocess the data
     sp_preprocess = subparsers.add_parser("preprocess", help="preprocess the raw data for modeling")
     sp_preprocess.add_argument("--config",
@@ -43,42 +70,91 @@ if __name__ == "__main__":
                                help="Path to configuration file")
     sp_preprocess.add_argument("--raw_path", default="data/raw/villagers.csv",
                                help="the input path of the raw data.")
-    sp_preprocess.add_argument("--clean_path", default="data/interim/clean.csv",
+    sp_preprocess.add_argument("--clean_path", default="data/interim/clean.parquet",
                                help="the output path for the cleaned data.")
+    sp_preprocess.add_argument("--encoded_path", default="data/interim/encoded.parquet",
+                               help="the output path for the integer coded data.")
+    sp_preprocess.add_argument("--vocab_path", default="data/interim/vocabulary.json",
+                               help="the output path for the vocabulary of the codes.")
+    sp_preprocess.add_argument("--force", action="store_true",
+                               help="run the stage even if its outputs are in the stage cache.")
+    sp_preprocess.add_argument("--chunksize", type=int, default=None,
+                               help="stream the raw data in chunks of this many rows, for data that does "
+                                    "not fit in memory. The outputs are the same as without.")
 
     # Sub-parser for training
     sp_train = subparsers.add_parser("train", help="train the model")
-    sp_train.add_argument("--clean_path", default="data/interim/clean.csv",
-                          help="the input path for the cleaned data.")
+    sp_train.add_argument("--encoded_path", default="data/interim/encoded.parquet",
+                          help="the input path for the integer coded data.")
+    sp_train.add_argument("--vocab_path", default="data/interim/vocabulary.json",
+                          help="the input path for the vocabulary of the codes.")
     sp_train.add_argument("--png_path", default="figures/cost_plot_kmodes.png",
                           help="the output path for the cost plot.")
     sp_train.add_argument("--result_path", default="deliverables/kmodes_result.csv",
                           help="the output path for the kmode results.")
-    sp_train.add_argument("--df_model_path", default="data/interim/for_model.csv",
+    sp_train.add_argument("--df_model_path", default="data/interim/for_model.parquet",
                           help="the output path for the csv for model uses.")
     sp_train.add_argument("--model_path", default="models/kmodes.joblib",
                           help="the output path for the final model.")
     sp_train.add_argument("--config",
                           default="config/model_config.yaml",
                           help="Path to configuration file")
+    sp_train.add_argument("--workers", type=int, default=None,
+                          help="number of processes for the elbow sweep (overrides n_jobs in the config).")
+    sp_train.add_argument("--force", action="store_true",
+                          help="run the stage even if its outputs are in the stage cache.")
 
     # Sub-parser for generating the recommendation result
     sp_recommendation = subparsers.add_parser("recommendation", help="generate the recommendation result")
-    sp_recommendation.add_argument("--df_model_path", default="data/interim/for_model.csv",
+    sp_recommendation.add_argument("--df_model_path", default="data/interim/for_model.parquet",
                           help="the input path for the data used for modeling.")
-    sp_recommendation.add_argument("--clean_path", default="data/interim/clean.csv",
-                          help="the input path for the cleaned data.")
+    sp_recommendation.add_argument("--encoded_path", default="data/interim/encoded.parquet",
+                          help="the input path for the integer coded data.")
+    sp_recommendation.add_argument("--vocab_path", default="data/interim/vocabulary.json",
+                          help="the input path for the vocabulary of the codes.")
     sp_recommendation.add_argument("--model_path", default="models/kmodes.joblib",
                           help="the input path for the final model.")
-    sp_recommendation.add_argument("--rec_path", default="data/final/recommendation.csv",
+    sp_recommendation.add_argument("--rec_path", default="data/final/recommendation.arrow",
                           help="the output path for the recommendation.")
+    sp_recommendation.add_argument("--store_path", default="data/final/recommendation.store",
+                          help="the output path for the memory-mapped recommendation store of the app.")
     sp_recommendation.add_argument("--config",
                         default="config/model_config.yaml",
                         help="Path to configuration file")
+    sp_recommendation.add_argument("--force", action="store_true",
+                        help="run the stage even if its outputs are in the stage cache.")
+
+    # Sub-parser for building the similarity index
+    sp_index = subparsers.add_parser("similarity_index",
+                                     help="build the index of the most similar villagers")
+    sp_index.add_argument("--df_model_path", default="data/interim/for_model.parquet",
+                          help="the input path for the data used for modeling.")
+    sp_index.add_argument("--encoded_path", default="data/interim/encoded.parquet",
+                          help="the input path for the integer coded data.")
+    sp_index.add_argument("--vocab_path", default="data/interim/vocabulary.json",
+                          help="the input path for the vocabulary of the codes.")
+    sp_index.add_argument("--model_path", default="models/kmodes.joblib",
+                          help="the input path for the final model.")
+    sp_index.add_argument("--index_path", default="models/similarity_index.joblib",
+                          help="the output path for the similarity index.")
+    sp_index.add_argument("--config",
+                          default="config/model_config.yaml",
+                          help="Path to configuration file")
+    sp_index.add_argument("--force", action="store_true",
+                          help="run the stage even if its outputs are in the stage cache.")
+
+    # Sub-parser for querying the similarity index
+    sp_similar = subparsers.add_parser("similar", help="print the villagers most similar to a villager")
+    sp_similar.add_argument("name", help="the villager name")
+    sp_similar.add_argument("--k", type=int, default=10, help="number of villagers to print.")
+    sp_similar.add_argument("--same_cluster", action="store_true",
+                            help="only print villagers from the same cluster.")
+    sp_similar.add_argument("--index_path", default="models/similarity_index.joblib",
+                            help="the path of the similarity index.")
 
     # Sub-parser for generating the metric
     sp_get_metric = subparsers.add_parser("get_metric", help="generate the recommendation result")
-    sp_get_metric.add_argument("--df_model_path", default="data/interim/for_model.csv",
+    sp_get_metric.add_argument("--df_model_path", default="data/interim/for_model.parquet",
                           help="the input path for the data used for modeling.")
     sp_get_metric.add_argument("--model_path", default="models/kmodes.joblib",
                           help="the input path for the final model.")
@@ -87,6 +163,55 @@ if __name__ == "__main__":
     sp_get_metric.add_argument("--config",
                         default="config/model_config.yaml",
                         help="Path to configuration file")
+    sp_get_metric.add_argument("--force", action="store_true",
+                        help="run the stage even if its outputs are in the stage cache.")
+
+    # Sub-parser for running several stages in one process
+    sp_pipeline = subparsers.add_parser("pipeline",
+                                        help="run a range of stages in one process, keeping the data in memory")
+    sp_pipeline.add_argument("--config",
+                             default="config/model_config.yaml",
+                             help="Path to configuration file")
+    sp_pipeline.add_argument("--start", default="preprocess", choices=STAGES,
+                             help="the first stage to run.")
+    sp_pipeline.add_argument("--end", default="get_metric", choices=STAGES,
+                             help="the last stage to run.")
+    sp_pipeline.add_argument("--save_artifacts", action="store_true",
+                             help="also write the tables, the model, the recommendation store and the "
+                                  "similarity index; without it only the plot and the deliverables are written.")
+    sp_pipeline.add_argument("--workers", type=int, default=None,
+                             help="number of processes for the elbow sweep (overrides n_jobs in the config).")
+    sp_pipeline.add_argument("--engine_string", default=SQLALCHEMY_DATABASE_URI,
+                             help="SQLAlchemy connection URI for database (ingest_rec stage)")
+    sp_pipeline.add_argument("--chunksize", type=int, default=10000,
+                             help="number of rows per insert in the ingest_rec stage; replace commits once after "
+                                  "the last chunk, upsert commits every chunk.")
+    sp_pipeline.add_argument("--mode", default="replace", choices=["replace", "upsert"],
+                             help="replace the table or upsert into it in the ingest_rec stage.")
+    sp_pipeline.add_argument("--raw_path", default="data/raw/villagers.csv",
+                             help="the input path of the raw data.")
+    sp_pipeline.add_argument("--clean_path", default="data/interim/clean.parquet",
+                             help="the path for the cleaned data.")
+    sp_pipeline.add_argument("--encoded_path", default="data/interim/encoded.parquet",
+                             help="the path for the integer coded data.")
+    sp_pipeline.add_argument("--vocab_path", default="data/interim/vocabulary.json",
+                             help="the path for the vocabulary of the codes.")
+    sp_pipeline.add_argument("--df_model_path", default="data/interim/for_model.parquet",
+                             help="the path for the data used for modeling.")
+    sp_pipeline.add_argument("--png_path", default="figures/cost_plot_kmodes.png",
+                             help="the output path for the cost plot.")
+    sp_pipeline.add_argument("--result_path", default="deliverables/kmodes_result.csv",
+                             help="the output path for the kmode results.")
+    sp_pipeline.add_argument("--model_path", default="models/kmodes.joblib",
+                             help="the path for the final model.")
+    sp_pipeline.add_argument("--rec_path", default="data/final/recommendation.arrow",
+                             help="the path for the recommendation.")
+    sp_pipeline.add_argument("--store_path", default="data/final/recommendation.store",
+                             help="the output path for the memory-mapped recommendation store of the app.")
+    sp_pipeline.add_argument("--index_path", default="models/similarity_index.joblib",
+                             help="the output path for the similarity index.")
+    sp_pipeline.add_argument("--metric_path", default="deliverables/metric.csv",
+                             help="the output path for the metric.")
 
     # Sub-parser for creating a database
     sp_create = subparsers.add_parser("create_db",
@@ -94,6 +219,12 @@ if __name__ == "__main__":
     sp_create.add_argument("--engine_string", default=SQLALCHEMY_DATABASE_URI,
                            help="SQLAlchemy connection URI for database")
 
+    # Sub-parser for migrating an existing database to the current schema
+    sp_migrate = subparsers.add_parser("migrate_db",
+                                       description="Add the missing tables, columns and indexes to a database")
+    sp_migrate.add_argument("--engine_string", default=SQLALCHEMY_DATABASE_URI,
+                            help="SQLAlchemy connection URI for database")
+
     # Sub-parser for ingesting raw data
     sp_ingest_raw = subparsers.add_parser("ingest_raw",
                                       description="Add raw data to database")
@@ -101,6 +232,44 @@ if __name__ == "__main__":
                            default=SQLALCHEMY_DATABASE_URI,
                            help="SQLAlchemy connection URI for database")
     sp_ingest_raw.add_argument("--input_path", default="data/raw/villagers.csv", help="Raw datt ingestion.")
+    sp_ingest_raw.add_argument("--bulk", action="store_true",
+                               help="stream the csv in chunks with executemany inserts.")
+    sp_ingest_raw.add_argument("--chunksize", type=int, default=10000,
+                               help="number of rows per insert in bulk mode. Replace commits the table once after "
+                                    "the last chunk, upsert commits every chunk.")
+    sp_ingest_raw.add_argument("--mode", default="replace", choices=["replace", "upsert"],
+                               help="replace the table in one transaction, or upsert into it chunk by chunk, in bulk mode.")
+
+    # sub-parser for adding new villagers without retraining
+    sp_add = subparsers.add_parser("add_villagers",
+                                   help="assign the new villagers of the raw data to the existing clusters "
+                                        "and update only the recommendations that change")
+    sp_add.add_argument("--config", default="config/model_config.yaml",
+                        help="Path to configuration file")
+    sp_add.add_argument("--raw_path", default="data/raw/villagers.csv",
+                        help="the raw data with the new villagers.")
+    sp_add.add_argument("--clean_path", default="data/interim/clean.parquet",
+                        help="the path of the cleaned data.")
+    sp_add.add_argument("--encoded_path", default="data/interim/encoded.parquet",
+                        help="the path of the integer coded data.")
+    sp_add.add_argument("--vocab_path", default="data/interim/vocabulary.json",
+                        help="the path of the vocabulary of the codes.")
+    sp_add.add_argument("--df_model_path", default="data/interim/for_model.parquet",
+                        help="the path of the data used for modeling.")
+    sp_add.add_argument("--model_path", default="models/kmodes.joblib",
+                        help="the path of the final model.")
+    sp_add.add_argument("--rec_path", default="data/final/recommendation.arrow",
+                        help="the path of the recommendation.")
+    sp_add.add_argument("--store_path", default="data/final/recommendation.store",
+                        help="the path of the memory-mapped recommendation store of the app.")
+    sp_add.add_argument("--index_path", default="models/similarity_index.joblib",
+                        help="the path of the similarity index, rebuilt with the new villagers.")
+    sp_add.add_argument("--engine_string", default=SQLALCHEMY_DATABASE_URI,
+                        help="SQLAlchemy connection URI for database")
+    sp_add.add_argument("--skip_ingest", action="store_true",
+                        help="only update the files, not the recommendations table.")
+    sp_add.add_argument("--chunksize", type=int, default=10000,
+                        help="number of rows per insert.")
 
     # sub-parser for ingesting recommendation data
     sp_ingest_rec = subparsers.add_parser("ingest_rec",
@@ -108,69 +277,265 @@ if __name__ == "__main__":
     sp_ingest_rec.add_argument("--engine_string",
                                default=SQLALCHEMY_DATABASE_URI,
                                help="SQLAlchemy connection URI for database")
-    sp_ingest_rec.add_argument("--input_path", default="data/final/recommendation.csv",
+    sp_ingest_rec.add_argument("--input_path", default="data/final/recommendation.arrow",
                                help="Recommendation table ingestion.")
+    sp_ingest_rec.add_argument("--config",
+                               default="config/model_config.yaml",
+                               help="Path to configuration file (for the format of the recommendation table)")
+    sp_ingest_rec.add_argument("--bulk", action="store_true",
+                               help="stream the csv in chunks with executemany inserts.")
+    sp_ingest_rec.add_argument("--chunksize", type=int, default=10000,
+                               help="number of rows per insert in bulk mode. Replace commits the table once after "
+                                    "the last chunk, upsert commits every chunk.")
+    sp_ingest_rec.add_argument("--mode", default="replace", choices=["replace", "upsert"],
+                               help="replace the table in one transaction, or upsert into it chunk by chunk, in bulk mode.")
 
     args = parser.parse_args()
     sp_used = args.subparser_name
 
+    if args.profile:
+        instrumentation.enable(memory=args.profile_memory)
+        # registered at exit so that the report is also written when a stage exits early
+        atexit.register(instrumentation.write_report, args.profile, command=sp_used, argv=sys.argv[1:])
+
     if sp_used == "upload_file_to_s3":
         upload_file_to_s3(args.local_path, args.s3_path)
 
     elif sp_used == "download_file_from_s3":
         download_file_from_s3(args.local_path, args.s3_path)
 
+    elif sp_used in ("push_artifacts", "pull_artifacts"):
+        with open(args.config, "r") as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+            logger.info("Configuration file loaded from %s", args.config)
+        store_config = config["artifact_store"]
+        store = ArtifactStore(backend_from_uri(args.uri or store_config["uri"]),
+                              cache_dir=store_config["cache_dir"],
+                              max_workers=store_config["max_workers"],
+                              max_size_mb=store_config["max_size_mb"])
+        if sp_used == "push_artifacts":
+            store.push(args.paths or store_config["paths"])
+        else:
+            store.pull(args.paths or store_config["paths"])
+
     elif sp_used == "preprocess":
         with open(args.config, "r") as f:
             config = yaml.load(f, Loader=yaml.FullLoader)
             logger.info("Configuration file loaded from %s", args.config)
-        data = load_dataset(filename=args.raw_path)
-        data_dropped = drop_cols(data, **config["preprocess"]["drop_cols"])
-        data_cleaned = feature_engineering(data_dropped, **config["preprocess"]["feature_engineering"])
-        save_df(data_cleaned, output_path=args.clean_path)
+        pre_format, pre_options = stage_options(config, "preprocess")
+        stage_cache = StageCache(**config.get("stage_cache", {}))
+        outputs = [artifact_path(args.clean_path, pre_format),
+                   artifact_path(args.encoded_path, pre_format),
+                   args.vocab_path]
+        key = stage_cache.key("preprocess", [args.raw_path],
+                              {"preprocess": config["preprocess"],
+                               "artifacts": [pre_format, pre_options]},
+                              config_path=args.config)
+        if args.force or not stage_cache.restore(key, outputs):
+            if args.chunksize:
+                vocabulary = preprocess_stream(args.raw_path, outputs[0], outputs[1],
+                                               features=config["preprocess"]["drop_cols"]["features"],
+                                               chunksize=args.chunksize,
+                                               **config["preprocess"]["encode_data"],
+                                               **config["preprocess"]["feature_engineering"],
+                                               **pre_options)
+            else:
+                data = load_dataset(filename=args.raw_path)
+                data_dropped = drop_cols(data, **config["preprocess"]["drop_cols"])
+                data_cleaned = feature_engineering(data_dropped, **config["preprocess"]["feature_engineering"])
+                save_df(data_cleaned, output_path=outputs[0], **pre_options)
+                data_encoded, vocabulary = encode_data(data_cleaned, **config["preprocess"]["encode_data"])
+                save_df(data_encoded, output_path=outputs[1], **pre_options)
+            save_vocabulary(vocabulary, output_path=args.vocab_path)
+            stage_cache.store(key, "preprocess", outputs)
 
     elif sp_used == "train":
         with open(args.config, "r") as f:
             config = yaml.load(f, Loader=yaml.FullLoader)
             logger.info("Configuration file loaded from %s", args.config)
-        kmodes_modeling(**config["modeling"]["kmodes_modeling"],
-                        filename=args.clean_path,
-                        pngpath=args.png_path,
-                        df_model_path=args.df_model_path,
-                        result_path = args.result_path
-                        )
-        form_final_model(**config["modeling"]["form_final_model"],
-                         model_path=args.model_path)
+        if args.workers is not None:
+            config["modeling"]["kmodes_modeling"]["n_jobs"] = args.workers
+        pre_format, _ = stage_options(config, "preprocess")
+        train_format, train_options = stage_options(config, "train")
+        stage_cache = StageCache(**config.get("stage_cache", {}))
+        engine, engine_options = engine_config(config["modeling"])
+        outputs = [args.png_path, args.result_path,
+                   artifact_path(args.df_model_path, train_format), args.model_path]
+        # the number of workers does not change the fitted model
+        sweep_config = {name: value for name, value in config["modeling"]["kmodes_modeling"].items()
+                        if name != "n_jobs"}
+        key = stage_cache.key("train",
+                              [artifact_path(args.encoded_path, pre_format), args.vocab_path],
+                              {"engine": [engine, engine_options],
+                               "kmodes_modeling": sweep_config,
+                               "form_final_model": config["modeling"]["form_final_model"],
+                               "artifacts": [train_format, train_options]},
+                              config_path=args.config)
+        if args.force or not stage_cache.restore(key, outputs):
+            kmodes_modeling(**config["modeling"]["kmodes_modeling"],
+                            filename=artifact_path(args.encoded_path, pre_format),
+                            vocab_path=args.vocab_path,
+                            pngpath=args.png_path,
+                            df_model_path=artifact_path(args.df_model_path, train_format),
+                            result_path = args.result_path,
+                            artifact_options=train_options,
+                            engine=engine,
+                            engine_options=engine_options
+                            )
+            form_final_model(**config["modeling"]["form_final_model"],
+                             model_path=args.model_path,
+                             filename_model=artifact_path(args.df_model_path, train_format),
+                             engine=engine,
+                             engine_options=engine_options)
+            stage_cache.store(key, "train", outputs)
 
     elif sp_used == "recommendation":
         with open(args.config, "r") as f:
             config = yaml.load(f, Loader=yaml.FullLoader)
             logger.info("Configuration file loaded from %s", args.config)
-        recommendation(**config["modeling"]["recommendation"],
-                       filename_model=args.df_model_path,
-                       filename_clean=args.clean_path,
-                       model_path=args.model_path,
-                       recommendation_path=args.rec_path)
+        pre_format, _ = stage_options(config, "preprocess")
+        train_format, _ = stage_options(config, "train")
+        rec_format, rec_options = stage_options(config, "recommendation")
+        stage_cache = StageCache(**config.get("stage_cache", {}))
+        engine, engine_options = engine_config(config["modeling"])
+        inputs = [artifact_path(args.df_model_path, train_format),
+                  artifact_path(args.encoded_path, pre_format),
+                  args.vocab_path, args.model_path]
+        outputs = [artifact_path(args.rec_path, rec_format), args.store_path]
+        key = stage_cache.key("recommendation", inputs,
+                              {"recommendation": config["modeling"]["recommendation"],
+                               "artifacts": [rec_format, rec_options]},
+                              config_path=args.config)
+        if args.force or not stage_cache.restore(key, outputs):
+            recommendation(**config["modeling"]["recommendation"],
+                           filename_model=inputs[0],
+                           filename_encoded=inputs[1],
+                           vocab_path=args.vocab_path,
+                           model_path=args.model_path,
+                           recommendation_path=outputs[0],
+                           artifact_options=rec_options,
+                           store_path=args.store_path,
+                           engine=engine,
+                           engine_options=engine_options)
+            stage_cache.store(key, "recommendation", outputs)
+    elif sp_used == "similarity_index":
+        with open(args.config, "r") as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+            logger.info("Configuration file loaded from %s", args.config)
+        pre_format, _ = stage_options(config, "preprocess")
+        train_format, _ = stage_options(config, "train")
+        stage_cache = StageCache(**config.get("stage_cache", {}))
+        inputs = [artifact_path(args.df_model_path, train_format),
+                  artifact_path(args.encoded_path, pre_format),
+                  args.vocab_path, args.model_path]
+        key = stage_cache.key("similarity_index", inputs, {"similarity": config["modeling"]["similarity"]},
+                              config_path=args.config)
+        if args.force or not stage_cache.restore(key, [args.index_path]):
+            build_similarity_index(**config["modeling"]["similarity"],
+                                   filename_model=inputs[0],
+                                   filename_encoded=inputs[1],
+                                   vocab_path=args.vocab_path,
+                                   model_path=args.model_path,
+                                   index_path=args.index_path)
+            stage_cache.store(key, "similarity_index", [args.index_path])
+
+    elif sp_used == "similar":
+        index = SimilarityIndex.load(args.index_path)
+        for rank, row in enumerate(index.query(args.name, k=args.k, same_cluster=args.same_cluster), 1):
+            print(f"{rank:>3} {row['Name']:<20} cluster {row['Cluster']:<3} "
+                  f"{row['Similarity']}/{len(index.features)} attributes")
+
     elif sp_used =="get_metric":
         with open(args.config, "r") as f:
             config = yaml.load(f, Loader=yaml.FullLoader)
             logger.info("Configuration file loaded from %s", args.config)
-        get_metric(**config["modeling"]["get_metric"],
-                       filename_model=args.df_model_path,
-                       model_path=args.model_path,
-                       metric_path=args.metric_path)
+        train_format, _ = stage_options(config, "train")
+        stage_cache = StageCache(**config.get("stage_cache", {}))
+        engine, engine_options = engine_config(config["modeling"])
+        inputs = [artifact_path(args.df_model_path, train_format), args.model_path]
+        key = stage_cache.key("get_metric", inputs, {"get_metric": config["modeling"]["get_metric"]},
+                              config_path=args.config)
+        if args.force or not stage_cache.restore(key, [args.metric_path]):
+            get_metric(**config["modeling"]["get_metric"],
+                           filename_model=inputs[0],
+                           model_path=args.model_path,
+                           metric_path=args.metric_path,
+                           engine=engine,
+                           engine_options=engine_options)
+            stage_cache.store(key, "get_metric", [args.metric_path])
+
+    elif sp_used == "pipeline":
+        with open(args.config, "r") as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+            logger.info("Configuration file loaded from %s", args.config)
+        if args.workers is not None:
+            config["modeling"]["kmodes_modeling"]["n_jobs"] = args.workers
+        pre_format, _ = stage_options(config, "preprocess")
+        train_format, _ = stage_options(config, "train")
+        rec_format, _ = stage_options(config, "recommendation")
+        paths = {"raw": args.raw_path,
+                 "clean": artifact_path(args.clean_path, pre_format),
+                 "encoded": artifact_path(args.encoded_path, pre_format),
+                 "vocab": args.vocab_path,
+                 "df_model": artifact_path(args.df_model_path, train_format),
+                 "png": args.png_path,
+                 "result": args.result_path,
+                 "model": args.model_path,
+                 "rec": artifact_path(args.rec_path, rec_format),
+                 "store": args.store_path,
+                 "index": args.index_path,
+                 "metric": args.metric_path}
+        run_pipeline(config, paths, start=args.start, end=args.end,
+                     save_artifacts=args.save_artifacts,
+                     engine_string=args.engine_string,
+                     chunksize=args.chunksize,
+                     mode=args.mode)
+
+    elif sp_used == "add_villagers":
+        with open(args.config, "r") as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+            logger.info("Configuration file loaded from %s", args.config)
+        pre_format, _ = stage_options(config, "preprocess")
+        train_format, _ = stage_options(config, "train")
+        rec_format, _ = stage_options(config, "recommendation")
+        paths = {"raw": args.raw_path,
+                 "clean": artifact_path(args.clean_path, pre_format),
+                 "encoded": artifact_path(args.encoded_path, pre_format),
+                 "vocab": args.vocab_path,
+                 "df_model": artifact_path(args.df_model_path, train_format),
+                 "model": args.model_path,
+                 "rec": artifact_path(args.rec_path, rec_format),
+                 "store": args.store_path,
+                 "index": args.index_path}
+        add_villagers(config, paths,
+                      engine_string=None if args.skip_ingest else args.engine_string,
+                      chunksize=args.chunksize)
 
     elif sp_used == "create_db":
         create_db(args.engine_string)
 
+    elif sp_used == "migrate_db":
+        migrate_db(args.engine_string)
+
     elif sp_used == "ingest_raw":
         am = AnimalManager(engine_string=args.engine_string)
-        am.ingest_from_csv(input_path=args.input_path)
+        if args.bulk:
+            am.bulk_ingest_from_csv(input_path=args.input_path, chunksize=args.chunksize, mode=args.mode)
+        else:
+            am.ingest_from_csv(input_path=args.input_path)
         am.close()
 
     elif sp_used == "ingest_rec":
+        with open(args.config, "r") as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+            logger.info("Configuration file loaded from %s", args.config)
+        rec_format, _ = stage_options(config, "recommendation")
+        input_path = artifact_path(args.input_path, rec_format)
         am = RecommendationManager(engine_string=args.engine_string)
-        am.ingest_from_csv_rec(input_path=args.input_path)
+        if args.bulk:
+            am.bulk_ingest_from_csv_rec(input_path=input_path, chunksize=args.chunksize, mode=args.mode)
+        else:
+            am.ingest_from_csv_rec(input_path=input_path)
         am.close()
     else:
         parser.print_help()
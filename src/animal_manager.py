@@ -2,15 +2,25 @@
  songs for the PennyLane app to query from and display results to the user."""
 # mypy: plugins = sqlmypy, plugins = flasksqlamypy
 
+import asyncio
 import logging
+import time
 import typing
+import uuid
 
 import pandas as pd
 import flask
 import sqlalchemy
+import sqlalchemy.dialects.mysql
+import sqlalchemy.dialects.postgresql
+import sqlalchemy.dialects.sqlite
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from flask_sqlalchemy import SQLAlchemy
 
+from src.artifacts import iter_table, read_table
+from src.instrumentation import instrumented
+
 logger = logging.getLogger(__name__)
 
 Base = declarative_base()
@@ -45,6 +55,8 @@ class Recommendations(Base):
     """Creates a data model for the database to be set up for capturing villagers."""
 
     __tablename__ = "recommendations"
+    # the app looks up the top ranked recommendations of one villager at a time
+    __table_args__ = (sqlalchemy.Index("ix_recommendations_name_villager_rank", "Name_villager", "Rank"),)
     Name_villager = sqlalchemy.Column(sqlalchemy.String(100), unique=False, nullable=False)
     Name = sqlalchemy.Column(sqlalchemy.String(100), unique=False, nullable=False)
     Species = sqlalchemy.Column(sqlalchemy.String(100), unique=False, nullable=False)
@@ -56,11 +68,278 @@ class Recommendations(Base):
     Style_2 = sqlalchemy.Column(sqlalchemy.String(100), unique=False, nullable=False)
     Color_1 = sqlalchemy.Column(sqlalchemy.String(100), unique=False, nullable=False)
     Color_2 = sqlalchemy.Column(sqlalchemy.String(100), unique=False, nullable=False)
+    Rank = sqlalchemy.Column(sqlalchemy.Integer, unique=False, nullable=False)
     Unique_id = sqlalchemy.Column(sqlalchemy.String(100), primary_key=True)
 
     def __repr__(self):
         return "<Animal Name %r>" % self.Name
 
+    def to_dict(self) -> typing.Dict:
+        """Detach the row values from the session, e.g. for caching."""
+        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
+
+class RecommendationVersion(Base):
+    """Creates a data model for the version stamp of the recommendations table.
+    The stamp is rewritten on every ingestion of the recommendations."""
+
+    __tablename__ = "recommendation_version"
+    Id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    Version = sqlalchemy.Column(sqlalchemy.String(100), unique=False, nullable=False)
+
+    def __repr__(self):
+        return "<Recommendation Version %r>" % self.Version
+
+# the settings of config/flaskconfig.py -> the arguments of the connection pool
+POOL_CONFIG = {"DB_POOL_SIZE": "pool_size", "DB_MAX_OVERFLOW": "max_overflow",
+               "DB_POOL_PRE_PING": "pool_pre_ping", "DB_POOL_RECYCLE": "pool_recycle"}
+
+def pool_options(config: typing.Dict) -> typing.Dict:
+    """the arguments of engine_options set in a configuration (e.g. the Flask config)
+
+    Args:
+        config (Dict): the configuration with the keys of POOL_CONFIG
+
+    Returns:
+        Dict: the pool arguments
+    """
+    return {argument: config[key] for key, argument in POOL_CONFIG.items() if key in config}
+
+def engine_options(engine_string: str,
+                   pool_size: int = 5,
+                   max_overflow: int = 10,
+                   pool_pre_ping: bool = True,
+                   pool_recycle: int = 1800) -> typing.Dict:
+    """keyword arguments of create_engine for the connection pool
+
+    Args:
+        engine_string (str): SQLAlchemy connection URI
+        pool_size (int): number of connections kept open
+        max_overflow (int): number of connections opened above pool_size under load
+        pool_pre_ping (bool): test a connection before handing it out, and replace it if
+            the server closed it
+        pool_recycle (int): seconds after which a connection is replaced, below the idle
+            timeout of the server (wait_timeout for MySQL)
+
+    Returns:
+        Dict: the arguments; SQLite does not keep a pool of connections, so it only gets
+            the pre-ping and recycle settings
+    """
+    options = {"pool_pre_ping": pool_pre_ping, "pool_recycle": pool_recycle}
+    if sqlalchemy.engine.make_url(engine_string).get_backend_name() != "sqlite":
+        options.update(pool_size=pool_size, max_overflow=max_overflow)
+    return options
+
+def open_session(app: typing.Optional[flask.app.Flask] = None,
+                 engine_string: typing.Optional[str] = None,
+                 pool: typing.Optional[typing.Dict] = None):
+    """a session scoped to the current request (Flask app) or thread (engine string)
+
+    Args:
+        app (:obj:`flask.app.Flask`): Flask app object; the pool settings are read from
+            its config unless SQLALCHEMY_ENGINE_OPTIONS is set
+        engine_string (str): SQLAlchemy engine string, used without an app
+        pool (Dict): the arguments of engine_options, used without an app
+
+    Raises:
+        ValueError: if there is neither an app nor an engine string
+
+    Returns:
+        the Flask-SQLAlchemy database (None without an app) and the scoped session
+    """
+    if app:
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS",
+                              engine_options(app.config["SQLALCHEMY_DATABASE_URI"], **pool_options(app.config)))
+        # Flask-SQLAlchemy removes the session at the end of every request
+        database = SQLAlchemy(app)
+        return database, database.session
+    if engine_string:
+        engine = sqlalchemy.create_engine(engine_string, **engine_options(engine_string, **(pool or {})))
+        return None, sqlalchemy.orm.scoped_session(sqlalchemy.orm.sessionmaker(bind=engine))
+    raise ValueError(
+        "Need either an engine string or a Flask app to initialize")
+
+def retry_on_disconnect(session, func: typing.Callable, retries: int = 3, backoff: float = 0.1):
+    """call func, and call it again with exponential backoff if the database connection
+    was lost on the way (e.g. the server closed it or failed over)
+
+    Args:
+        session (sqlalchemy.orm.Session): the session func uses; it is rolled back after an error
+        func (Callable): the function reading from the database
+        retries (int): number of retries after the first call
+        backoff (float): seconds before the first retry, doubled for every next one
+
+    Raises:
+        sqlalchemy.exc.DBAPIError: if the error is not a lost connection or the retries are used up
+
+    Returns:
+        the result of func
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except sqlalchemy.exc.DBAPIError as e:
+            session.rollback()
+            if not e.connection_invalidated or attempt == retries:
+                raise
+            wait = backoff * 2 ** attempt
+            logger.warning("The database connection was lost, retry %i of %i in %.2f s.", attempt + 1, retries, wait)
+            time.sleep(wait)
+
+# async drivers of the database dialects, used by the async app
+ASYNC_DRIVERS = {"mysql": "aiomysql", "sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+def async_engine_url(engine_string: str) -> sqlalchemy.engine.URL:
+    """Swap the driver of an engine string for the async driver of its dialect,
+    e.g. mysql+pymysql for mysql+aiomysql
+
+    Args:
+        engine_string (str): SQLAlchemy connection URI
+
+    Raises:
+        ValueError: if there is no async driver for the dialect
+
+    Returns:
+        sqlalchemy.engine.URL: the URL for create_async_engine
+    """
+    url = sqlalchemy.engine.make_url(engine_string)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        logger.error("There is no async driver for the %s dialect.", backend)
+        raise ValueError(f"The {backend} dialect has no async driver, use one of {list(ASYNC_DRIVERS)}.")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+def upsert_statement(table: sqlalchemy.Table, dialect_name: str):
+    """Build an insert statement that updates the existing row on a primary key conflict
+
+    Args:
+        table (sqlalchemy.Table): the table to insert into
+        dialect_name (str): name of the database dialect, e.g. sqlite or mysql
+
+    Raises:
+        ValueError: if upserts are not supported for the dialect
+
+    Returns: the insert statement
+    """
+    update_cols = [col.name for col in table.columns if not col.primary_key]
+    if dialect_name == "mysql":
+        stmt = sqlalchemy.dialects.mysql.insert(table)
+        return stmt.on_duplicate_key_update({col: stmt.inserted[col] for col in update_cols})
+    if dialect_name in ("sqlite", "postgresql"):
+        dialect = getattr(sqlalchemy.dialects, dialect_name)
+        stmt = dialect.insert(table)
+        return stmt.on_conflict_do_update(index_elements=[col.name for col in table.primary_key.columns],
+                                          set_={col: stmt.excluded[col] for col in update_cols})
+    logger.error("Upserts are not supported for the %s dialect.", dialect_name)
+    raise ValueError(f"Upserts are not supported for the {dialect_name} dialect.")
+
+def bulk_ingest(session: sqlalchemy.orm.Session,
+                table: sqlalchemy.Table,
+                input_path: str,
+                chunksize: int = 10000,
+                mode: str = "replace") -> int:
+    """Stream a table file (csv, Parquet or Arrow IPC) into a table in chunks, with one
+    executemany insert per chunk. Replace mode commits the whole table in one transaction,
+    upsert mode commits every chunk (see ingest_chunks).
+
+    Args:
+        session (sqlalchemy.orm.Session): the database session
+        table (sqlalchemy.Table): the table to ingest into
+        input_path (str): the path of the table file
+        chunksize (int): number of rows read and inserted at once
+        mode (str): "replace" empties the table before ingesting, "upsert" updates the rows
+            that already exist and inserts the others
+
+    Raises:
+        ValueError: if the mode is not replace or upsert
+
+    Returns: number of rows ingested
+    """
+    return ingest_chunks(session, table, iter_table(input_path, chunksize=chunksize), mode)
+
+@instrumented(rows_in=None, rows_out=lambda n_rows: n_rows)
+def ingest_chunks(session: sqlalchemy.orm.Session,
+                  table: sqlalchemy.Table,
+                  chunks: typing.Iterable[pd.DataFrame],
+                  mode: str = "replace") -> int:
+    """Insert dataframe chunks into a table, with one executemany insert per chunk.
+
+    In replace mode the rows are not committed chunk by chunk: the delete and all the
+    chunks are one transaction, committed after the last chunk. A commit per chunk would
+    let readers see the emptied or half-filled table, and a failure on a later chunk would
+    leave it that way; with one transaction a failure rolls back to the old rows. The
+    database holds the uncommitted rows until the end. In upsert mode every chunk is a
+    complete state of the table, so each one is committed on its own.
+
+    Args:
+        session (sqlalchemy.orm.Session): the database session
+        table (sqlalchemy.Table): the table to ingest into
+        chunks (Iterable): the dataframes to insert
+        mode (str): "replace" empties the table before ingesting, "upsert" updates the rows
+            that already exist and inserts the others
+
+    Raises:
+        ValueError: if the mode is not replace or upsert
+
+    Returns: number of rows ingested
+    """
+    if mode not in ("replace", "upsert"):
+        logger.error("Ingestion mode %s is not supported.", mode)
+        raise ValueError("mode should be either replace or upsert.")
+
+    if mode == "replace":
+        session.execute(table.delete())
+        stmt = table.insert()
+    else:
+        stmt = upsert_statement(table, session.get_bind().dialect.name)
+
+    n_rows = 0
+    start = time.perf_counter()
+    try:
+        for chunk in chunks:
+            # NaN is not a valid value for the database driver
+            records = chunk.astype(object).where(chunk.notna(), None).to_dict(orient="records")
+            session.execute(stmt, records)
+            if mode == "upsert":
+                session.commit()
+            n_rows += len(records)
+            logger.info("%i rows ingested into %s (%.0f rows/sec)", n_rows, table.name,
+                        n_rows / max(time.perf_counter() - start, 1e-9))
+    except Exception:
+        session.rollback()
+        logger.error("The ingestion into %s failed after %i rows.", table.name, n_rows)
+        raise
+    session.commit()
+    return n_rows
+
+@instrumented(rows_out=lambda n_rows: n_rows)
+def replace_rows(session: sqlalchemy.orm.Session,
+                 table: sqlalchemy.Table,
+                 df: pd.DataFrame,
+                 key_column: str,
+                 chunksize: int = 10000) -> int:
+    """Replace all the rows whose key is in df by the rows of df, e.g. the whole
+    recommendation list of some villagers. The rows are deleted and inserted in one
+    transaction, which is committed by the caller.
+
+    Args:
+        session (sqlalchemy.orm.Session): the database session
+        table (sqlalchemy.Table): the table to update
+        df (pd.DataFrame): the new rows
+        key_column (str): the column whose values select the rows to replace
+        chunksize (int): number of rows per executemany insert
+
+    Returns: number of rows inserted
+    """
+    keys = df[key_column].unique().tolist()
+    for start in range(0, len(keys), chunksize):
+        session.execute(table.delete().where(table.c[key_column].in_(keys[start:start + chunksize])))
+    stmt = table.insert()
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        # NaN is not a valid value for the database driver
+        session.execute(stmt, chunk.astype(object).where(chunk.notna(), None).to_dict(orient="records"))
+    return len(df)
+
 class AnimalManager:
     """Creates a SQLAlchemy connection to the Apps table.
 
@@ -69,30 +348,23 @@ class AnimalManager:
             within a Flask app. Optional.
         engine_string (str): SQLAlchemy engine string specifying which database
             to write to. Follows the format
+        pool (Dict): the arguments of engine_options, used with an engine string
     """
     def __init__(self, app: typing.Optional[flask.app.Flask] = None,
-                 engine_string: typing.Optional[str] = None):
-        if app:
-            self.database = SQLAlchemy(app)
-            self.session = self.database.session
-        elif engine_string:
-            engine = sqlalchemy.create_engine(engine_string)
-            session_maker = sqlalchemy.orm.sessionmaker(bind=engine)
-            self.session = session_maker()
-        else:
-            raise ValueError(
-                "Need either an engine string or a Flask app to initialize")
+                 engine_string: typing.Optional[str] = None,
+                 pool: typing.Optional[typing.Dict] = None):
+        self.database, self.session = open_session(app, engine_string, pool)
 
     def ingest_from_csv(self, input_path: str) -> None:
         """
         Add all the data in a csv file into the database
         Args:
-            input_path: the path of the csv file
+            input_path: the path of the table file (csv, Parquet or Arrow IPC)
         Returns: None
         """
 
         session = self.session
-        data_list = pd.read_csv(input_path).to_dict(orient="records")
+        data_list = read_table(input_path).to_dict(orient="records")
 
         persist_list = []
         for data in data_list:
@@ -110,13 +382,32 @@ class AnimalManager:
         else:
             logger.info("%i records from %s were added to the table",len(persist_list), input_path)
 
+    def bulk_ingest_from_csv(self, input_path: str, chunksize: int = 10000, mode: str = "replace") -> None:
+        """
+        Stream the data in a csv file into the database in chunks
+        Args:
+            input_path: the path of the table file (csv, Parquet or Arrow IPC)
+            chunksize: number of rows per insert; replace commits once after the last chunk,
+                upsert commits every chunk
+            mode: replace or upsert the rows that already exist
+        Returns: None
+        """
+        try:
+            n_rows = bulk_ingest(self.session, Villagers.__table__, input_path, chunksize, mode)
+        except sqlalchemy.exc.OperationalError:
+            self.session.rollback()
+            logger.error("You might need to check your NU vpn connection.\n"
+                         "The original error message is: ", exc_info=True)
+        else:
+            logger.info("%i records from %s were added to the table", n_rows, input_path)
+
     def close(self) -> None:
         """Closes SQLAlchemy session
 
         Returns: None
 
         """
-        self.session.close()
+        self.session.remove()
 
 def create_db(engine_string: str) -> None:
     """Create database from provided engine string
@@ -135,6 +426,47 @@ def create_db(engine_string: str) -> None:
     else:
         logger.info("Database created.")
 
+def migrate_db(engine_string: str) -> None:
+    """Bring an existing database up to the current schema in place: create the missing
+    tables, add the Rank column to the recommendations table and create its indexes.
+    The recommendations already in the table have no ranking to fill the new column with,
+    so they get Rank 0 and have to be ingested again (ingest_rec) to be ordered.
+    Args:
+        engine_string (str): Engine string
+    Returns: None
+    """
+    engine = sqlalchemy.create_engine(engine_string)
+    table = Recommendations.__table__
+    try:
+        # only creates the tables that do not exist yet
+        Base.metadata.create_all(engine)
+        inspector = sqlalchemy.inspect(engine)
+        columns = [col["name"] for col in inspector.get_columns(table.name)]
+        indexes = [index["name"] for index in inspector.get_indexes(table.name)]
+        with engine.begin() as conn:
+            if "Rank" not in columns:
+                # RANK is a reserved word in MySQL 8, so the names are quoted
+                preparer = engine.dialect.identifier_preparer
+                conn.execute(sqlalchemy.text(f"ALTER TABLE {preparer.format_table(table)} "
+                                             f"ADD COLUMN {preparer.format_column(table.c.Rank)} "
+                                             f"INTEGER NOT NULL DEFAULT 0"))
+                logger.info("Added the Rank column to %s.", table.name)
+                n_rows = conn.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(table)).scalar()
+                if n_rows:
+                    logger.warning("The %i rows of %s have no rank yet (Rank 0). Ingest the recommendations "
+                                   "again (run.py ingest_rec) so that the lookups return them in order.",
+                                   n_rows, table.name)
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    logger.info("Created the index %s on %s.", index.name, table.name)
+    except sqlalchemy.exc.OperationalError as e:
+        logger.error("There is a connection error. \n"
+                     "Possible cause is missing enviroment variable or VPN connection.The original error is: %s",
+                     str(e))
+    else:
+        logger.info("Database migrated.")
+
 class RecommendationManager:
     """Creates a SQLAlchemy connection to the Apps table.
 
@@ -143,31 +475,33 @@ class RecommendationManager:
             within a Flask app. Optional.
         engine_string (str): SQLAlchemy engine string specifying which database
             to write to. Follows the format
+        pool (Dict): the arguments of engine_options, used with an engine string
+        retries (int): number of retries of a lookup after a lost connection
+            (DB_RETRIES of the app config)
+        backoff (float): seconds before the first retry, doubled for every next one
+            (DB_RETRY_BACKOFF of the app config)
     """
     def __init__(self, app: typing.Optional[flask.app.Flask] = None,
-                 engine_string: typing.Optional[str] = None):
-        if app:
-            self.database = SQLAlchemy(app)
-            self.session = self.database.session
-        elif engine_string:
-            engine = sqlalchemy.create_engine(engine_string)
-            session_maker = sqlalchemy.orm.sessionmaker(bind=engine)
-            self.session = session_maker()
-        else:
-            raise ValueError(
-                "Need either an engine string or a Flask app to initialize")
+                 engine_string: typing.Optional[str] = None,
+                 pool: typing.Optional[typing.Dict] = None,
+                 retries: int = 3,
+                 backoff: float = 0.1):
+        self.database, self.session = open_session(app, engine_string, pool)
+        config = app.config if app else {}
+        self.retries = config.get("DB_RETRIES", retries)
+        self.backoff = config.get("DB_RETRY_BACKOFF", backoff)
 
     def ingest_from_csv_rec(self, input_path: str) -> None:
         """
         Add all the data in a csv file into the database
         Args:
-            input_path: the path of the csv file
+            input_path: the path of the table file (csv, Parquet or Arrow IPC)
         Returns: None
         """
 
         session = self.session
 
-        data_list = pd.read_csv(input_path).to_dict(orient="records")
+        data_list = read_table(input_path).to_dict(orient="records")
 
         persist_list = []
         for data in data_list:
@@ -175,6 +509,8 @@ class RecommendationManager:
 
         try:
             session.add_all(persist_list)
+            # stamp a new version so that cached recommendations get invalidated
+            session.merge(RecommendationVersion(Id=1, Version=uuid.uuid4().hex))
             session.commit()
         except sqlalchemy.exc.OperationalError as e:
             logger.error("There is a connection error. \n"
@@ -186,10 +522,198 @@ class RecommendationManager:
         else:
             logger.info("%i records from %s were added to the table", len(persist_list), input_path)
 
+    def bulk_ingest_from_csv_rec(self, input_path: str, chunksize: int = 10000, mode: str = "replace") -> None:
+        """
+        Stream the data in a csv file into the database in chunks
+        Args:
+            input_path: the path of the table file (csv, Parquet or Arrow IPC)
+            chunksize: number of rows per insert; replace commits once after the last chunk,
+                upsert commits every chunk
+            mode: replace or upsert the rows that already exist
+        Returns: None
+        """
+        self._bulk_ingest_rec(iter_table(input_path, chunksize=chunksize), mode, input_path)
+
+    def bulk_ingest_df_rec(self, df: pd.DataFrame, chunksize: int = 10000, mode: str = "replace") -> None:
+        """
+        Insert a recommendation table that is already in memory into the database in chunks
+        Args:
+            df: the recommendation table
+            chunksize: number of rows per insert; replace commits once after the last chunk,
+                upsert commits every chunk
+            mode: replace or upsert the rows that already exist
+        Returns: None
+        """
+        chunks = (df.iloc[start:start + chunksize] for start in range(0, len(df), chunksize))
+        self._bulk_ingest_rec(chunks, mode, "memory")
+
+    def replace_villagers_rec(self, df: pd.DataFrame, chunksize: int = 10000) -> None:
+        """
+        Replace the recommendations of the villagers in a table by its rows, e.g. after
+        new villagers joined their clusters
+        Args:
+            df: the new recommendations of the villagers (Name_villager)
+            chunksize: number of rows inserted at once
+        Returns: None
+        """
+        try:
+            n_rows = replace_rows(self.session, Recommendations.__table__, df, "Name_villager", chunksize)
+            # stamp a new version so that cached recommendations get invalidated
+            self.session.merge(RecommendationVersion(Id=1, Version=uuid.uuid4().hex))
+            self.session.commit()
+        except sqlalchemy.exc.OperationalError as e:
+            self.session.rollback()
+            logger.error("There is a connection error. \n"
+                         "Possible cause is missing enviroment variable or VPN connection.The original error is:%s",
+                         str(e))
+        else:
+            logger.info("The recommendations of %i villagers are replaced by %i records",
+                        df["Name_villager"].nunique(), n_rows)
+
+    def _bulk_ingest_rec(self, chunks: typing.Iterable[pd.DataFrame], mode: str, source: str) -> None:
+        """Insert the chunks of a recommendation table and stamp a new version."""
+        try:
+            n_rows = ingest_chunks(self.session, Recommendations.__table__, chunks, mode)
+            # stamp a new version so that cached recommendations get invalidated; the
+            # stamp is only written once the last chunk is committed
+            self.session.merge(RecommendationVersion(Id=1, Version=uuid.uuid4().hex))
+            self.session.commit()
+        except sqlalchemy.exc.OperationalError as e:
+            self.session.rollback()
+            logger.error("There is a connection error. \n"
+                         "Possible cause is missing enviroment variable or VPN connection.The original error is:%s",
+                         str(e))
+        else:
+            logger.info("%i records from %s were added to the table", n_rows, source)
+
+    def get_recommendations(self, name: str, limit: int) -> typing.List[typing.Dict]:
+        """Query the recommendations of a villager, retrying after a lost connection
+
+        Args:
+            name: the villager name
+            limit: number of recommendations
+
+        Returns: the recommendations as dictionaries, ordered by rank
+
+        """
+        def query():
+            return self.session.query(Recommendations).filter_by(Name_villager=name) \
+                .order_by(Recommendations.Rank).limit(limit).all()
+        return [rec.to_dict() for rec in retry_on_disconnect(self.session, query, self.retries, self.backoff)]
+
+    def get_recommendations_many(self, names: typing.List[str], limit: int) -> typing.Dict[str, typing.List]:
+        """Query the recommendations of several villagers with one IN (...) query,
+        retrying after a lost connection
+
+        Args:
+            names: the villager names
+            limit: number of recommendations per villager
+
+        Returns: villager name -> recommendations ordered by rank, for the villagers that were found
+
+        """
+        def query():
+            return self.session.query(Recommendations) \
+                .filter(Recommendations.Name_villager.in_(names)) \
+                .order_by(Recommendations.Name_villager, Recommendations.Rank).all()
+        results = {}
+        for rec in retry_on_disconnect(self.session, query, self.retries, self.backoff):
+            rows = results.setdefault(rec.Name_villager, [])
+            if len(rows) < limit:
+                rows.append(rec.to_dict())
+        return results
+
+    def get_version(self) -> typing.Optional[str]:
+        """Get the version stamp of the recommendations table
+
+        Returns: the version stamp, None if the table was never stamped or can not be read
+
+        """
+        def query():
+            return self.session.query(RecommendationVersion.Version).filter_by(Id=1).scalar()
+        try:
+            return retry_on_disconnect(self.session, query, self.retries, self.backoff)
+        except sqlalchemy.exc.SQLAlchemyError:
+            self.session.rollback()
+            logger.warning("Not able to read the recommendation version stamp.", exc_info=True)
+            return None
+
     def close(self) -> None:
         """Closes SQLAlchemy session
 
         Returns: None
 
         """
-        self.session.close()
+        self.session.remove()
+
+class AsyncRecommendationManager:
+    """Reads the recommendations table with an async driver, for the async app.
+
+    Args:
+        engine_string (str): SQLAlchemy engine string of the database; the driver is
+            replaced by the async driver of its dialect
+        pool (Dict): the arguments of engine_options
+        retries (int): number of retries of a lookup after a lost connection
+        backoff (float): seconds before the first retry, doubled for every next one
+    """
+    def __init__(self, engine_string: str, pool: typing.Optional[typing.Dict] = None,
+                 retries: int = 3, backoff: float = 0.1):
+        self.engine = create_async_engine(async_engine_url(engine_string),
+                                          **engine_options(engine_string, **(pool or {})))
+        self.retries = retries
+        self.backoff = backoff
+        self.table = Recommendations.__table__
+
+    async def query_many(self, names: typing.List[str], limit: int) -> typing.Dict[str, typing.List]:
+        """Query the recommendations of several villagers with one IN (...) query
+
+        Args:
+            names (List): the villager names
+            limit (int): number of recommendations per villager
+
+        Returns:
+            Dict: villager name -> recommendations ordered by rank, for the villagers that were found
+        """
+        statement = sqlalchemy.select(self.table) \
+            .where(self.table.c.Name_villager.in_(names)) \
+            .order_by(self.table.c.Name_villager, self.table.c.Rank)
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.engine.connect() as connection:
+                    rows = (await connection.execute(statement)).mappings().all()
+                break
+            except sqlalchemy.exc.DBAPIError as e:
+                if not e.connection_invalidated or attempt == self.retries:
+                    raise
+                wait = self.backoff * 2 ** attempt
+                logger.warning("The database connection was lost, retry %i of %i in %.2f s.",
+                               attempt + 1, self.retries, wait)
+                await asyncio.sleep(wait)
+        results = {}
+        for row in rows:
+            recommendations = results.setdefault(row["Name_villager"], [])
+            if len(recommendations) < limit:
+                recommendations.append(dict(row))
+        return results
+
+    async def get_version(self) -> typing.Optional[str]:
+        """Get the version stamp of the recommendations table
+
+        Returns: the version stamp, None if the table was never stamped or can not be read
+
+        """
+        statement = sqlalchemy.select(RecommendationVersion.Version).where(RecommendationVersion.Id == 1)
+        try:
+            async with self.engine.connect() as connection:
+                return (await connection.execute(statement)).scalar()
+        except sqlalchemy.exc.SQLAlchemyError:
+            logger.warning("Not able to read the recommendation version stamp.", exc_info=True)
+            return None
+
+    async def close(self) -> None:
+        """Closes the connections of the engine
+
+        Returns: None
+
+        """
+        await self.engine.dispose()
@@ -0,0 +1,68 @@
+"""
+This module includes the request parsing and response building of the json API, shared
+by the Flask app (app.py) and the async app (asgi.py).
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+def parse_batch_request(payload, max_names: int, max_rows: int) -> Tuple[List[str], int]:
+    """validate the body of a batch recommendation request
+
+    Args:
+        payload: the decoded json body, {"names": [...], "limit": n}
+        max_names (int): maximum number of names per request
+        max_rows (int): maximum (and default) number of recommendations per name
+
+    Raises:
+        ValueError: if the body is not valid, with the message for the client
+
+    Returns:
+        Tuple: the names and the number of recommendations per name
+    """
+    names = payload.get("names") if isinstance(payload, dict) else None
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise ValueError("The body should be a json object with a list of names.")
+    if len(names) > max_names:
+        raise ValueError(f"At most {max_names} names are allowed per request.")
+    limit = payload.get("limit", max_rows)
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        raise ValueError("The limit should be a positive integer.")
+    return names, min(limit, max_rows)
+
+def parse_k(value: Optional[str], default: int) -> int:
+    """validate the number of villagers asked from the similarity index
+
+    Args:
+        value (str): the k of the query string, None if it is not given
+        default (int): the number of villagers if k is not given
+
+    Raises:
+        ValueError: if k is empty, not an integer or smaller than 1, with the message for the client
+
+    Returns:
+        int: the number of villagers
+    """
+    if value is None:
+        return default
+    try:
+        k = int(value)
+    except ValueError:
+        raise ValueError("k should be a positive integer.") from None
+    if k < 1:
+        raise ValueError("k should be a positive integer.")
+    return k
+
+def batch_response(found: Dict[str, List], limit: int) -> Dict:
+    """the body of a batch recommendation response
+
+    Args:
+        found (Dict): villager name -> recommendations, in the order of the request
+        limit (int): number of recommendations per name
+
+    Returns:
+        Dict: {"results": [{"name", "recommendations"}], "not_found": [...]}
+    """
+    return {"results": [{"name": name, "recommendations": rows[:limit]} for name, rows in found.items()],
+            "not_found": [name for name, rows in found.items() if not rows]}
@@ -0,0 +1,250 @@
+"""
+This module syncs the outputs of the pipeline stages (data, models, figures,
+deliverables) with a remote artifact store, an S3 prefix or a directory standing in
+for it. Files are transferred concurrently by a thread pool, large files in multipart
+transfers. A file is only transferred when its content differs: local files are
+compared with the remote objects by their ETag, computed locally the way S3 computes
+it. Downloads go through a local content-addressed cache, keyed by the ETag, so a
+container that already pulled an artifact gets it back without a download.
+"""
+import logging
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src.s3 import file_etag, parse_s3, s3_client, transfer_config
+
+logger = logging.getLogger(__name__)
+
+class LocalBackend:
+    """An artifact store in a directory, with the interface of S3Backend. It stands in
+    for S3 in tests and on machines that share a file system.
+
+    Args:
+        root (str): the directory of the store
+    """
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def list(self, prefix: str = "") -> Dict[str, str]:
+        """the keys under a prefix
+
+        Returns:
+            Dict: key -> ETag
+        """
+        base = self.root / prefix
+        if base.is_file():
+            return {prefix: file_etag(str(base))}
+        if not base.is_dir():
+            return {}
+        return {path.relative_to(self.root).as_posix(): file_etag(str(path))
+                for path in sorted(base.rglob("*")) if path.is_file()}
+
+    def upload(self, local_path: str, key: str) -> None:
+        """copy a file into the store"""
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        shutil.copyfile(local_path, tmp)
+        os.replace(tmp, path)
+
+    def download(self, key: str, local_path: str) -> None:
+        """copy a file out of the store
+
+        Raises:
+            FileNotFoundError: if the key does not exist
+        """
+        shutil.copyfile(self.root / key, local_path)
+
+class S3Backend:
+    """An artifact store under an S3 prefix. One client is shared by all the transfers
+    (boto3 clients are thread-safe); files above the multipart threshold are sent in
+    parts by max_concurrency threads each.
+
+    Args:
+        bucket (str): the bucket
+        prefix (str): the prefix of the keys of the store
+        client: a boto3 S3 client. Defaults to the client of the process.
+        max_concurrency (int): threads per multipart transfer
+    """
+    def __init__(self, bucket: str, prefix: str = "", client=None, max_concurrency: int = 4):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = client or s3_client()
+        self.transfer_config = transfer_config(max_concurrency)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def list(self, prefix: str = "") -> Dict[str, str]:
+        """the keys under a prefix
+
+        Returns:
+            Dict: key (relative to the prefix of the store) -> ETag
+        """
+        found = {}
+        start = len(self.prefix) + 1 if self.prefix else 0
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for item in page.get("Contents", []):
+                key = item["Key"][start:]
+                # "models" should not match "models_old/..."
+                if key == prefix or not prefix or key.startswith(prefix.rstrip("/") + "/"):
+                    found[key] = item["ETag"].strip('"')
+        return found
+
+    def upload(self, local_path: str, key: str) -> None:
+        """upload a file"""
+        self.client.upload_file(local_path, self.bucket, self._key(key), Config=self.transfer_config)
+
+    def download(self, key: str, local_path: str) -> None:
+        """download a file"""
+        self.client.download_file(self.bucket, self._key(key), local_path, Config=self.transfer_config)
+
+def backend_from_uri(uri: str, **options):
+    """the backend of a store URI: s3://bucket/prefix, or a directory (file:// optional)
+
+    Args:
+        uri (str): the URI of the store
+        options: passed to S3Backend
+
+    Returns:
+        LocalBackend or S3Backend: the backend
+    """
+    if uri.startswith("s3://"):
+        bucket, prefix = parse_s3(uri.rstrip("/") + "/")
+        return S3Backend(bucket, prefix, **options)
+    return LocalBackend(uri[len("file://"):] if uri.startswith("file://") else uri)
+
+class ArtifactStore:
+    """Push and pull files and whole directories to and from a backend.
+
+    Args:
+        backend (LocalBackend or S3Backend): the remote store
+        cache_dir (str): the directory of the local content-addressed cache
+        max_workers (int): number of files transferred at the same time
+        max_size_mb (float): the total size kept in the cache; the least recently used
+            files are evicted above it
+    """
+    def __init__(self, backend, cache_dir: str = ".artifact_cache",
+                 max_workers: int = 8, max_size_mb: float = 1024):
+        if max_workers < 1 or max_size_mb <= 0:
+            logger.error("max_workers and max_size_mb of the artifact store should be positive.")
+            raise ValueError("max_workers and max_size_mb should be positive.")
+        self.backend = backend
+        self.cache_dir = Path(cache_dir)
+        self.max_workers = max_workers
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+
+    def push(self, paths: List[str]) -> Dict[str, str]:
+        """upload files and directories under the same relative paths, skipping the files
+        the store already has
+
+        Args:
+            paths (List): files or directories, relative to the working directory
+
+        Raises:
+            FileNotFoundError: if a path does not exist
+
+        Returns:
+            Dict: key -> "uploaded" or "skipped"
+        """
+        files = []
+        for path in paths:
+            if os.path.isfile(path):
+                files.append(path)
+            elif os.path.isdir(path):
+                files += [str(file) for file in sorted(Path(path).rglob("*")) if file.is_file()]
+            else:
+                logger.error("%s does not exist.", path)
+                raise FileNotFoundError(f"{path} does not exist.")
+        remote = {}
+        for path in paths:
+            remote.update(self.backend.list(Path(path).as_posix()))
+        return self._run(self._push_file, [(file, Path(file).as_posix(), remote.get(Path(file).as_posix()))
+                                           for file in files], "pushed")
+
+    def pull(self, paths: List[str]) -> Dict[str, str]:
+        """download the keys under paths (files or directories) to the same relative paths,
+        skipping the files that are already there
+
+        Args:
+            paths (List): keys or key prefixes
+
+        Raises:
+            FileNotFoundError: if nothing is stored under a path
+
+        Returns:
+            Dict: key -> "downloaded", "cached" or "skipped"
+        """
+        remote = {}
+        for path in paths:
+            found = self.backend.list(Path(path).as_posix())
+            if not found:
+                logger.error("Nothing is stored under %s.", path)
+                raise FileNotFoundError(f"Nothing is stored under {path}.")
+            remote.update(found)
+        results = self._run(self._pull_file, [(key, key, etag) for key, etag in remote.items()], "pulled")
+        self.evict()
+        return results
+
+    def _run(self, func, units: List, verb: str) -> Dict[str, str]:
+        """run the transfers on the thread pool and log a summary"""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = dict(zip([key for _, key, _ in units], pool.map(lambda unit: func(*unit), units)))
+        counts = {status: list(results.values()).count(status) for status in sorted(set(results.values()))}
+        logger.info("%i files %s in %.2f s (%s)", len(results), verb, time.perf_counter() - start,
+                    ", ".join(f"{count} {status}" for status, count in counts.items()))
+        return results
+
+    def _push_file(self, local_path: str, key: str, remote_etag: Optional[str]) -> str:
+        """upload one file unless the store has the same content"""
+        if remote_etag is not None and remote_etag == file_etag(local_path):
+            logger.debug("%s is unchanged, not uploaded.", key)
+            return "skipped"
+        self.backend.upload(local_path, key)
+        logger.debug("%s uploaded.", key)
+        return "uploaded"
+
+    def _pull_file(self, key: str, local_path: str, remote_etag: str) -> str:
+        """download one file unless it is already there or in the cache"""
+        if os.path.isfile(local_path) and file_etag(local_path) == remote_etag:
+            logger.debug("%s is unchanged, not downloaded.", key)
+            return "skipped"
+        os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+        cached = self.cache_dir / remote_etag
+        status = "cached"
+        if not cached.is_file():
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_dir / f".{remote_etag}.{uuid.uuid4().hex}.tmp"
+            self.backend.download(key, str(tmp))
+            # the entry only shows up once it is complete
+            os.replace(tmp, cached)
+            status = "downloaded"
+        else:
+            # the modification time orders the eviction
+            os.utime(cached)
+        tmp = f"{local_path}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(cached, tmp)
+        os.replace(tmp, local_path)
+        logger.debug("%s %s.", key, status)
+        return status
+
+    def evict(self) -> None:
+        """remove the least recently used files until the cache fits in its size"""
+        if not self.cache_dir.is_dir():
+            return
+        entries = sorted((path.stat().st_mtime, path.stat().st_size, path)
+                         for path in self.cache_dir.iterdir() if path.is_file() and not path.name.startswith("."))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink()
+            total -= size
+            logger.info("Cached artifact %s evicted.", path.name)
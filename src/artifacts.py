@@ -0,0 +1,232 @@
+"""
+This module includes the functions to write and read the tables passed between the
+pipeline stages. A table can be stored as csv, Parquet or Arrow IPC (feather); the format
+is taken from the file extension. The columnar formats keep the column types (e.g. small
+integer codes and categorical columns), support compression, and are read memory-mapped.
+"""
+import gc
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# file extension of every supported format
+EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+def table_format(path: str) -> str:
+    """get the format of a table from its file extension
+
+    Args:
+        path (str): the path of the table
+
+    Raises:
+        ValueError: if the extension is not one of the supported formats
+
+    Returns:
+        str: csv, parquet or arrow
+    """
+    suffix = Path(path).suffix.lower()
+    for fmt, extension in EXTENSIONS.items():
+        if suffix == extension or (fmt == "arrow" and suffix == ".feather"):
+            return fmt
+    logger.error("The extension of %s is not one of %s.", path, str(list(EXTENSIONS.values())))
+    raise ValueError(f"Can not tell the format of {path} from its extension.")
+
+def artifact_path(path: str, fmt: Optional[str]) -> str:
+    """change the extension of a path to the one of the format
+
+    Args:
+        path (str): the path of the table
+        fmt (str): csv, parquet or arrow. None keeps the path as it is.
+
+    Raises:
+        ValueError: if the format is not supported
+
+    Returns:
+        str: the path with the extension of the format
+    """
+    if fmt is None:
+        return path
+    if fmt not in EXTENSIONS:
+        logger.error("The format %s is not one of %s.", fmt, str(list(EXTENSIONS)))
+        raise ValueError(f"The format {fmt} is not supported.")
+    return str(Path(path).with_suffix(EXTENSIONS[fmt]))
+
+def write_table(df: pd.DataFrame,
+                output_path: str,
+                compression: Optional[str] = None,
+                categorical: bool = False) -> None:
+    """write a table in the format given by the extension of the output path.
+
+    Args:
+        df (pd.DataFrame): the table to write
+        output_path (str): intented location.
+        compression (str): compression codec for the columnar formats (e.g. snappy, zstd, lz4).
+            None writes uncompressed data, which lets Arrow IPC files be read without a copy.
+        categorical (bool): store the string columns of the columnar formats as categorical columns.
+            The categories are in the order the values first appear, which is also the order
+            of a categorical column read from a table written by write_chunks.
+    """
+    fmt = table_format(output_path)
+    if fmt == "csv":
+        df.to_csv(output_path, index=False)
+        return
+
+    if categorical:
+        df = df.assign(**{col: pd.Categorical(df[col], categories=df[col].dropna().unique())
+                          for col in df.columns if df[col].dtype == object})
+    if fmt == "parquet":
+        df.to_parquet(output_path, index=False, compression=compression)
+    else:
+        feather.write_feather(df.reset_index(drop=True), output_path,
+                              compression=compression or "uncompressed")
+
+def write_chunks(chunks: Iterable[pd.DataFrame],
+                 output_path: str,
+                 compression: Optional[str] = None,
+                 categorical: bool = False) -> int:
+    """write a table chunk by chunk, so that only one chunk is in memory at a time.
+    The chunks should all have the same columns. In the columnar formats, the later chunks
+    are cast to the types of the first one (e.g. a string column that is empty in a chunk).
+
+    Args:
+        chunks (Iterable): the chunks of the table
+        output_path (str): intented location.
+        compression (str): compression codec for the columnar formats
+        categorical (bool): dictionary encode the string columns of Parquet files. The
+            dictionaries of the chunks are merged in the order the values first appear when
+            the table is read. Arrow IPC files need one dictionary for all chunks, so their
+            string columns are kept; give them categories before writing instead.
+
+    Raises:
+        ValueError: if there is no chunk
+
+    Returns:
+        int: the number of rows written
+    """
+    fmt = table_format(output_path)
+    writer = None
+    schema = None
+    n_rows = 0
+    try:
+        for chunk in chunks:
+            if fmt == "csv":
+                chunk.to_csv(output_path, index=False, mode="w" if writer is None else "a",
+                             header=writer is None)
+                writer = True
+            else:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if categorical and fmt == "parquet":
+                    for i, field in enumerate(table.schema):
+                        if pa.types.is_string(field.type):
+                            table = table.set_column(i, field.name, pc.dictionary_encode(table[i]))
+                if schema is None:
+                    schema = table.schema
+                elif not table.schema.equals(schema):
+                    table = table.cast(schema)
+                if writer is None:
+                    writer = (pq.ParquetWriter(output_path, table.schema, compression=compression or "none")
+                              if fmt == "parquet" else
+                              pa.ipc.new_file(output_path, table.schema,
+                                              options=pa.ipc.IpcWriteOptions(compression=compression)))
+                writer.write_table(table)
+            n_rows += len(chunk)
+    finally:
+        if writer is not None and writer is not True:
+            writer.close()
+    if writer is None:
+        logger.error("There is no chunk to write to %s.", output_path)
+        raise ValueError("chunks should not be empty.")
+    return n_rows
+
+def read_table(filename: str, dtype: Optional[Dict] = None) -> pd.DataFrame:
+    """read a table in the format given by its extension. Parquet and Arrow IPC files are
+    memory-mapped instead of parsed.
+
+    Args:
+        filename (str): the location of the table
+        dtype (Dict): column types for csv files; the columnar formats keep their own types
+
+    Returns:
+        pd.DataFrame: the table
+    """
+    fmt = table_format(filename)
+    if fmt == "csv":
+        return pd.read_csv(filename, dtype=dtype)
+    if fmt == "parquet":
+        return pq.read_table(filename, memory_map=True).to_pandas()
+    with pa.memory_map(str(filename), "r") as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+def iter_table(filename: str, chunksize: int) -> Iterator[pd.DataFrame]:
+    """read a table chunk by chunk, so that only one chunk is in memory at a time.
+
+    Args:
+        filename (str): the location of the table
+        chunksize (int): number of rows in a chunk
+
+    Yields:
+        pd.DataFrame: the chunks of the table
+    """
+    fmt = table_format(filename)
+    if fmt == "csv":
+        yield from _collected(pd.read_csv(filename, chunksize=chunksize))
+    elif fmt == "parquet":
+        batches = pq.ParquetFile(filename, memory_map=True).iter_batches(batch_size=chunksize)
+        yield from _collected(batch.to_pandas() for batch in batches)
+    else:
+        with pa.memory_map(str(filename), "r") as source:
+            reader = pa.ipc.open_file(source)
+            # one record batch of the file at a time, cut to the chunk size
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            yield from _collected(batch.slice(start, chunksize).to_pandas()
+                                  for batch in batches for start in range(0, batch.num_rows, chunksize))
+
+def table_columns(filename: str) -> List:
+    """read the column names of a table without reading its rows
+
+    Args:
+        filename (str): the location of the table
+
+    Returns:
+        List: the column names
+    """
+    fmt = table_format(filename)
+    if fmt == "csv":
+        return pd.read_csv(filename, nrows=0).columns.tolist()
+    if fmt == "parquet":
+        return pq.read_schema(filename).names
+    with pa.memory_map(str(filename), "r") as source:
+        return pa.ipc.open_file(source).schema.names
+
+def _collected(chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """yield the chunks, running the garbage collector before reading the next one. pandas
+    leaves reference cycles in the dataframes of a chunk, and the collector runs on the
+    number of objects allocated, not their size, so the earlier chunks would otherwise
+    stay in memory."""
+    for chunk in chunks:
+        yield chunk
+        gc.collect()
+
+def stage_options(config: Dict, stage: str) -> Tuple[Optional[str], Dict]:
+    """get the format and the write options of a stage from the artifacts section of
+    the model configuration.
+
+    Args:
+        config (Dict): the model configuration
+        stage (str): the stage that writes the tables (preprocess, train or recommendation)
+
+    Returns:
+        str: the format of the tables of the stage, None if it is not configured
+        Dict: the other options (compression, categorical) passed to write_table
+    """
+    options = dict(config.get("artifacts", {}).get(stage) or {})
+    fmt = options.pop("format", None)
+    return fmt, options
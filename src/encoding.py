@@ -0,0 +1,117 @@
+"""
+This module includes the functions to dictionary-encode the categorical columns of the
+villager data into small integer codes, and to map the codes back to their values.
+The vocabulary of every column is sorted, so the codes keep the order of the values.
+"""
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.artifacts import read_table
+
+logger = logging.getLogger(__name__)
+
+def code_dtype(n_values: int) -> np.dtype:
+    """the smallest signed integer type that holds the codes of a column (-1 is missing)
+
+    Args:
+        n_values (int): number of values in the vocabulary of the column
+
+    Returns:
+        np.dtype: int8, int16 or int32
+    """
+    for dtype in (np.int8, np.int16):
+        if n_values <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int32)
+
+def encode_df(df: pd.DataFrame,
+              columns: List,
+              vocabulary: Optional[Dict] = None) -> Tuple[pd.DataFrame, Dict]:
+    """replace the values of the given columns by integer codes.
+
+    Args:
+        df (pd.DataFrame): the dataframe to encode
+        columns (List): the columns to encode, the others are kept as they are
+        vocabulary (Dict): existing vocabulary to encode with. If None, one is built from df.
+
+    Raises:
+        KeyError: if some columns are not in the df
+
+    Returns:
+        pd.DataFrame: the encoded dataframe, unknown or missing values get -1
+        Dict: the vocabulary, column name -> sorted list of values
+    """
+    missing = [col for col in columns if col not in df.columns]
+    if missing:
+        logger.error("Columns %s are not in the dataset.", str(missing))
+        raise KeyError("Some columns to encode are not in the dataset. Check again!")
+
+    if vocabulary is None:
+        vocabulary = {col: sorted(df[col].dropna().unique().tolist()) for col in columns}
+
+    encoded = df.copy()
+    for col in columns:
+        codes = pd.Categorical(df[col], categories=vocabulary[col]).codes
+        encoded[col] = codes.astype(code_dtype(len(vocabulary[col])))
+    return encoded, vocabulary
+
+def decode_df(df: pd.DataFrame, vocabulary: Dict, suffix: str = "") -> pd.DataFrame:
+    """map the codes of every column in the vocabulary back to their values.
+
+    Args:
+        df (pd.DataFrame): the encoded dataframe
+        vocabulary (Dict): column name -> sorted list of values
+        suffix (str): also decode the columns named column + suffix (e.g. "_villager")
+
+    Returns:
+        pd.DataFrame: the decoded dataframe
+    """
+    decoded = df.copy()
+    for col, values in vocabulary.items():
+        for name in {col, col + suffix}:
+            if name in decoded.columns:
+                decoded[name] = pd.Categorical.from_codes(decoded[name], categories=values).astype(object)
+    return decoded
+
+def save_vocabulary(vocabulary: Dict, output_path: str) -> None:
+    """save the vocabulary to a json file.
+
+    Args:
+        vocabulary (Dict): column name -> sorted list of values
+        output_path (str): intented location.
+    """
+    with open(output_path, "w") as f:
+        json.dump(vocabulary, f, indent=2)
+    logger.info("The vocabulary is saved to %s", output_path)
+
+def load_vocabulary(filename: str) -> Dict:
+    """load the vocabulary from a json file.
+
+    Args:
+        filename (str): the location of the vocabulary
+
+    Returns:
+        Dict: column name -> sorted list of values
+    """
+    with open(filename, "r") as f:
+        vocabulary = json.load(f)
+    logger.info("The vocabulary is loaded from %s", filename)
+    return vocabulary
+
+def read_encoded(filename: str, vocabulary: Dict) -> pd.DataFrame:
+    """read an encoded table with the smallest integer type for every code column.
+    The columnar formats already store these types; csv files are parsed with them.
+
+    Args:
+        filename (str): the location of the encoded table
+        vocabulary (Dict): column name -> sorted list of values
+
+    Returns:
+        pd.DataFrame: the encoded dataframe
+    """
+    dtypes = {col: code_dtype(len(values)) for col, values in vocabulary.items()}
+    return read_table(filename, dtype=dtypes)
@@ -0,0 +1,226 @@
+"""
+This module includes the functions to add new villagers without retraining. The new rows
+of the raw data are preprocessed on their own, assigned to the closest modes of the
+persisted model, and only the recommendations of the clusters they join are rebuilt.
+"""
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.animal_manager import RecommendationManager
+from src.artifacts import read_table, stage_options, write_table
+from src.encoding import code_dtype, decode_df, encode_df, load_vocabulary, read_encoded, save_vocabulary
+from src.kmodes_engine import mismatch
+from src.modeling import load_model, save_model
+from src.modeling_helper import create_rec_table
+from src.preprocess import drop_cols, feature_engineering, load_dataset
+from src.rec_store import write_rec_store
+from src.similarity import SimilarityIndex
+
+logger = logging.getLogger(__name__)
+
+def extend_vocabulary(vocabulary: Dict, df: pd.DataFrame) -> Dict:
+    """add the values of df that are not in the vocabulary yet. The vocabulary stays
+    sorted, so the codes of the existing values can change; code_maps gives the old
+    code -> new code of the columns to recode.
+
+    Args:
+        vocabulary (Dict): column name -> sorted list of values
+        df (pd.DataFrame): the new rows
+
+    Returns:
+        Dict: the extended vocabulary
+    """
+    extended = {}
+    for col, values in vocabulary.items():
+        known = set(values)
+        new_values = sorted(value for value in df[col].dropna().unique() if value not in known)
+        if new_values:
+            logger.info("New values %s are added to the vocabulary of %s.", str(new_values), col)
+        extended[col] = sorted(list(values) + new_values)
+    return extended
+
+def code_maps(vocabulary: Dict, extended: Dict) -> Dict:
+    """the new code of every old code, for the columns whose codes changed
+
+    Args:
+        vocabulary (Dict): the old vocabulary
+        extended (Dict): the vocabulary extended by extend_vocabulary
+
+    Returns:
+        Dict: column name -> np.ndarray, the new code at the position of the old one
+    """
+    maps = {}
+    for col, values in vocabulary.items():
+        new_codes = {value: code for code, value in enumerate(extended[col])}
+        mapping = np.array([new_codes[value] for value in values], dtype=np.int64)
+        if not np.array_equal(mapping, np.arange(len(values))):
+            maps[col] = mapping
+    return maps
+
+def recode(df: pd.DataFrame, maps: Dict, vocabulary: Dict) -> pd.DataFrame:
+    """replace the old codes of the columns of df by the new ones. Missing values (-1)
+    stay missing.
+
+    Args:
+        df (pd.DataFrame): encoded data
+        maps (Dict): the code maps of code_maps
+        vocabulary (Dict): the extended vocabulary, for the type of the codes
+
+    Returns:
+        pd.DataFrame: the recoded data
+    """
+    recoded = df.copy()
+    for col, mapping in maps.items():
+        if col in recoded.columns:
+            codes = _map_codes(recoded[col].to_numpy(), mapping)
+            recoded[col] = codes.astype(code_dtype(len(vocabulary[col])))
+    return recoded
+
+def recode_model(model, features: List, maps: Dict) -> None:
+    """replace the old codes of the modes of a fitted model by the new ones
+
+    Args:
+        model (KModes): the fitted model (any engine of src.kmodes_engine)
+        features (List): the columns of the modes
+        maps (Dict): the code maps of code_maps
+    """
+    centroids = np.asarray(model.cluster_centroids_).astype(np.int64)
+    for i, col in enumerate(features):
+        if col in maps:
+            centroids[:, i] = _map_codes(centroids[:, i], maps[col])
+    model.cluster_centroids_ = centroids
+
+def _map_codes(codes: np.ndarray, mapping: np.ndarray) -> np.ndarray:
+    """map the codes, keeping the missing ones (-1)"""
+    codes = codes.astype(np.int64)
+    return np.where(codes >= 0, mapping[np.maximum(codes, 0)], -1)
+
+def assign_clusters(model, codes: pd.DataFrame) -> np.ndarray:
+    """assign new rows to the closest modes of a fitted model and add them to its
+    labels_ and cost_, so that the model describes the extended data.
+
+    Args:
+        model (KModes): the fitted model (any engine of src.kmodes_engine)
+        codes (pd.DataFrame): the new rows, with the columns used for modeling
+
+    Returns:
+        np.ndarray: the cluster of every new row
+    """
+    centroids = np.asarray(model.cluster_centroids_).astype(np.int64)
+    distances = mismatch(codes.to_numpy().astype(np.int64), centroids)
+    labels = distances.argmin(axis=1)
+    old_labels = np.asarray(model.labels_)
+    model.labels_ = np.concatenate([old_labels, labels.astype(old_labels.dtype)])
+    model.cost_ = model.cost_ + float(distances[np.arange(len(labels)), labels].sum())
+    return labels
+
+def add_villagers(config: Dict,
+                  paths: Dict,
+                  engine_string: Optional[str] = None,
+                  chunksize: int = 10000) -> pd.DataFrame:
+    """add the villagers of the raw data that are not in the encoded data yet.
+
+    The new rows are cleaned and encoded with the existing vocabulary (extended with the
+    values never seen before), assigned to the closest modes of the model, and appended
+    to the clean, encoded and modeling tables. The vocabulary stays sorted, so the codes
+    of the existing rows and of the modes are mapped to the new ones. The recommendations
+    of every villager in the clusters the new villagers join are rebuilt and replace the
+    old ones in the recommendation table and, if an engine string is given, in the
+    database. The similarity index, which covers every villager, is rebuilt.
+
+    Args:
+        config (Dict): the model configuration
+        paths (Dict): the paths of the files, with the keys raw, clean, encoded, vocab,
+            df_model, model and rec, and optionally store (the recommendation store of the app)
+            and index (the similarity index)
+        engine_string (str): SQLAlchemy connection URI. None only updates the files.
+        chunksize (int): number of rows per insert into the database
+
+    Returns:
+        pd.DataFrame: the recommendation rows that changed (empty if there is no new villager)
+    """
+    vocabulary = load_vocabulary(paths["vocab"])
+    encoded = read_encoded(paths["encoded"], vocabulary)
+    id_columns = config["preprocess"]["encode_data"]["id_columns"]
+    raw = load_dataset(filename=paths["raw"])
+    new_raw = raw[~raw[id_columns[0]].isin(encoded[id_columns[0]])].copy()
+    if new_raw.empty:
+        logger.info("There is no new villager in %s.", paths["raw"])
+        return pd.DataFrame()
+    logger.info("%i new villagers are found in %s.", len(new_raw), paths["raw"])
+
+    # preprocess only the new rows, with the vocabulary of the existing ones
+    dropped = drop_cols(new_raw, **config["preprocess"]["drop_cols"])
+    cleaned = feature_engineering(dropped, **config["preprocess"]["feature_engineering"])
+    extended = extend_vocabulary(vocabulary, cleaned)
+    maps = code_maps(vocabulary, extended)
+    vocabulary = extended
+    new_encoded, _ = encode_df(cleaned, list(vocabulary), vocabulary)
+
+    # assign them to the modes of the persisted model, in the codes of the new vocabulary
+    df_model = read_table(paths["df_model"])
+    model = load_model(paths["model"], df_model)
+    if maps:
+        logger.info("The codes of %s are mapped to the extended vocabulary.", str(list(maps)))
+        encoded = recode(encoded, maps, vocabulary)
+        df_model = recode(df_model, maps, vocabulary)
+        recode_model(model, df_model.columns.tolist(), maps)
+    new_model_rows = new_encoded[df_model.columns]
+    clusters = assign_clusters(model, new_model_rows)
+    for name, cluster in zip(new_encoded[id_columns[0]], clusters):
+        logger.info("%s is assigned to cluster %i.", name, cluster)
+
+    # append the new rows to the tables of the earlier stages
+    encoded = pd.concat([encoded, new_encoded], ignore_index=True)
+    df_model = pd.concat([df_model, new_model_rows], ignore_index=True)
+    _, pre_options = stage_options(config, "preprocess")
+    _, train_options = stage_options(config, "train")
+    clean = pd.concat([read_table(paths["clean"]), cleaned], ignore_index=True)
+    write_table(clean, paths["clean"], **pre_options)
+    write_table(encoded, paths["encoded"], **pre_options)
+    save_vocabulary(vocabulary, output_path=paths["vocab"])
+    write_table(df_model, paths["df_model"], **train_options)
+    save_model(model, df_model, paths["model"])
+
+    changed = _rebuild_clusters(encoded, df_model.columns.tolist(), vocabulary, model.labels_,
+                                np.unique(clusters), **config["modeling"]["recommendation"])
+    changed = _replace_villagers(changed, paths["rec"], config, paths.get("store"))
+    if paths.get("index") is not None:
+        index = SimilarityIndex.build(df_model, encoded[id_columns[0]], model.labels_,
+                                      **config["modeling"]["similarity"])
+        index.save(paths["index"])
+
+    if engine_string is not None:
+        manager = RecommendationManager(engine_string=engine_string)
+        manager.replace_villagers_rec(changed, chunksize=chunksize)
+        manager.close()
+    return changed
+
+def _rebuild_clusters(encoded: pd.DataFrame, features: List, vocabulary: Dict, labels: np.ndarray,
+                      clusters: np.ndarray, drop_list: List, top_n: Optional[int] = None) -> pd.DataFrame:
+    """the recommendations of every villager in the given clusters. The ranking only
+    compares villagers of the same cluster, so the other clusters do not change."""
+    members = np.flatnonzero(np.isin(labels, clusters))
+    logger.info("Rebuilding the recommendations of %i villagers in clusters %s.",
+                len(members), str(clusters.tolist()))
+    joined = create_rec_table(df=encoded.iloc[members], clusters=labels[members], drop_list=drop_list,
+                              top_n=top_n, features=features)
+    return decode_df(joined, vocabulary, suffix="_villager")
+
+def _replace_villagers(changed: pd.DataFrame, rec_path: str, config: Dict,
+                       store_path: Optional[str] = None) -> pd.DataFrame:
+    """replace the rows of the changed villagers in the recommendation table (and store).
+    The new rows get Unique_ids after the largest one in the table."""
+    rec = read_table(rec_path)
+    kept = rec[~rec["Name_villager"].isin(changed["Name_villager"])]
+    changed = changed.assign(Unique_id=np.arange(len(changed)) + int(rec["Unique_id"].max()) + 1)
+    _, rec_options = stage_options(config, "recommendation")
+    replaced = pd.concat([kept, changed], ignore_index=True)
+    write_table(replaced, rec_path, **rec_options)
+    if store_path is not None:
+        write_rec_store(replaced, store_path)
+    logger.info("%i rows of %s are replaced by %i rows.", len(rec) - len(kept), rec_path, len(changed))
+    return changed
@@ -0,0 +1,320 @@
+"""
+This module records the wall time, CPU time, peak memory and row counts of the stages
+of the model pipeline and writes them to a json run report. Recording is switched on
+with enable() (run.py --profile); while it is off, stage() and the instrumented
+functions only check one module variable.
+
+Memory is measured in one of two ways:
+
+- "rss": the peak resident set size of the process at the end of every stage and how
+  much the stage raised it. Cheap, and it sees the memory of numpy, pandas and pyarrow.
+- "tracemalloc": the peak of the memory allocated by python (numpy arrays included)
+  during every stage. Exact per stage, but it slows allocations down.
+"""
+import functools
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError: # not available on windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# version of the layout of the run report
+REPORT_VERSION = 1
+
+MEMORY_MODES = ["rss", "tracemalloc"]
+
+def peak_rss_mb() -> Optional[float]:
+    """the peak resident set size of this process in MB (None where it is not available)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on linux
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+def cpu_seconds() -> float:
+    """user and system CPU time of this process and of its finished child processes
+    (e.g. the workers of the elbow sweep)"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+class Recorder:
+    """Collects one record per stage. Stages can be nested; the path of a record joins
+    the names of the stages it ran in.
+
+    Args:
+        memory (str): "rss" or "tracemalloc", see the module docstring
+    """
+    def __init__(self, memory: str = "rss"):
+        if memory not in MEMORY_MODES:
+            logger.error("The memory mode %s is not one of %s.", memory, str(MEMORY_MODES))
+            raise ValueError(f"The memory mode {memory} is not supported.")
+        self.memory = memory
+        self.records = []
+        self._stack = []
+        self._started_tracemalloc = False
+        if memory == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.started_at = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        self._wall = time.perf_counter()
+        self._cpu = cpu_seconds()
+
+    def start(self, name: str, rows_in: Optional[int] = None, **tags) -> Dict:
+        """open a stage
+
+        Args:
+            name (str): the name of the stage
+            rows_in (int): number of rows going into the stage
+            tags: other fields of the record (e.g. k)
+
+        Returns:
+            Dict: the record of the stage, completed by finish
+        """
+        path = "/".join([frame["record"]["name"] for frame in self._stack] + [name])
+        record = {"stage": path, "name": name, "depth": len(self._stack),
+                  "rows_in": rows_in, "rows_out": None, **tags}
+        # records are listed in the order the stages started
+        self.records.append(record)
+        frame = {"record": record, "cpu": cpu_seconds(), "rss": peak_rss_mb(), "traced_peak": 0}
+        if self.memory == "tracemalloc":
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # the peak is reset for the new stage, so keep the peak of the parent so far
+                self._stack[-1]["traced_peak"] = max(self._stack[-1]["traced_peak"],
+                                                     peak - self._stack[-1]["traced_start"])
+            tracemalloc.reset_peak()
+            frame["traced_start"] = current
+        self._stack.append(frame)
+        frame["wall"] = time.perf_counter()
+        return record
+
+    def finish(self, error: Optional[BaseException] = None) -> Dict:
+        """close the innermost stage and fill in its timings and memory
+
+        Args:
+            error (BaseException): the exception that ended the stage, if any
+
+        Returns:
+            Dict: the record of the stage
+        """
+        wall = time.perf_counter()
+        frame = self._stack.pop()
+        record = frame["record"]
+        record["wall_s"] = round(wall - frame["wall"], 6)
+        record["cpu_s"] = round(cpu_seconds() - frame["cpu"], 6)
+        rows = record["rows_in"] if record["rows_in"] is not None else record["rows_out"]
+        if rows is not None:
+            record["rows_per_s"] = round(rows / max(record["wall_s"], 1e-9), 1)
+        rss = peak_rss_mb()
+        if rss is not None:
+            record["peak_rss_mb"] = round(rss, 1)
+            record["rss_growth_mb"] = round(rss - frame["rss"], 1)
+        if self.memory == "tracemalloc":
+            peak = max(frame["traced_peak"], tracemalloc.get_traced_memory()[1] - frame["traced_start"])
+            record["traced_peak_mb"] = round(peak / 1024 ** 2, 3)
+            if self._stack:
+                parent = self._stack[-1]
+                parent["traced_peak"] = max(parent["traced_peak"],
+                                            frame["traced_start"] - parent["traced_start"] + peak)
+            tracemalloc.reset_peak()
+        if error is not None:
+            record["error"] = type(error).__name__
+        return record
+
+    def add_rows(self, rows_in: Optional[int] = None, rows_out: Optional[int] = None) -> None:
+        """set the row counts of the innermost stage (for stages that read their input)"""
+        if not self._stack:
+            return
+        record = self._stack[-1]["record"]
+        if rows_in is not None:
+            record["rows_in"] = rows_in
+        if rows_out is not None:
+            record["rows_out"] = rows_out
+
+    def add(self, name: str, wall_s: float, cpu_s: float, **fields) -> Dict:
+        """add a record measured elsewhere (e.g. in a worker process) under the innermost stage
+
+        Returns:
+            Dict: the record
+        """
+        path = "/".join([frame["record"]["name"] for frame in self._stack] + [name])
+        record = {"stage": path, "name": name, "depth": len(self._stack),
+                  "wall_s": round(wall_s, 6), "cpu_s": round(cpu_s, 6), **fields}
+        self.records.append(record)
+        return record
+
+    def report(self, **meta) -> Dict:
+        """the run report: the run totals, meta and every record
+
+        Returns:
+            Dict: the report
+        """
+        report = {"version": REPORT_VERSION, **meta,
+                  "started_at": self.started_at,
+                  "memory": self.memory,
+                  "wall_s": round(time.perf_counter() - self._wall, 6),
+                  "cpu_s": round(cpu_seconds() - self._cpu, 6),
+                  "peak_rss_mb": None if peak_rss_mb() is None else round(peak_rss_mb(), 1),
+                  "stages": self.records}
+        return report
+
+    def close(self) -> None:
+        """stop tracemalloc if this recorder started it"""
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+_RECORDER: Optional[Recorder] = None
+
+def enable(memory: str = "rss") -> Recorder:
+    """start recording the stages
+
+    Args:
+        memory (str): "rss" or "tracemalloc"
+
+    Returns:
+        Recorder: the recorder the stages are written to
+    """
+    global _RECORDER # pylint: disable=global-statement
+    disable()
+    _RECORDER = Recorder(memory)
+    return _RECORDER
+
+def disable() -> Optional[Recorder]:
+    """stop recording
+
+    Returns:
+        Recorder: the recorder that was active, None if recording was off
+    """
+    global _RECORDER # pylint: disable=global-statement
+    recorder, _RECORDER = _RECORDER, None
+    if recorder is not None:
+        recorder.close()
+    return recorder
+
+def enabled() -> bool:
+    """whether the stages are being recorded"""
+    return _RECORDER is not None
+
+@contextmanager
+def stage(name: str, rows_in: Optional[int] = None, **tags) -> Iterator[Optional[Dict]]:
+    """record the block as a stage. Does nothing while recording is off.
+
+    Args:
+        name (str): the name of the stage
+        rows_in (int): number of rows going into the stage
+        tags: other fields of the record (e.g. k)
+
+    Yields:
+        Dict: the record of the stage, None while recording is off
+    """
+    recorder = _RECORDER
+    if recorder is None:
+        yield None
+        return
+    record = recorder.start(name, rows_in, **tags)
+    try:
+        yield record
+    except BaseException as e:
+        recorder.finish(error=e)
+        raise
+    recorder.finish()
+
+def add_rows(rows_in: Optional[int] = None, rows_out: Optional[int] = None) -> None:
+    """set the row counts of the innermost stage. Does nothing while recording is off."""
+    if _RECORDER is not None:
+        _RECORDER.add_rows(rows_in, rows_out)
+
+def add_record(name: str, wall_s: float, cpu_s: float, **fields) -> None:
+    """add a record measured elsewhere under the innermost stage. Does nothing while
+    recording is off."""
+    if _RECORDER is not None:
+        _RECORDER.add(name, wall_s, cpu_s, **fields)
+
+def frame_rows(value) -> Optional[int]:
+    """the number of rows of a dataframe, or of the first dataframe of a tuple"""
+    if isinstance(value, pd.DataFrame):
+        return len(value)
+    if isinstance(value, tuple):
+        return next((len(item) for item in value if isinstance(item, pd.DataFrame)), None)
+    return None
+
+def first_frame_rows(args: tuple, kwargs: Dict) -> Optional[int]:
+    """the number of rows of the first dataframe among the arguments of a call"""
+    return frame_rows(tuple(args) + tuple(kwargs.values()))
+
+def instrumented(name: Optional[str] = None,
+                 rows_in: Optional[Callable] = first_frame_rows,
+                 rows_out: Optional[Callable] = frame_rows) -> Callable:
+    """decorator recording every call of a function as a stage
+
+    Args:
+        name (str): the name of the stage. Defaults to the name of the function.
+        rows_in (Callable): computes the rows going in from (args, kwargs). None does not count them.
+        rows_out (Callable): computes the rows coming out from the result. None does not count them.
+
+    Returns:
+        Callable: the decorator
+    """
+    def decorator(func: Callable) -> Callable:
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _RECORDER is None:
+                return func(*args, **kwargs)
+            with stage(stage_name, rows_in(args, kwargs) if rows_in else None):
+                result = func(*args, **kwargs)
+                if rows_out is not None:
+                    add_rows(rows_out=rows_out(result))
+            return result
+        return wrapper
+    return decorator
+
+def write_report(path: str, recorder: Optional[Recorder] = None, **meta) -> Optional[Dict]:
+    """write the run report of a recorder to a json file
+
+    Args:
+        path (str): the path of the report
+        recorder (Recorder): the recorder. Defaults to the active one.
+        meta: fields added to the report (e.g. the command)
+
+    Returns:
+        Dict: the report, None if there is nothing to write
+    """
+    recorder = recorder or _RECORDER
+    if recorder is None:
+        logger.warning("Recording is off, no run report is written to %s.", path)
+        return None
+    report = recorder.report(**meta)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info("The run report with %i stages is written to %s", len(report["stages"]), path)
+    for line in summary(report):
+        logger.info(line)
+    return report
+
+def summary(report: Dict) -> List[str]:
+    """one line per stage of a run report, indented by depth"""
+    lines = []
+    for record in report["stages"]:
+        rows = record.get("rows_in") if record.get("rows_in") is not None else record.get("rows_out")
+        label = record["name"] + (f" k={record['k']}" if "k" in record else "")
+        lines.append(f"{'  ' * record['depth'] + label:<36} {record['wall_s']:>9.3f} s "
+                     f"{record['cpu_s']:>9.3f} cpu s {'' if rows is None else rows:>9} rows "
+                     f"{record.get('peak_rss_mb', ''):>8} MB")
+    return lines
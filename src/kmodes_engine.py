@@ -0,0 +1,422 @@
+"""
+This module includes a k-modes implementation on integer coded data written with numpy
+array operations. Points are assigned to the closest modes with one mismatch matrix per
+batch of points and the modes are recomputed with a bincount per attribute, instead of
+moving points one at a time like the kmodes package. It is selected with
+`modeling.engine: numpy` in the configuration. `modeling.engine: minibatch` selects a
+mini-batch variant that reads the data chunk by chunk and only keeps the counts of the
+codes per cluster in memory.
+"""
+import logging
+from typing import Callable, Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from kmodes.kmodes import KModes
+from kmodes.util import get_unique_rows
+from kmodes.util.dissim import matching_dissim
+from kmodes.util.init_methods import init_cao, init_huang
+
+logger = logging.getLogger(__name__)
+
+# the clustering engines that can be selected in the configuration
+ENGINES = ("kmodes", "numpy", "minibatch")
+
+# number of (point, centroid, attribute) comparisons held in memory at once
+BATCH_ELEMENTS = 1 << 22
+
+# default number of rows in a batch of the minibatch engine
+BATCH_SIZE = 100000
+
+def engine_config(modeling_config: Dict) -> Tuple[str, Dict]:
+    """get the engine and its options from the modeling section of the configuration.
+    The options of an engine are in the sub-section named after it.
+
+    Args:
+        modeling_config (Dict): the modeling section of the model configuration
+
+    Returns:
+        str: the engine (kmodes by default)
+        Dict: the options of the engine
+    """
+    engine = modeling_config.get("engine", "kmodes")
+    return engine, dict(modeling_config.get(engine) or {})
+
+def make_model(engine: str, n_clusters: int, init: str, n_init: int, random_state: int,
+               **options):
+    """create an unfitted k-modes model of the selected engine
+
+    Args:
+        engine (str): "kmodes" for the kmodes package, "numpy" for NumpyKModes,
+            "minibatch" for MiniBatchKModes
+        n_clusters (int): number of clusters
+        init (str): init method (kmode param)
+        n_init (int): number of restarts (kmode param)
+        random_state (int): random state for kmode
+        **options: other parameters of the model (e.g. batch_size of MiniBatchKModes)
+
+    Raises:
+        ValueError: if the engine is not supported
+
+    Returns:
+        KModes, NumpyKModes or MiniBatchKModes: the model
+    """
+    params = dict(n_clusters=n_clusters, init=init, n_init=n_init, random_state=random_state,
+                  **options)
+    if engine == "kmodes":
+        return KModes(**params)
+    if engine == "numpy":
+        return NumpyKModes(**params)
+    if engine == "minibatch":
+        return MiniBatchKModes(**params)
+    logger.error("The engine %s is not one of %s.", engine, str(ENGINES))
+    raise ValueError(f"The engine {engine} is not supported.")
+
+def mismatch(codes: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """number of attributes in which every point differs from every centroid
+
+    Args:
+        codes (np.ndarray): (n_points, n_attrs) integer codes
+        centroids (np.ndarray): (n_clusters, n_attrs) integer codes
+
+    Returns:
+        np.ndarray: (n_points, n_clusters) matrix of mismatches
+    """
+    n_points = codes.shape[0]
+    distances = np.empty((n_points, centroids.shape[0]), dtype=np.int32)
+    batch = max(BATCH_ELEMENTS // max(centroids.size, 1), 1)
+    for start in range(0, n_points, batch):
+        block = codes[start:start + batch]
+        distances[start:start + batch] = (block[:, None, :] != centroids[None, :, :]).sum(axis=2)
+    return distances
+
+def cluster_modes(codes: np.ndarray, labels: np.ndarray, n_clusters: int,
+                  n_values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """the most frequent code of every attribute in every cluster. Ties go to the
+    smallest code, like in the kmodes package.
+
+    Args:
+        codes (np.ndarray): (n_points, n_attrs) integer codes
+        labels (np.ndarray): the cluster of every point
+        n_clusters (int): number of clusters
+        n_values (np.ndarray): number of distinct codes of every attribute
+
+    Returns:
+        np.ndarray: (n_clusters, n_attrs) modes (meaningless for empty clusters)
+        np.ndarray: the size of every cluster
+    """
+    modes = np.empty((n_clusters, codes.shape[1]), dtype=codes.dtype)
+    labels = labels.astype(np.int64)
+    for iattr, n_value in enumerate(n_values):
+        counts = np.bincount(labels * n_value + codes[:, iattr], minlength=n_clusters * n_value)
+        modes[:, iattr] = counts.reshape(n_clusters, n_value).argmax(axis=1)
+    return modes, np.bincount(labels, minlength=n_clusters)
+
+def kmodes_single(codes: np.ndarray,
+                  n_clusters: int,
+                  init: Union[str, np.ndarray],
+                  max_iter: int,
+                  random_state: Optional[int],
+                  n_values: Optional[np.ndarray] = None) -> Tuple:
+    """fit one k-modes restart on integer coded data.
+
+    The centroids are initialized like the kmodes package does for the same random
+    state. Each iteration then assigns all points to their closest centroid and
+    recomputes all modes at once, and stops when no point moves or the cost does not
+    decrease.
+
+    Args:
+        codes (np.ndarray): (n_points, n_attrs) codes from 0 to n_values - 1
+        n_clusters (int): number of clusters
+        init (str or np.ndarray): "random", "huang", "cao" or the initial centroids
+        max_iter (int): maximum number of iterations
+        random_state (int): seed of this restart
+        n_values (np.ndarray): number of distinct codes of every attribute. Default is
+            taken from the data.
+
+    Raises:
+        ValueError: if the init method is not supported
+
+    Returns:
+        Tuple: (centroids, labels, cost, n_iter)
+    """
+    rng = np.random.RandomState(random_state)
+    n_points = codes.shape[0]
+    if n_values is None:
+        n_values = codes.max(axis=0).astype(np.int64) + 1
+    if isinstance(init, str) and init.lower() == "random":
+        centroids = codes[rng.choice(range(n_points), n_clusters)]
+    elif isinstance(init, str) and init.lower() == "huang":
+        centroids = init_huang(codes, n_clusters, matching_dissim, rng).astype(codes.dtype)
+    elif isinstance(init, str) and init.lower() == "cao":
+        centroids = init_cao(codes, n_clusters, matching_dissim).astype(codes.dtype)
+    elif hasattr(init, "__array__"):
+        centroids = np.asarray(init, dtype=codes.dtype)
+    else:
+        logger.error("The init method %s is not one of random, huang, cao.", str(init))
+        raise ValueError(f"The init method {init} is not supported.")
+
+    # initial assignment and mode update; empty clusters get random attribute values
+    labels = mismatch(codes, centroids).argmin(axis=1)
+    centroids, sizes = cluster_modes(codes, labels, n_clusters, n_values)
+    for ik in np.flatnonzero(sizes == 0):
+        for iattr in range(codes.shape[1]):
+            centroids[ik, iattr] = rng.choice(codes[:, iattr])
+    distances = mismatch(codes, centroids)
+    labels = distances.argmin(axis=1)
+    cost = distances[np.arange(n_points), labels].sum()
+
+    n_iter = 0
+    converged = False
+    while n_iter < max_iter and not converged:
+        n_iter += 1
+        centroids, sizes = cluster_modes(codes, labels, n_clusters, n_values)
+        # an empty cluster restarts from a random point of the largest cluster
+        for ik in np.flatnonzero(sizes == 0):
+            members = np.flatnonzero(labels == sizes.argmax())
+            centroids[ik] = codes[rng.choice(members)]
+        distances = mismatch(codes, centroids)
+        new_labels = distances.argmin(axis=1)
+        new_cost = distances[np.arange(n_points), new_labels].sum()
+        moves = int((new_labels != labels).sum())
+        converged = moves == 0 or new_cost >= cost
+        labels, cost = new_labels, new_cost
+
+    return centroids, labels, float(cost), n_iter
+
+class NumpyKModes:
+    """k-modes clustering with the same parameters and fitted attributes as
+    kmodes.kmodes.KModes (cluster_centroids_, labels_, cost_, n_iter_).
+
+    Args:
+        n_clusters (int): number of clusters
+        init (str): "random", "huang" or "cao"
+        n_init (int): number of restarts; the one with the lowest cost is kept
+        max_iter (int): maximum number of iterations of a restart
+        random_state (int): random state for the restarts
+    """
+    def __init__(self, n_clusters: int = 8, init: str = "random", n_init: int = 10,
+                 max_iter: int = 100, random_state: Optional[int] = None):
+        self.n_clusters = n_clusters
+        self.init = init
+        self.n_init = n_init
+        self.max_iter = max_iter
+        self.random_state = random_state
+
+    def fit(self, X, y=None): # pylint: disable=invalid-name,unused-argument
+        """fit the model on categorical data
+
+        Args:
+            X (pd.DataFrame or np.ndarray): the data used for clustering
+
+        Returns:
+            NumpyKModes: the fitted model
+        """
+        columns = _columns(X)
+        encoded = [np.unique(column, return_inverse=True) for column in columns]
+        self.categories_ = [categories for categories, _ in encoded]
+        codes = np.column_stack([inverse.reshape(-1) for _, inverse in encoded]).astype(np.int32)
+        n_values = np.array([len(categories) for categories in self.categories_], dtype=np.int64)
+
+        n_clusters, init, max_iter = self.n_clusters, self.init, self.max_iter
+        # same shortcut as KModes: fewer unique rows than clusters
+        unique = get_unique_rows(codes)
+        if unique.shape[0] <= n_clusters:
+            n_clusters, init, max_iter = unique.shape[0], unique, 0
+        # the same restart seeds as KModes; deterministic inits are fitted once
+        n_init = self.n_init if isinstance(init, str) and init.lower() != "cao" else 1
+        seeds = np.random.RandomState(self.random_state).randint(np.iinfo(np.int32).max, size=n_init)
+
+        best = None
+        for seed in seeds:
+            result = kmodes_single(codes, n_clusters, init, max_iter, seed, n_values)
+            if best is None or result[2] < best[2]:
+                best = result
+        centroids, self.labels_, self.cost_, self.n_iter_ = best
+        self._centroid_codes = centroids
+        self.cluster_centroids_ = np.column_stack(
+            [self.categories_[iattr][centroids[:, iattr]] for iattr in range(centroids.shape[1])])
+        return self
+
+    def predict(self, X) -> np.ndarray: # pylint: disable=invalid-name
+        """assign new points to the closest modes. Values not seen in fit never match.
+
+        Args:
+            X (pd.DataFrame or np.ndarray): the data to assign
+
+        Returns:
+            np.ndarray: the cluster of every point
+        """
+        codes = []
+        for categories, column in zip(self.categories_, _columns(X)):
+            index = np.searchsorted(categories, column).clip(max=len(categories) - 1)
+            codes.append(np.where(categories[index] == column, index, -1))
+        return mismatch(np.column_stack(codes).astype(np.int32), self._centroid_codes).argmin(axis=1)
+
+    def fit_predict(self, X, y=None) -> np.ndarray: # pylint: disable=invalid-name
+        """fit the model and return the cluster of every point"""
+        return self.fit(X, y).labels_
+
+class MiniBatchKModes:
+    """k-modes clustering on integer codes that never holds the whole data. The data
+    is read in batches; every batch is assigned to the current modes, its codes are
+    added to per-cluster counts, and the modes are updated from the counts of the epoch
+    so far. Memory is bounded by the batch size and the counts (n_clusters x number of
+    codes), plus one label per point if keep_labels is set.
+
+    The modes are initialized by fitting NumpyKModes restarts on the first batch.
+
+    Args:
+        n_clusters (int): number of clusters
+        init (str): "random", "huang" or "cao", used on the first batch
+        n_init (int): number of restarts on the first batch
+        max_iter (int): maximum number of epochs (passes over the data)
+        batch_size (int): number of rows in a batch when fitting in-memory data
+        tol (float): stop when an epoch lowers the cost by less than this fraction
+        keep_labels (bool): keep the cluster of every point in labels_
+        random_state (int): random state for the initialization
+    """
+    def __init__(self, n_clusters: int = 8, init: str = "random", n_init: int = 10,
+                 max_iter: int = 20, batch_size: int = BATCH_SIZE, tol: float = 1e-4,
+                 keep_labels: bool = True, random_state: Optional[int] = None):
+        if batch_size < 1:
+            logger.error("The batch size should be at least 1.")
+            raise ValueError("batch_size should be at least 1.")
+        self.n_clusters = n_clusters
+        self.init = init
+        self.n_init = n_init
+        self.max_iter = max_iter
+        self.batch_size = batch_size
+        self.tol = tol
+        self.keep_labels = keep_labels
+        self.random_state = random_state
+
+    def fit(self, X, y=None): # pylint: disable=invalid-name,unused-argument
+        """fit the model on integer coded data
+
+        Args:
+            X (pd.DataFrame, np.ndarray or Callable): the data, or a function returning a
+                new iterator over its chunks (called once per epoch)
+
+        Returns:
+            MiniBatchKModes: the fitted model
+        """
+        batches = self._batches(X)
+        centroids = None
+        n_points = 0
+        cost = None
+        for epoch in range(1, self.max_iter + 1):
+            counts = []
+            epoch_cost = 0
+            for codes in batches():
+                if centroids is None:
+                    centroids = self._init_centroids(codes)
+                epoch_cost += self._partial_fit(codes, centroids, counts)
+                if epoch == 1:
+                    n_points += codes.shape[0]
+            if centroids is None:
+                logger.error("The data to fit has no rows.")
+                raise ValueError("There is no data to fit.")
+            logger.debug("Epoch %i, cost %i", epoch, epoch_cost)
+            converged = cost is not None and cost - epoch_cost <= self.tol * cost
+            cost = epoch_cost
+            self.n_iter_ = epoch
+            if converged:
+                break
+
+        # the cost and the labels of the final modes
+        self.cluster_centroids_ = centroids
+        labels = []
+        self.cost_ = 0.0
+        for codes in batches():
+            distances = mismatch(codes, centroids)
+            batch_labels = distances.argmin(axis=1).astype(np.int32)
+            self.cost_ += float(distances[np.arange(codes.shape[0]), batch_labels].sum())
+            if self.keep_labels:
+                labels.append(batch_labels)
+        self.labels_ = np.concatenate(labels) if self.keep_labels else None
+        logger.info("Mini-batch k-modes on %i rows converged after %i epochs with cost %i.",
+                    n_points, self.n_iter_, self.cost_)
+        return self
+
+    def predict(self, X) -> np.ndarray: # pylint: disable=invalid-name
+        """assign points to the closest modes
+
+        Args:
+            X (pd.DataFrame, np.ndarray or Callable): integer coded data, or a function
+                returning an iterator over its chunks
+
+        Returns:
+            np.ndarray: the cluster of every point
+        """
+        return np.concatenate([mismatch(codes, self.cluster_centroids_).argmin(axis=1)
+                               for codes in self._batches(X)()])
+
+    def fit_predict(self, X, y=None) -> np.ndarray: # pylint: disable=invalid-name
+        """fit the model and return the cluster of every point"""
+        return self.fit(X, y).labels_
+
+    def _batches(self, X) -> Callable[[], Iterator[np.ndarray]]: # pylint: disable=invalid-name
+        """a function returning a new iterator over the batches of X as integer codes"""
+        if callable(X):
+            return lambda: (_codes(chunk) for chunk in X())
+        codes = _codes(X)
+        return lambda: (codes[start:start + self.batch_size]
+                        for start in range(0, codes.shape[0], self.batch_size))
+
+    def _init_centroids(self, codes: np.ndarray) -> np.ndarray:
+        """the modes of the best NumpyKModes restart on the first batch"""
+        n_clusters = min(self.n_clusters, codes.shape[0])
+        model = NumpyKModes(n_clusters=n_clusters, init=self.init, n_init=self.n_init,
+                            random_state=self.random_state).fit(codes)
+        centroids = np.zeros((self.n_clusters, codes.shape[1]), dtype=np.int32)
+        centroids[:model.cluster_centroids_.shape[0]] = model.cluster_centroids_
+        return centroids
+
+    def _partial_fit(self, codes: np.ndarray, centroids: np.ndarray, counts: list) -> int:
+        """assign a batch, add its codes to the counts and update the modes in place
+
+        Returns:
+            int: the cost of the batch under the modes it was assigned to
+        """
+        distances = mismatch(codes, centroids)
+        labels = distances.argmin(axis=1).astype(np.int64)
+        cost = int(distances[np.arange(codes.shape[0]), labels].sum())
+        seen = None
+        for iattr in range(codes.shape[1]):
+            n_value = int(codes[:, iattr].max()) + 1
+            if len(counts) <= iattr:
+                counts.append(np.zeros((self.n_clusters, n_value), dtype=np.int64))
+            elif counts[iattr].shape[1] < n_value:
+                counts[iattr] = np.pad(counts[iattr], ((0, 0), (0, n_value - counts[iattr].shape[1])))
+            n_value = counts[iattr].shape[1]
+            counts[iattr] += np.bincount(labels * n_value + codes[:, iattr],
+                                         minlength=self.n_clusters * n_value
+                                         ).reshape(self.n_clusters, n_value)
+            if seen is None:
+                seen = counts[iattr].sum(axis=1) > 0
+            centroids[seen, iattr] = counts[iattr][seen].argmax(axis=1)
+        return cost
+
+def _codes(X) -> np.ndarray: # pylint: disable=invalid-name
+    """a dataframe or array of non-negative integer codes as an int32 matrix
+
+    Raises:
+        TypeError: if the data is not integer coded
+        ValueError: if there are negative (missing) codes
+    """
+    codes = np.asarray(X)
+    if not np.issubdtype(codes.dtype, np.integer):
+        logger.error("The mini-batch engine needs integer coded data, not %s.", codes.dtype)
+        raise TypeError("The data should be integer codes (see src.encoding).")
+    if codes.size and codes.min() < 0:
+        logger.error("The data has missing (negative) codes.")
+        raise ValueError("The data should not have missing values.")
+    return codes.astype(np.int32, copy=False)
+
+def _columns(X) -> list: # pylint: disable=invalid-name
+    """the columns of a dataframe or 2d array as numpy arrays"""
+    if isinstance(X, pd.DataFrame):
+        return [np.asarray(X[column]) for column in X.columns]
+    X = np.asarray(X)
+    return [X[:, iattr] for iattr in range(X.shape[1])]
@@ -0,0 +1,241 @@
+"""
+This module includes the request metrics of the web apps (app.py and asgi.py): latency
+histograms of the requests and of their phases (lookup, render), counters of the
+responses and of the lookup outcomes, and the hit ratio of the recommendation cache.
+They are rendered as text in the Prometheus exposition format for the /metrics route.
+The metrics are kept in the memory of the process; every worker reports its own.
+"""
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# upper bounds in seconds of the latency buckets, from a cache hit to a slow database
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_value(value: float) -> str:
+    """a sample value as Prometheus writes it"""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+def format_labels(labels: Dict[str, str]) -> str:
+    """{name="value",...} with the values escaped, empty without labels"""
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Metric:
+    """A metric with a fixed set of label names and one series per combination of
+    label values.
+
+    Args:
+        name (str): the metric name
+        documentation (str): the help text
+        labelnames (Sequence): the names of the labels
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        """the label values in the order of the label names"""
+        if set(labels) != set(self.labelnames):
+            logger.error("The labels of %s are %s, not %s.", self.name, str(self.labelnames), str(sorted(labels)))
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}.")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """(sample name, labels, value) of every series"""
+        raise NotImplementedError
+
+class Counter(Metric):
+    """A value that only goes up, e.g. the number of responses."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        """add amount to the series of the labels
+
+        Raises:
+            ValueError: if amount is negative or the labels are not the label names
+        """
+        if amount < 0:
+            logger.error("Counters can only increase, %s was increased by %s.", self.name, str(amount))
+            raise ValueError("amount should not be negative.")
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        """the value of the series of the labels"""
+        return self._series.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            series = sorted(self._series.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in series]
+
+class Histogram(Metric):
+    """Counts of observations in cumulative buckets, with their sum and count.
+
+    Args:
+        name (str): the metric name
+        documentation (str): the help text
+        labelnames (Sequence): the names of the labels
+        buckets (Sequence): the upper bounds of the buckets, in increasing order
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        """count one observation in the series of the labels"""
+        key = self._key(labels)
+        # the first bucket whose upper bound is not below the value
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._series[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """observe the seconds the block took, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        samples = []
+        for key, (counts, total) in series:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+class CallbackMetric(Metric):
+    """A metric without labels whose value is read from a function when it is exposed,
+    e.g. the hits of the recommendation cache.
+
+    Args:
+        name (str): the metric name
+        documentation (str): the help text
+        func (Callable): returns the current value
+        kind (str): "gauge" or "counter"
+    """
+    def __init__(self, name: str, documentation: str, func: Callable[[], float], kind: str = "gauge"):
+        super().__init__(name, documentation)
+        self.func = func
+        self.kind = kind
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        return [(self.name, {}, float(self.func()))]
+
+class Registry:
+    """The metrics exposed together on one /metrics route."""
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        """add a metric
+
+        Raises:
+            ValueError: if a metric of the same name is already registered
+
+        Returns:
+            Metric: the metric
+        """
+        if any(registered.name == metric.name for registered in self.metrics):
+            logger.error("A metric named %s is already registered.", metric.name)
+            raise ValueError(f"{metric.name} is already registered.")
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        """all the metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+class ServingMetrics:
+    """The metrics of a web app.
+
+    Args:
+        cache (RecommendationCache): the recommendation cache whose hits are exposed, if any
+        prefix (str): the prefix of the metric names
+    """
+    def __init__(self, cache=None, prefix: str = "recommender"):
+        self.registry = Registry()
+        self.request_seconds = self.registry.register(Histogram(
+            f"{prefix}_request_seconds", "Latency of the requests in seconds.", ["endpoint"]))
+        self.responses = self.registry.register(Counter(
+            f"{prefix}_responses_total", "Responses by endpoint and status code.", ["endpoint", "status"]))
+        self.phase_seconds = self.registry.register(Histogram(
+            f"{prefix}_phase_seconds", "Latency of the phases of the requests (lookup, render) in seconds.",
+            ["endpoint", "phase"]))
+        self.lookups = self.registry.register(Counter(
+            f"{prefix}_lookups_total", "Villagers looked up, by outcome (found, not_found, error).",
+            ["endpoint", "outcome"]))
+        if cache is not None:
+            self.registry.register(CallbackMetric(
+                f"{prefix}_cache_hits_total", "Lookups answered by the recommendation cache.",
+                lambda: cache.hits, kind="counter"))
+            self.registry.register(CallbackMetric(
+                f"{prefix}_cache_misses_total", "Lookups the recommendation cache had to load.",
+                lambda: cache.misses, kind="counter"))
+            self.registry.register(CallbackMetric(
+                f"{prefix}_cache_hit_ratio", "Share of the lookups answered by the recommendation cache.",
+                lambda: cache.hits / max(cache.hits + cache.misses, 1)))
+            self.registry.register(CallbackMetric(
+                f"{prefix}_cache_entries", "Villagers in the recommendation cache.", lambda: len(cache)))
+
+    def phase(self, endpoint: str, phase: str):
+        """context manager timing a phase of a request"""
+        return self.phase_seconds.time(endpoint=endpoint, phase=phase)
+
+    def count(self, endpoint: str, outcome: str, amount: int = 1) -> None:
+        """count looked up villagers by outcome"""
+        if amount:
+            self.lookups.inc(amount, endpoint=endpoint, outcome=outcome)
+
+    def observe_request(self, endpoint: Optional[str], status: int, seconds: float) -> None:
+        """record a finished request"""
+        endpoint = endpoint or "unknown"
+        self.request_seconds.observe(seconds, endpoint=endpoint)
+        self.responses.inc(endpoint=endpoint, status=status)
+
+    def expose(self) -> str:
+        """the metrics in the Prometheus text exposition format"""
+        return self.registry.expose()
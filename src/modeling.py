@@ -1,15 +1,24 @@
 import logging
+import os
 import sys
-from typing import List
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple, Union
 import joblib
 import pandas as pd
 from kmodes.kmodes import KModes
 import matplotlib.pyplot as plt
 
-from src.modeling_helper import create_rec_table
+from src.artifacts import iter_table, read_table, table_columns, write_chunks, write_table
+from src.encoding import decode_df, load_vocabulary, read_encoded
+from src.instrumentation import add_rows, instrumented
+from src.kmodes_engine import BATCH_SIZE, make_model
+from src.rec_store import write_rec_store
+from src.modeling_helper import (adaptive_sweep, chunks_checksum, create_rec_table, data_checksum,
+                                  find_knee, parallel_sweep)
 
 logger = logging.getLogger(__name__)
 
+@instrumented(rows_in=None, rows_out=None)
 def kmodes_modeling(filename: str,
                     feature_not_used: List,
                     k_start: int,
@@ -19,11 +28,18 @@ def kmodes_modeling(filename: str,
                     random_state: int,
                     pngpath: str,
                     df_model_path: str,
-                    result_path: str) -> None:
+                    result_path: str,
+                    n_jobs: int = 1,
+                    search: str = "exhaustive",
+                    adaptive: Optional[Dict] = None,
+                    engine: str = "kmodes",
+                    engine_options: Optional[Dict] = None,
+                    vocab_path: Optional[str] = None,
+                    artifact_options: Optional[Dict] = None) -> None:
     """perform kmodes training, save a cost vs. cluster image and a final selected model.
 
     Args:
-        filename (str): input csv file path
+        filename (str): input file path of the encoded data
         feature_not_used (List): features that should not be included in the modeling
         k_start (int): start of k for the kmode model
         k_end (int): end of k for the kmode model
@@ -31,51 +47,185 @@ def kmodes_modeling(filename: str,
         n_init (int): number of items in each cluster at first (kmode param)
         random_state (int): random state for kmode
         pngpath (str): the path to save the png file
+        df_model_path (str): the path to save the data used for modeling
+        result_path (str): the path to save the K and cost table
+        n_jobs (int): number of worker processes for the sweep. 1 fits every (k, restart)
+            in this process, anything else spreads them over a process pool.
+        search (str): "exhaustive" fits every k with n_init restarts, "adaptive" refines
+            only the k around the knee of a coarse pass
+        adaptive (Dict): coarse_n_init, coarse_step and refine_width of the adaptive search
+        engine (str): "kmodes" for the kmodes package, "numpy" or "minibatch" for
+            src.kmodes_engine. "minibatch" streams the data in batches instead of reading it.
+        engine_options (Dict): parameters of the engine (e.g. batch_size of minibatch)
+        vocab_path (str): the path of the vocabulary, used to read the codes as small integers
+        artifact_options (Dict): compression and categorical options for writing df_model
     """
+    if engine == "minibatch":
+        batch_size = (engine_options or {}).get("batch_size", BATCH_SIZE)
+        try:
+            # stream the encoded data into df_model, then sweep over its batches
+            chunks = (chunk.drop(columns=feature_not_used) for chunk in iter_table(filename, batch_size))
+            n_rows = write_chunks(chunks, df_model_path, **(artifact_options or {}))
+            add_rows(rows_in=n_rows)
+            logger.info("%i rows of %s are written to %s in batches.", n_rows, filename, df_model_path)
+        except FileNotFoundError:
+            logger.error("Cannot find %s", filename)
+            sys.exit(1)
+        result_table = cost_table(partial(iter_table, df_model_path, batch_size), k_start, k_end,
+                                  init, n_init, random_state, n_jobs=n_jobs, search=search,
+                                  adaptive=adaptive, engine=engine, engine_options=engine_options)
+        save_elbow_results(result_table, pngpath=pngpath, result_path=result_path)
+        return
+
     try:
-        # read in the cleaned data
-        df_all = pd.read_csv(filename)
+        # read in the encoded data
+        df_all = read_encoded(filename, load_vocabulary(vocab_path)) if vocab_path else read_table(filename)
         logger.info("The dataset path %s is loaded and it has %i columns.", filename, df_all.shape[1])
+        add_rows(rows_in=len(df_all))
     except FileNotFoundError:
         logger.error("Cannot find %s", filename)
         sys.exit(1)
 
+    df, result_table = elbow_sweep(df_all, feature_not_used, k_start, k_end, init, n_init,
+                                   random_state, n_jobs=n_jobs, search=search, adaptive=adaptive,
+                                   engine=engine, engine_options=engine_options)
+
+    # save this df_model for further use.
+    write_table(df, df_model_path, **(artifact_options or {}))
+
+    save_elbow_results(result_table, pngpath=pngpath, result_path=result_path)
+
+@instrumented()
+def elbow_sweep(df_all: pd.DataFrame,
+                feature_not_used: List,
+                k_start: int,
+                k_end: int,
+                init: str,
+                n_init: int,
+                random_state: int,
+                n_jobs: int = 1,
+                search: str = "exhaustive",
+                adaptive: Optional[Dict] = None,
+                engine: str = "kmodes",
+                engine_options: Optional[Dict] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """drop the features that are not used and compute the kmodes cost for the k in the
+    range, then mark the k at the knee of the cost curve as the selected one.
+
+    Args:
+        df_all (pd.DataFrame): the encoded data
+        feature_not_used (List): features that should not be included in the modeling
+        k_start (int): start of k for the kmode model
+        k_end (int): end of k for the kmode model
+        init (str): init method (kmode param)
+        n_init (int): number of items in each cluster at first (kmode param)
+        random_state (int): random state for kmode
+        n_jobs (int): number of worker processes for the sweep
+        search (str): "exhaustive" or "adaptive"
+        adaptive (Dict): coarse_n_init, coarse_step and refine_width of the adaptive search
+        engine (str): "kmodes", "numpy" or "minibatch"
+        engine_options (Dict): parameters of the engine
+
+    Returns:
+        pd.DataFrame: the data used for modeling
+        pd.DataFrame: the K, cost, n_init and selected table
+    """
     # drop the features that are not used
     df = df_all.drop(columns = feature_not_used) # pylint: disable=no-member
     logger.info("Columns used for kmodes clustering are %s", str(df.columns.values.tolist()))
 
-    # save this df_model for further use.
-    df.to_csv(df_model_path, index=False)
+    return df, cost_table(df, k_start, k_end, init, n_init, random_state, n_jobs=n_jobs,
+                          search=search, adaptive=adaptive, engine=engine,
+                          engine_options=engine_options)
+
+@instrumented(rows_out=None)
+def cost_table(data: Union[pd.DataFrame, Callable],
+               k_start: int,
+               k_end: int,
+               init: str,
+               n_init: int,
+               random_state: int,
+               n_jobs: int = 1,
+               search: str = "exhaustive",
+               adaptive: Optional[Dict] = None,
+               engine: str = "kmodes",
+               engine_options: Optional[Dict] = None) -> pd.DataFrame:
+    """compute the kmodes cost for the k in the range and mark the k at the knee of the
+    cost curve as the selected one.
+
+    Args:
+        data (pd.DataFrame or Callable): the data used for modeling, or (for the
+            minibatch engine) a function returning an iterator over its chunks
+        k_start (int): start of k for the kmode model
+        k_end (int): end of k for the kmode model
+        init (str): init method (kmode param)
+        n_init (int): number of items in each cluster at first (kmode param)
+        random_state (int): random state for kmode
+        n_jobs (int): number of worker processes for the sweep
+        search (str): "exhaustive" or "adaptive"
+        adaptive (Dict): coarse_n_init, coarse_step and refine_width of the adaptive search
+        engine (str): "kmodes", "numpy" or "minibatch"
+        engine_options (Dict): parameters of the engine
+
+    Raises:
+        ValueError: if the search mode is not supported
+
+    Returns:
+        pd.DataFrame: the K, cost, n_init and selected table
+    """
+    if search not in ("exhaustive", "adaptive"):
+        logger.error("The search mode %s is not one of exhaustive, adaptive.", search)
+        raise ValueError(f"The search mode {search} is not supported.")
 
     # start the training process
     logger.debug("Kmodes training starts")
-    cost = []
-    k = range(k_start, k_end)
-    for num_clusters in list(k):
-        logger.debug("running n_cluster = %i", num_clusters)
-        kmode = KModes(n_clusters = num_clusters, init = init, n_init = n_init, random_state=random_state)
-        kmode.fit_predict(df)
-        cost.append(kmode.cost_)
-        logger.debug("The cost is %i", kmode.cost_)
+    if search == "adaptive":
+        result_table = adaptive_sweep(data, k_start, k_end, init=init, n_init=n_init,
+                                      random_state=random_state, n_jobs=n_jobs, engine=engine,
+                                      engine_options=engine_options, **(adaptive or {}))
+    else:
+        k = list(range(k_start, k_end))
+        cost = parallel_sweep(data, k, init=init, n_init=n_init, random_state=random_state,
+                              n_jobs=n_jobs, engine=engine, engine_options=engine_options)
+        chosen = find_knee(k, cost)
+        result_table = pd.DataFrame({"K": k, "cost": cost, "n_init": n_init,
+                                     "selected": [num_clusters == chosen for num_clusters in k]})
+    for num_clusters, num_cost in zip(result_table["K"], result_table["cost"]):
+        logger.debug("The cost for n_cluster = %i is %i", num_clusters, num_cost)
+    logger.info("The knee of the cost curve is at k = %i.",
+                result_table.loc[result_table["selected"], "K"].iloc[0])
+
+    return result_table
 
+def save_elbow_results(result_table: pd.DataFrame, pngpath: str, result_path: str) -> None:
+    """save the cost vs. cluster plot and the K and cost table.
+
+    Args:
+        result_table (pd.DataFrame): the K and cost table
+        pngpath (str): the path to save the png file
+        result_path (str): the path to save the K and cost table
+    """
     # plot the cost vs cluster plot
     logger.info("Finished the training process. Saving a plot to %s", pngpath)
-    plt.plot(k, cost, "bx-")
+    plt.plot(result_table["K"], result_table["cost"], "bx-")
     plt.xlabel("No. of clusters")
     plt.ylabel("Cost")
     plt.title("Elbow Method For Optimal k")
     plt.savefig(pngpath, transparent=True)
 
     # save the result kmodes K and cost table
-    result_table = pd.DataFrame({"K": k, "cost": cost})
     result_table.to_csv(result_path, index=False)
 
+@instrumented(rows_in=None, rows_out=None)
 def form_final_model(final_n_cluster: int,
                      init: str,
                      n_init: int,
                      random_state: int,
-                     model_path: str) -> None:
-    """this function will export the final model
+                     model_path: str,
+                     filename_model: str,
+                     engine: str = "kmodes",
+                     engine_options: Optional[Dict] = None) -> None:
+    """this function will fit the final model once and export it, together with a
+    checksum of the data it was trained on.
 
     Args:
         init (str): init method (kmode param)
@@ -83,75 +233,257 @@ def form_final_model(final_n_cluster: int,
         random_state (int): random_state for this model
         model_path (str): the path to save the model
         final_n_cluster (str): number of clusters for the final model
+        filename_model (str): input file path of the data used for modeling
+        engine (str): "kmodes" for the kmodes package, "numpy" or "minibatch" for
+            src.kmodes_engine. "minibatch" streams the data in batches instead of reading it.
+        engine_options (Dict): parameters of the engine (e.g. batch_size of minibatch)
     """
     logger.debug("entered the form final model step.")
-    # save the final model
-    final_model = KModes(n_clusters=final_n_cluster, init = init, n_init = n_init, random_state=random_state)
-    joblib.dump(final_model, model_path)
+    if engine == "minibatch":
+        chunks = partial(iter_table, filename_model, (engine_options or {}).get("batch_size", BATCH_SIZE))
+        try:
+            final_model = make_model(engine, n_clusters=final_n_cluster, init=init, n_init=n_init,
+                                     random_state=random_state, **(engine_options or {})).fit(chunks)
+        except FileNotFoundError:
+            logger.error("Cannot find %s", filename_model)
+            sys.exit(1)
+        logger.info("The final model is fitted. The cost is %i", final_model.cost_)
+        save_model(final_model, None, model_path, checksum=chunks_checksum(chunks()))
+        return
+
+    try:
+        df_model = read_table(filename_model)
+        logger.info("The dataset path %s is loaded and it has %i columns.", filename_model, df_model.shape[1])
+        add_rows(rows_in=len(df_model))
+    except FileNotFoundError:
+        logger.error("Cannot find %s", filename_model)
+        sys.exit(1)
+
+    # fit and save the final model
+    final_model = fit_final_model(df_model, final_n_cluster, init, n_init, random_state,
+                                  engine=engine, engine_options=engine_options)
+    save_model(final_model, df_model, model_path)
+
+@instrumented(rows_out=None)
+def fit_final_model(df_model: pd.DataFrame,
+                    final_n_cluster: int,
+                    init: str,
+                    n_init: int,
+                    random_state: int,
+                    engine: str = "kmodes",
+                    engine_options: Optional[Dict] = None) -> KModes:
+    """fit the final model on the data used for modeling.
+
+    Args:
+        df_model (pd.DataFrame): the data used for modeling
+        final_n_cluster (str): number of clusters for the final model
+        init (str): init method (kmode param)
+        n_init (int): init method (kmode param)
+        random_state (int): random_state for this model
+        engine (str): "kmodes", "numpy" or "minibatch"
+        engine_options (Dict): parameters of the engine
+
+    Returns:
+        KModes: the fitted model (a model of src.kmodes_engine with the same attributes
+            for the other engines)
+    """
+    final_model = make_model(engine, n_clusters=final_n_cluster, init=init, n_init=n_init,
+                             random_state=random_state, **(engine_options or {}))
+    final_model.fit(df_model)
+    logger.info("The final model is fitted. The cost is %i", final_model.cost_)
+    return final_model
+
+def save_model(model: KModes, df_model: Optional[pd.DataFrame], model_path: str,
+               checksum: Optional[str] = None) -> None:
+    """save a fitted model along with the checksum of its training data.
+
+    Args:
+        model (KModes): the fitted model
+        df_model (pd.DataFrame): the data the model was fitted on
+        model_path (str): the path to save the model
+        checksum (str): the checksum of the data, if df_model is not in memory
+    """
+    checksum = checksum or data_checksum(df_model)
+    joblib.dump({"model": model, "data_checksum": checksum}, model_path)
     logger.info("The final model is saved to %s", model_path)
 
+@instrumented(rows_out=None)
+def load_model(model_path: str, df_model: Union[pd.DataFrame, Callable]) -> KModes:
+    """load the fitted final model. The model is only refitted (and saved again) if
+    the data it was trained on is not the same as df_model.
+
+    Args:
+        model_path (str): the path to load the model
+        df_model (pd.DataFrame or Callable): the data used for modeling, or (for the
+            minibatch engine) a function returning an iterator over its chunks
+
+    Returns:
+        KModes: a model whose labels_ and cost_ describe df_model
+    """
+    streamed = callable(df_model)
+    checksum = chunks_checksum(df_model()) if streamed else data_checksum(df_model)
+    artifact = joblib.load(model_path)
+    if isinstance(artifact, dict) and artifact.get("data_checksum") == checksum:
+        logger.info("Reusing the fitted model from %s.", model_path)
+        return artifact["model"]
+
+    # an older unfitted model or a model trained on different data
+    logger.warning("The model in %s was not fitted on this data. Refitting it.", model_path)
+    model = artifact["model"] if isinstance(artifact, dict) else artifact
+    model.fit(df_model)
+    save_model(model, None if streamed else df_model, model_path, checksum=checksum)
+    return model
+
+def model_data(filename_model: str,
+               engine: str = "kmodes",
+               engine_options: Optional[Dict] = None) -> Union[pd.DataFrame, Callable]:
+    """the data used for modeling, as load_model takes it. The minibatch engine gets a
+    function returning an iterator over its batches, so the table is never read whole.
+
+    Args:
+        filename_model (str): input file path of the data used for modeling
+        engine (str): "kmodes", "numpy" or "minibatch"
+        engine_options (Dict): parameters of the engine (e.g. batch_size of minibatch)
+
+    Raises:
+        FileNotFoundError: if the file does not exist
+
+    Returns:
+        pd.DataFrame or Callable: the table, or the function returning its chunks
+    """
+    if engine == "minibatch":
+        if not os.path.isfile(filename_model):
+            raise FileNotFoundError(filename_model)
+        return partial(iter_table, filename_model, (engine_options or {}).get("batch_size", BATCH_SIZE))
+    df_model = read_table(filename_model)
+    logger.info("The dataset path %s is loaded and it has %i columns.", filename_model, df_model.shape[1])
+    add_rows(rows_in=len(df_model))
+    return df_model
+
+@instrumented(rows_in=None, rows_out=None)
 def recommendation(filename_model: str,
-                   filename_clean: str,
+                   filename_encoded: str,
+                   vocab_path: str,
                    drop_list: List,
                    model_path: str,
-                   recommendation_path: str) -> None:
-    """This function will create the recommendation file and save it to csv.
+                   recommendation_path: str,
+                   top_n: Optional[int] = None,
+                   artifact_options: Optional[Dict] = None,
+                   store_path: Optional[str] = None,
+                   engine: str = "kmodes",
+                   engine_options: Optional[Dict] = None) -> None:
+    """This function will create the recommendation file and save it to csv. The table is
+    built on the integer codes and only decoded when it is written. With the minibatch
+    engine the data used for modeling is streamed; the encoded data and the table are
+    still held in memory, since every villager is ranked against its whole cluster.
 
     Args:
-        filename (str): input csv file path
+        filename_model (str): input file path of the data used for modeling
+        filename_encoded (str): input file path of the encoded data
+        vocab_path (str): the path of the vocabulary of the encoded data
         drop_list (List): the list of features that should not be included in the final recommendation
         model_path (str): the path to load the model
         recommendation_path (str): the path to save the final recommendation
+        top_n (int): number of ranked recommendations kept per villager. None keeps all cluster-mates.
+        artifact_options (Dict): compression and categorical options for writing the recommendation
+        store_path (str): the path of the memory-mapped store of the recommendation for the app.
+            None does not write it.
+        engine (str): the engine of the model, "minibatch" streams the data used for modeling
+        engine_options (Dict): parameters of the engine (e.g. batch_size of minibatch)
     """
-    # read in the csv file
+    # read in the data
     try:
-        df_model = pd.read_csv(filename_model)
-        logger.info("The dataset path %s is loaded and it has %i columns.", filename_model, df_model.shape[1])
+        df_model = model_data(filename_model, engine, engine_options)
     except FileNotFoundError:
         logger.error("Cannot find %s", filename_model)
     try:
-        df_clean = pd.read_csv(filename_clean)
-        logger.info("The dataset path %s is loaded and it has %i columns.", filename_clean, df_clean.shape[1])
+        vocabulary = load_vocabulary(vocab_path)
+        df_encoded = read_encoded(filename_encoded, vocabulary)
+        logger.info("The dataset path %s is loaded and it has %i columns.", filename_encoded, df_encoded.shape[1])
     except FileNotFoundError:
-        logger.error("Cannot find %s", filename_clean)
-
-    # fit the final model
-    kmode_final = joblib.load(model_path)
+        logger.error("Cannot find %s", filename_encoded)
 
-    clusters = kmode_final.fit_predict(df_model)
-    logger.info("Kmode modeling finished! The cost is %i", kmode_final.cost_)
+    # load the fitted final model
+    kmode_final = load_model(model_path, df_model)
 
-    # Create the recommendation table.
-    joined = create_rec_table(df = df_clean, clusters = clusters, drop_list=drop_list)
+    joined = build_recommendations(table_columns(filename_model), df_encoded, vocabulary, kmode_final,
+                                   drop_list=drop_list, top_n=top_n)
 
+    add_rows(rows_in=len(df_encoded), rows_out=len(joined))
     # export the recommendation table to a csv
-    joined.to_csv(recommendation_path, index = False)
+    write_table(joined, recommendation_path, **(artifact_options or {}))
     logger.info("The table with clustering information is written to %s", recommendation_path)
+    if store_path is not None:
+        write_rec_store(joined, store_path)
 
+@instrumented()
+def build_recommendations(features: List,
+                          df_encoded: pd.DataFrame,
+                          vocabulary: Dict,
+                          model: KModes,
+                          drop_list: List,
+                          top_n: Optional[int] = None) -> pd.DataFrame:
+    """create the recommendation table from the clusters of the fitted model. The table
+    is built on the integer codes and decoded at the end.
+
+    Args:
+        features (List): the columns of the data used for modeling
+        df_encoded (pd.DataFrame): the encoded data
+        vocabulary (Dict): the vocabulary of the encoded data
+        model (KModes): the model fitted on the data used for modeling
+        drop_list (List): the list of features that should not be included in the final recommendation
+        top_n (int): number of ranked recommendations kept per villager. None keeps all cluster-mates.
+
+    Returns:
+        pd.DataFrame: the decoded recommendation table
+    """
+    clusters = model.labels_
+    logger.info("Kmode modeling finished! The cost is %i", model.cost_)
+
+    # Create the recommendation table.
+    joined = create_rec_table(df = df_encoded, clusters = clusters, drop_list=drop_list,
+                              top_n = top_n, features = features)
+    return decode_df(joined, vocabulary, suffix="_villager")
+
+@instrumented(rows_in=None, rows_out=None)
 def get_metric(filename_model: str,
                final_n_cluster: int,
                model_path: str,
-               metric_path: str)->None:
+               metric_path: str,
+               engine: str = "kmodes",
+               engine_options: Optional[Dict] = None)->None:
     """This function will create the a file to save the cost metric.
 
     Args:
-        filename_model (str): input csv file path
+        filename_model (str): input file path
         final_n_cluster (int): final number of cluster
         model_path (str): the path to load the model
         metric_path (str): the path to save the metric
+        engine (str): the engine of the model, "minibatch" streams the data used for modeling
+        engine_options (Dict): parameters of the engine (e.g. batch_size of minibatch)
     """
-    # read in the csv file
+    # read in the data
     try:
-        df_model = pd.read_csv(filename_model)
-        logger.info("The dataset path %s is loaded and it has %i columns.", filename_model, df_model.shape[1])
+        df_model = model_data(filename_model, engine, engine_options)
     except FileNotFoundError:
         logger.error("Cannot find %s", filename_model)
 
-    # fit the final model
-    kmode_final = joblib.load(model_path)
-    kmode_final.fit_predict(df_model)
-    logger.info("Reffiting the model to get the metric. The cost is %i", kmode_final.cost_)
+    # load the fitted final model
+    kmode_final = load_model(model_path, df_model)
+    logger.info("Loaded the model to get the metric. The cost is %i", kmode_final.cost_)
 
-    result_table = pd.DataFrame({"K": [final_n_cluster], "cost": [kmode_final.cost_]})
+    result_table = metric_table(kmode_final, final_n_cluster)
     result_table.to_csv(metric_path, index=False)
     logger.info("The performance metric is written to %s", metric_path)
+
+def metric_table(model: KModes, final_n_cluster: int) -> pd.DataFrame:
+    """the cost metric of the fitted final model.
+
+    Args:
+        model (KModes): the fitted final model
+        final_n_cluster (int): final number of cluster
+
+    Returns:
+        pd.DataFrame: the K and cost of the final model
+    """
+    return pd.DataFrame({"K": [final_n_cluster], "cost": [model.cost_]})
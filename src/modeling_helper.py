@@ -1,22 +1,114 @@
 """
 This module includes functions called in the modeling module.
 """
+import hashlib
 import logging
-from typing import List
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 import numpy as np
 import pandas as pd
+# _k_modes_single is private to kmodes, its signature is that of the 0.12 releases pinned
+# in requirements.txt
+from kmodes.kmodes import KModes, _k_modes_single # pylint: disable=protected-access
+from kmodes.util import get_unique_rows
+from kmodes.util.dissim import matching_dissim
+
+from src.instrumentation import add_record, enabled, instrumented, stage
+from src.kmodes_engine import ENGINES, kmodes_single, make_model
 
 logger = logging.getLogger(__name__)
 
+# encoded data (its unique rows and number of codes per column) shared by the workers
+# of the parallel elbow sweep
+_SWEEP_DATA = None
+_SWEEP_UNIQUE = None
+_SWEEP_N_VALUES = None
+
+def encode_columns(df: pd.DataFrame, features: List) -> np.ndarray:
+    """Integer code every feature column so that values can be compared as small ints.
+
+    Args:
+        df (pd.DataFrame): the dataframe to encode
+        features (List): the columns to encode
+
+    Returns:
+        np.ndarray: (n_rows, n_features) matrix of codes
+    """
+    codes = np.empty((df.shape[0], len(features)), dtype=np.int32)
+    for i, col in enumerate(features):
+        codes[:, i] = pd.factorize(df[col])[0]
+    return codes
+
+def rank_neighbors(codes: np.ndarray,
+                   clusters: np.array,
+                   top_n: Optional[int] = None,
+                   block_size: int = 1024) -> Tuple:
+    """Find the top_n most similar villagers from the same cluster for every villager.
+    Similarity is the number of matching attributes (Hamming similarity). Ties are
+    broken by row order so the ranking is deterministic.
+
+    Args:
+        codes (np.ndarray): (n_rows, n_features) integer coded attributes
+        clusters (np.array): the clustering result
+        top_n (int): number of neighbors to keep per villager. None keeps all cluster-mates.
+        block_size (int): number of villagers compared at once, which bounds the memory used
+
+    Returns:
+        Tuple: (villager row, neighbor row, rank, similarity) arrays, ordered by villager and rank
+    """
+    clusters = np.asarray(clusters)
+    src, dst, rank, sim = [], [], [], []
+    for cluster in np.unique(clusters):
+        members = np.flatnonzero(clusters == cluster)
+        n_members = members.shape[0]
+        keep = n_members - 1 if top_n is None else min(top_n, n_members - 1)
+        if keep <= 0:
+            continue
+        member_codes = codes[members]
+        for start in range(0, n_members, block_size):
+            block = member_codes[start:start + block_size]
+            n_block = block.shape[0]
+            # (n_block, n_members) count of matching attributes
+            similarity = (block[:, None, :] == member_codes[None, :, :]).sum(axis=2)
+            # higher similarity first, then lower row order; a villager is never its own neighbor
+            key = (n_members * (codes.shape[1] - similarity) + np.arange(n_members)).astype(np.int64)
+            key[np.arange(n_block), np.arange(start, start + n_block)] = np.iinfo(np.int64).max
+            if keep < n_members - 1:
+                top = np.argpartition(key, keep - 1, axis=1)[:, :keep]
+                top = np.take_along_axis(top, np.argsort(np.take_along_axis(key, top, axis=1), axis=1),
+                                         axis=1)
+            else:
+                top = np.argsort(key, axis=1)[:, :keep]
+
+            src.append(np.repeat(members[start:start + n_block], keep))
+            dst.append(members[top].ravel())
+            rank.append(np.tile(np.arange(1, keep + 1), n_block))
+            sim.append(np.take_along_axis(similarity, top, axis=1).ravel())
+
+    if not src:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty, empty
+    src, dst, rank, sim = (np.concatenate(arr) for arr in (src, dst, rank, sim))
+    order = np.lexsort((rank, src))
+    return src[order], dst[order], rank[order], sim[order]
+
+@instrumented()
 def create_rec_table(df: pd.DataFrame,
                      clusters: np.array,
-                     drop_list: List) -> pd.DataFrame:
-    """Create the recommendation table. Needs to join two df's together.
+                     drop_list: List,
+                     top_n: Optional[int] = None,
+                     features: Optional[List] = None) -> pd.DataFrame:
+    """Create the recommendation table. Every villager is paired with its top_n most
+    similar villagers from the same cluster, ranked by the number of matching attributes.
 
     Args:
         df (pd.DataFrame): the original dataframe
         clusters (np.array): the clustering result
         drop_list (List): the items that are not needed in the end result
+        top_n (int): number of recommendations per villager. None keeps all cluster-mates.
+        features (List): the columns compared for similarity. Defaults to every column but Name.
 
     Raises:
         ValueError: if the nrow of df doesn't match with the lenth of the cluter
@@ -30,19 +122,306 @@ def create_rec_table(df: pd.DataFrame,
     cluster_length = len(clusters)
 
     if df_nrows == cluster_length:
+        # the ids read from a categorical table become strings again, so the table (and the
+        # categories it is written with) does not depend on how the data was read
+        df = df.reset_index(drop=True).astype({col: object for col in df.columns
+                                               if isinstance(df[col].dtype, pd.CategoricalDtype)})
         df.insert(0, "Cluster", clusters, True)
     else:
         logger.error("nrow of df doesn't match with the lenth of the clutersing result.")
         raise ValueError("nrow of the df doesn't match length of the array.")
 
-    # perform merging
-    joined = df.merge(df, how="outer", on="Cluster",
-                    suffixes = ["_villager", ""])
+    if features is None:
+        features = [col for col in df.columns if col not in ("Cluster", "Name")]
+    codes = encode_columns(df, features)
+    src, dst, rank, _ = rank_neighbors(codes, df["Cluster"].values, top_n=top_n)
+
+    # lay the pairs out the same way a self merge on Cluster would
+    villager = df.iloc[src].drop(columns="Cluster").add_suffix("_villager")
+    neighbor = df.iloc[dst].drop(columns="Cluster")
+    joined = pd.concat([df["Cluster"].iloc[src].reset_index(drop=True),
+                        villager.reset_index(drop=True),
+                        neighbor.reset_index(drop=True)], axis=1)
     joined.drop(columns=drop_list, inplace=True)
-    joined = joined[joined.Name_villager!=joined.Name]
+    joined["Rank"] = rank
 
     # set a unique index for further use in creating the SQL table
     index_str = [int(x) for x in np.arange(0,joined.shape[0])]
     joined["Unique_id"] = index_str
 
     return joined
+
+def data_checksum(df: pd.DataFrame) -> str:
+    """Fingerprint the content of a dataframe, so that a persisted model can tell
+    whether it was trained on the same data.
+
+    Args:
+        df (pd.DataFrame): the data used for modeling
+
+    Returns:
+        str: sha256 hex digest of the column names and values
+    """
+    return chunks_checksum([df])
+
+def chunks_checksum(chunks: Iterable[pd.DataFrame]) -> str:
+    """data_checksum of a table read chunk by chunk. The rows are hashed one by one, so
+    the digest is the same as the one of the whole table.
+
+    Args:
+        chunks (Iterable): the chunks of the data used for modeling
+
+    Returns:
+        str: sha256 hex digest of the column names and values
+    """
+    digest = hashlib.sha256()
+    for i, chunk in enumerate(chunks):
+        if i == 0:
+            digest.update(",".join(map(str, chunk.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(chunk, index=False).values.tobytes())
+    return digest.hexdigest()
+
+def restart_seeds(random_state: int, n_init: int) -> np.ndarray:
+    """Draw the per-restart seeds the same way KModes does internally, so that each
+    (k, restart) work unit can be fitted on its own and still match a serial fit.
+
+    Args:
+        random_state (int): random state for kmode
+        n_init (int): number of restarts for each k
+
+    Returns:
+        np.ndarray: one seed per restart
+    """
+    return np.random.RandomState(random_state).randint(np.iinfo(np.int32).max, size=n_init)
+
+def init_sweep_worker(data: np.ndarray) -> None:
+    """Initializer of the process pool. Ships the encoded data to each worker once
+    instead of once per work unit.
+
+    Args:
+        data (np.ndarray): the integer encoded data used for clustering
+    """
+    global _SWEEP_DATA, _SWEEP_UNIQUE, _SWEEP_N_VALUES # pylint: disable=global-statement
+    _SWEEP_DATA = data
+    _SWEEP_UNIQUE = get_unique_rows(data)
+    _SWEEP_N_VALUES = data.max(axis=0).astype(np.int64) + 1
+
+def fit_restart(unit: Tuple) -> Tuple:
+    """Fit a single kmodes restart. This is one work unit of the parallel elbow sweep.
+
+    Args:
+        unit (Tuple): (num_clusters, init, max_iter, init_no, seed, engine)
+
+    Returns:
+        Tuple: (num_clusters, init_no, cost, wall seconds, CPU seconds)
+    """
+    start, start_cpu = time.perf_counter(), time.process_time()
+    num_clusters, init, max_iter, init_no, seed, engine = unit
+    data = _SWEEP_DATA
+    n_points, n_attrs = data.shape
+    n_clusters = num_clusters
+
+    # same shortcut as kmodes: if there are fewer unique rows than clusters,
+    # the unique rows are the centroids and no iteration is needed.
+    unique = _SWEEP_UNIQUE
+    if unique.shape[0] <= n_clusters:
+        n_clusters, init, max_iter = unique.shape[0], unique, 0
+
+    if engine == "numpy":
+        _, _, cost, _ = kmodes_single(data, n_clusters, init, max_iter, seed, _SWEEP_N_VALUES)
+    else:
+        _, _, cost, _, _ = _k_modes_single(data, n_clusters, n_points, n_attrs, max_iter,
+                                           matching_dissim, init, init_no, 0, seed)
+    return num_clusters, init_no, cost, time.perf_counter() - start, time.process_time() - start_cpu
+
+def parallel_sweep(df: Union[pd.DataFrame, Callable],
+                   k_list: List,
+                   init: str,
+                   n_init: int,
+                   random_state: int,
+                   n_jobs: int,
+                   max_iter: int = 100,
+                   engine: str = "kmodes",
+                   engine_options: Optional[Dict] = None) -> List:
+    """Run the elbow sweep with every (k, restart) pair as a separate work unit in a
+    process pool (or in this process if n_jobs is 1). The data is encoded only once and
+    the restarts use the seeds a serial KModes fit would use, so the best cost per k is
+    the same as fitting KModes for each k one after another.
+
+    Args:
+        df (pd.DataFrame): the data used for clustering
+        k_list (List): the numbers of clusters to try
+        init (str): init method (kmode param)
+        n_init (int): number of restarts for each k (kmode param)
+        random_state (int): random state for kmode
+        n_jobs (int): number of worker processes. Negative values count back from the
+            number of CPUs (-1 uses all of them)
+        max_iter (int): maximum number of iterations of a single restart (kmode param)
+        engine (str): "kmodes" fits the restarts with the kmodes package, "numpy" with
+            the vectorized engine in src.kmodes_engine. "minibatch" fits one
+            MiniBatchKModes per k in this process; df can then also be a function
+            returning an iterator over the chunks of the data.
+        engine_options (Dict): parameters of the minibatch engine (e.g. batch_size)
+
+    Raises:
+        ValueError: if n_jobs is 0 or the engine is not supported
+
+    Returns:
+        List: the lowest cost for each k in k_list
+    """
+    if n_jobs == 0:
+        logger.error("n_jobs can not be 0.")
+        raise ValueError("n_jobs can not be 0.")
+    if engine not in ENGINES:
+        logger.error("The engine %s is not one of %s.", engine, str(ENGINES))
+        raise ValueError(f"The engine {engine} is not supported.")
+    if engine == "minibatch":
+        # the data is streamed, so the restarts only pick the modes of the first batch
+        costs = []
+        for num_clusters in k_list:
+            with stage("fit", k=num_clusters, restarts=n_init):
+                costs.append(make_model(engine, n_clusters=num_clusters, init=init, n_init=n_init,
+                                        random_state=random_state, **(engine_options or {})).fit(df).cost_)
+        return costs
+    if n_jobs < 0:
+        n_jobs = max((os.cpu_count() or 1) + 1 + n_jobs, 1)
+
+    # encode once here rather than once per fit. Like KModes, every column is mapped
+    # to the rank of its value, so integer codes and strings give the same result.
+    data = np.column_stack([np.unique(np.asarray(df[col]), return_inverse=True)[1]
+                            for col in df.columns]).astype(np.int32)
+    # KModes forces n_init to 1 for deterministic init methods (e.g. Cao)
+    n_init = KModes(init=init, n_init=n_init).n_init
+    seeds = restart_seeds(random_state, n_init)
+    units = [(num_clusters, init, max_iter, init_no, seed, engine)
+             for num_clusters in k_list
+             for init_no, seed in enumerate(seeds)]
+    logger.info("Running %i kmodes fits with %i worker process(es).", len(units), n_jobs)
+
+    if n_jobs == 1:
+        init_sweep_worker(data)
+        results = list(map(fit_restart, units))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs,
+                                 initializer=init_sweep_worker,
+                                 initargs=(data,)) as pool:
+            results = list(pool.map(fit_restart, units))
+
+    best_cost = {}
+    for num_clusters, _, cost, _, _ in results:
+        if num_clusters not in best_cost or cost < best_cost[num_clusters]:
+            best_cost[num_clusters] = cost
+    if enabled():
+        # the restarts of a k may have run in different workers, so their times are summed
+        for num_clusters in k_list:
+            times = [(wall, cpu) for k, _, _, wall, cpu in results if k == num_clusters]
+            add_record("fit", sum(wall for wall, _ in times), sum(cpu for _, cpu in times),
+                       k=num_clusters, restarts=len(times), rows_in=len(data), n_jobs=n_jobs)
+
+    return [best_cost[num_clusters] for num_clusters in k_list]
+
+def find_knee(k_list: List, cost: List, candidates: Optional[List] = None) -> int:
+    """find the knee of a decreasing cost curve. Both axes are scaled to [0, 1] and the
+    knee is the k where the drop in cost is furthest ahead of the straight line joining
+    the first and last points (the Kneedle difference curve).
+
+    Args:
+        k_list (List): the numbers of clusters, in increasing order
+        cost (List): the cost for each k
+        candidates (List): only pick the knee among these k. Default is all of k_list.
+
+    Raises:
+        ValueError: if no k is given or no candidate is in k_list
+
+    Returns:
+        int: the k at the knee
+    """
+    k = np.asarray(k_list, dtype=float)
+    if len(k) == 0:
+        logger.error("No k is given to find the knee.")
+        raise ValueError("k_list should not be empty.")
+    drop = cost[0] - np.asarray(cost, dtype=float)
+    k_span = k[-1] - k[0]
+    k_scaled = (k - k[0]) / k_span if k_span > 0 else np.zeros_like(k)
+    drop_scaled = drop / drop[-1] if drop[-1] > 0 else np.zeros_like(drop)
+    difference = drop_scaled - k_scaled
+    if candidates is not None:
+        allowed = np.isin(k, np.asarray(candidates, dtype=float))
+        if not allowed.any():
+            logger.error("None of the candidates %s is in k_list.", str(list(candidates)))
+            raise ValueError("The candidates should be in k_list.")
+        difference = np.where(allowed, difference, -np.inf)
+    return int(k_list[int(np.argmax(difference))])
+
+def adaptive_sweep(df: Union[pd.DataFrame, Callable],
+                   k_start: int,
+                   k_end: int,
+                   init: str,
+                   n_init: int,
+                   random_state: int,
+                   n_jobs: int,
+                   coarse_n_init: int = 2,
+                   coarse_step: int = 2,
+                   refine_width: int = 2,
+                   engine: str = "kmodes",
+                   engine_options: Optional[Dict] = None) -> pd.DataFrame:
+    """Search k adaptively instead of fitting every k with all restarts. A coarse pass
+    fits every coarse_step-th k with coarse_n_init restarts, the knee of that curve is
+    located, and only the k within refine_width of it are fitted again with n_init
+    restarts. The knee among the refined k is the chosen k.
+
+    Args:
+        df (pd.DataFrame): the data used for clustering
+        k_start (int): start of k for the kmode model
+        k_end (int): end of k for the kmode model (not included)
+        init (str): init method (kmode param)
+        n_init (int): number of restarts for the refined k (kmode param)
+        random_state (int): random state for kmode
+        n_jobs (int): number of worker processes
+        coarse_n_init (int): number of restarts for the coarse pass
+        coarse_step (int): distance between two k of the coarse pass
+        refine_width (int): the refined k are the knee of the coarse pass +/- this width
+        engine (str): "kmodes", "numpy" or "minibatch"
+        engine_options (Dict): parameters of the minibatch engine
+
+    Raises:
+        ValueError: if the range of k is empty or a search parameter is not positive
+
+    Returns:
+        pd.DataFrame: K, cost, the number of restarts behind each cost (n_init) and
+            whether K is the chosen one (selected)
+    """
+    if k_end <= k_start:
+        logger.error("k_end (%i) should be larger than k_start (%i).", k_end, k_start)
+        raise ValueError("The range of k is empty.")
+    if min(coarse_n_init, coarse_step) < 1 or refine_width < 0:
+        logger.error("coarse_n_init and coarse_step should be positive and refine_width not negative.")
+        raise ValueError("Invalid adaptive search parameters.")
+
+    # the coarse pass always ends at the last k so that its curve spans the whole range
+    coarse_k = list(range(k_start, k_end, coarse_step))
+    if coarse_k[-1] != k_end - 1:
+        coarse_k.append(k_end - 1)
+    # the first coarse_n_init restart seeds are the same as the first seeds of a full fit
+    coarse_n_init = min(coarse_n_init, n_init)
+    coarse_cost = parallel_sweep(df, coarse_k, init=init, n_init=coarse_n_init,
+                                 random_state=random_state, n_jobs=n_jobs, engine=engine,
+                                 engine_options=engine_options)
+    knee = find_knee(coarse_k, coarse_cost)
+    logger.info("The coarse pass over %i values of k puts the knee at k = %i.", len(coarse_k), knee)
+
+    refine_k = list(range(max(k_start, knee - refine_width), min(k_end, knee + refine_width + 1)))
+    refine_cost = parallel_sweep(df, refine_k, init=init, n_init=n_init,
+                                 random_state=random_state, n_jobs=n_jobs, engine=engine,
+                                 engine_options=engine_options)
+
+    result = {k: (cost, coarse_n_init) for k, cost in zip(coarse_k, coarse_cost)}
+    result.update({k: (cost, n_init) for k, cost in zip(refine_k, refine_cost)})
+    k_list = sorted(result)
+    cost = [result[k][0] for k in k_list]
+    chosen = find_knee(k_list, cost, candidates=refine_k)
+    logger.info("The adaptive search chose k = %i.", chosen)
+
+    return pd.DataFrame({"K": k_list,
+                         "cost": cost,
+                         "n_init": [result[k][1] for k in k_list],
+                         "selected": [k == chosen for k in k_list]})
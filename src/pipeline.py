@@ -0,0 +1,177 @@
+"""
+This module runs a contiguous range of the model pipeline stages in a single process.
+The data is passed from one stage to the next in memory instead of through the files
+written by the single stage commands of run.py; those files, and the model, store and
+index that depend on them, are only written on request.
+"""
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from src.animal_manager import RecommendationManager
+from src.artifacts import read_table, stage_options, write_table
+from src.encoding import load_vocabulary, read_encoded, save_vocabulary
+from src.instrumentation import stage as instrumented_stage
+from src.kmodes_engine import engine_config
+from src.modeling import (build_recommendations, elbow_sweep, fit_final_model, load_model,
+                          metric_table, save_elbow_results, save_model)
+from src.preprocess import drop_cols, encode_data, feature_engineering, load_dataset, save_df
+from src.rec_store import write_rec_store
+from src.similarity import SimilarityIndex
+
+logger = logging.getLogger(__name__)
+
+STAGES = ["preprocess", "train", "recommendation", "similarity_index", "get_metric", "ingest_rec"]
+
+def stage_range(start: str, end: str) -> List[str]:
+    """the stages from start to end (both included)
+
+    Args:
+        start (str): the first stage
+        end (str): the last stage
+
+    Raises:
+        ValueError: if a stage does not exist or end comes before start
+
+    Returns:
+        List: the names of the stages to run
+    """
+    if start not in STAGES or end not in STAGES:
+        logger.error("The stages should be in %s.", str(STAGES))
+        raise ValueError(f"The stages should be in {STAGES}.")
+    if STAGES.index(start) > STAGES.index(end):
+        logger.error("The stage %s comes after %s.", start, end)
+        raise ValueError("The start stage should not come after the end stage.")
+    return STAGES[STAGES.index(start):STAGES.index(end) + 1]
+
+def _get(data: Dict, key: str, loader: Callable):
+    """take an intermediate result from memory, or load it if an earlier stage did not run"""
+    if key not in data:
+        data[key] = loader()
+    return data[key]
+
+def run_pipeline(config: Dict,
+                 paths: Dict,
+                 start: str = "preprocess",
+                 end: str = "get_metric",
+                 save_artifacts: bool = False,
+                 engine_string: Optional[str] = None,
+                 chunksize: int = 10000,
+                 mode: str = "replace") -> Dict:
+    """run the stages from start to end in this process.
+
+    The elbow plot and the deliverables (the elbow results and the metric) are always
+    written. The tables (clean, encoded, vocabulary, for_model, recommendation), the model,
+    the recommendation store and the similarity index are only written if save_artifacts
+    is True: the model is saved with the checksum of for_model and the store and index are
+    built from the recommendation and encoded tables, so they are written together or not
+    at all. Stages that need the output of a stage that is not in the range read it from
+    its path.
+
+    Args:
+        config (Dict): the model configuration
+        paths (Dict): the paths of the files, with the keys raw, clean, encoded, vocab,
+            df_model, png, result, model, rec and metric, and optionally store (the
+            recommendation store of the app) and index (the similarity index)
+        start (str): the first stage
+        end (str): the last stage
+        save_artifacts (bool): also write the tables, the model, the store and the index
+        engine_string (str): SQLAlchemy connection URI, needed for the ingest_rec stage
+        chunksize (int): number of rows per insert in the ingest_rec stage
+        mode (str): replace or upsert in the ingest_rec stage
+
+    Returns:
+        Dict: the wall time in seconds of every stage that ran
+    """
+    stages = stage_range(start, end)
+    if "ingest_rec" in stages and engine_string is None:
+        logger.error("An engine string is needed for the ingest_rec stage.")
+        raise ValueError("engine_string is needed for the ingest_rec stage.")
+
+    data = {}
+    timings = {}
+    for stage in stages:
+        logger.info("Running the %s stage.", stage)
+        stage_start = time.perf_counter()
+        with instrumented_stage(stage):
+            if stage == "preprocess":
+                _preprocess(config, paths, data, save_artifacts)
+            elif stage == "train":
+                _train(config, paths, data, save_artifacts)
+            elif stage == "recommendation":
+                _recommendation(config, paths, data, save_artifacts)
+            elif stage == "similarity_index":
+                _similarity_index(config, paths, data, save_artifacts)
+            elif stage == "get_metric":
+                _get_metric(config, paths, data)
+            else:
+                recommendations = _get(data, "recommendations", lambda: read_table(paths["rec"]))
+                manager = RecommendationManager(engine_string=engine_string)
+                manager.bulk_ingest_df_rec(recommendations, chunksize=chunksize, mode=mode)
+                manager.close()
+        timings[stage] = time.perf_counter() - stage_start
+
+    for stage, seconds in timings.items():
+        logger.info("%-15s %8.2f s", stage, seconds)
+    logger.info("%-15s %8.2f s", "total", sum(timings.values()))
+    return timings
+
+def _preprocess(config: Dict, paths: Dict, data: Dict, save_artifacts: bool) -> None:
+    """clean and encode the raw data"""
+    raw = load_dataset(filename=paths["raw"])
+    dropped = drop_cols(raw, **config["preprocess"]["drop_cols"])
+    cleaned = feature_engineering(dropped, **config["preprocess"]["feature_engineering"])
+    data["encoded"], data["vocabulary"] = encode_data(cleaned, **config["preprocess"]["encode_data"])
+    if save_artifacts:
+        _, options = stage_options(config, "preprocess")
+        save_df(cleaned, output_path=paths["clean"], **options)
+        save_df(data["encoded"], output_path=paths["encoded"], **options)
+        save_vocabulary(data["vocabulary"], output_path=paths["vocab"])
+
+def _train(config: Dict, paths: Dict, data: Dict, save_artifacts: bool) -> None:
+    """run the elbow sweep and fit the final model"""
+    vocabulary = _get(data, "vocabulary", lambda: load_vocabulary(paths["vocab"]))
+    encoded = _get(data, "encoded", lambda: read_encoded(paths["encoded"], vocabulary))
+    engine, engine_options = engine_config(config["modeling"])
+    data["df_model"], result_table = elbow_sweep(encoded, **config["modeling"]["kmodes_modeling"],
+                                                 engine=engine, engine_options=engine_options)
+    save_elbow_results(result_table, pngpath=paths["png"], result_path=paths["result"])
+    data["model"] = fit_final_model(data["df_model"], **config["modeling"]["form_final_model"],
+                                    engine=engine, engine_options=engine_options)
+    if save_artifacts:
+        _, options = stage_options(config, "train")
+        write_table(data["df_model"], paths["df_model"], **options)
+        save_model(data["model"], data["df_model"], paths["model"])
+
+def _recommendation(config: Dict, paths: Dict, data: Dict, save_artifacts: bool) -> None:
+    """build the recommendation table"""
+    vocabulary = _get(data, "vocabulary", lambda: load_vocabulary(paths["vocab"]))
+    encoded = _get(data, "encoded", lambda: read_encoded(paths["encoded"], vocabulary))
+    df_model = _get(data, "df_model", lambda: read_table(paths["df_model"]))
+    model = _get(data, "model", lambda: load_model(paths["model"], df_model))
+    data["recommendations"] = build_recommendations(df_model.columns.tolist(), encoded, vocabulary, model,
+                                                    **config["modeling"]["recommendation"])
+    if save_artifacts:
+        _, options = stage_options(config, "recommendation")
+        write_table(data["recommendations"], paths["rec"], **options)
+        if paths.get("store") is not None:
+            write_rec_store(data["recommendations"], paths["store"])
+
+def _similarity_index(config: Dict, paths: Dict, data: Dict, save_artifacts: bool) -> None:
+    """build the similarity index of the villagers"""
+    vocabulary = _get(data, "vocabulary", lambda: load_vocabulary(paths["vocab"]))
+    encoded = _get(data, "encoded", lambda: read_encoded(paths["encoded"], vocabulary))
+    df_model = _get(data, "df_model", lambda: read_table(paths["df_model"]))
+    model = _get(data, "model", lambda: load_model(paths["model"], df_model))
+    id_column = config["preprocess"]["encode_data"]["id_columns"][0]
+    data["similarity_index"] = SimilarityIndex.build(df_model, encoded[id_column], model.labels_,
+                                                     **config["modeling"]["similarity"])
+    if save_artifacts and paths.get("index") is not None:
+        data["similarity_index"].save(paths["index"])
+
+def _get_metric(config: Dict, paths: Dict, data: Dict) -> None:
+    """write the cost of the final model"""
+    df_model = _get(data, "df_model", lambda: read_table(paths["df_model"]))
+    model = _get(data, "model", lambda: load_model(paths["model"], df_model))
+    metric_table(model, **config["modeling"]["get_metric"]).to_csv(paths["metric"], index=False)
+    logger.info("The performance metric is written to %s", paths["metric"])
@@ -1,15 +1,21 @@
 """This module includes three functions that is associated with preprocessing the data.
 After these three steps, user should get a cleaned dataset.
+preprocess_stream runs the same steps on the raw data chunk by chunk, for inputs that do
+not fit in memory.
 """
 import logging
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import pandas as pd
 
+from src.artifacts import iter_table, read_table, table_format, write_chunks, write_table
+from src.encoding import encode_df
+from src.instrumentation import add_rows, instrumented
 from src.preprocess_helper import grouping, trimming
 
 logger = logging.getLogger(__name__)
 
+@instrumented(rows_in=None)
 def load_dataset(filename: str) -> pd.DataFrame:
     """load the dataset from the data folder
 
@@ -21,12 +27,13 @@ def load_dataset(filename: str) -> pd.DataFrame:
         pd.DataFrame: The dataframe with only useful features
     """
     try:
-        df = pd.read_csv(filename)
+        df = read_table(filename)
         logger.info("The dataset path %s is loaded and it has %i columns.", filename, df.shape[1])
     except FileNotFoundError:
         logger.error("Cannot find %s", filename)
     return df
 
+@instrumented()
 def drop_cols(df:pd.DataFrame, features:List) -> pd.DataFrame:
     """This function will drop not used columns from the data frame.
 
@@ -49,13 +56,15 @@ def drop_cols(df:pd.DataFrame, features:List) -> pd.DataFrame:
     logger.info("The shape of the data with useful features only is %s", str(df_use.shape))
     return df_use
 
+@instrumented()
 def feature_engineering(df: pd.DataFrame,
                         grouping_column: str,
                         grouping_dict: Dict,
                         grouping_new_name: str,
                         trim_column: str,
                         trim_by: int,
-                        trim_new_name:str) -> pd.DataFrame:
+                        trim_new_name:str,
+                        grouping_unmapped: str = "nan") -> pd.DataFrame:
     """This function will regroup the animal species column using the grouping dictionary
         in the configuration file. Then, the birthday column will be replaced by a month only value.
         Afterwards, the name column is set as the index.
@@ -68,6 +77,7 @@ def feature_engineering(df: pd.DataFrame,
         trim_column (str): The column to trim
         trim_by (int): The number to trim the trim_column by
         trim_new_name (str): The name for the new column after trimming
+        grouping_unmapped (str): what to do with entries not in any group (error, other or nan)
         index_column (str): The new index column
 
     Returns:
@@ -82,7 +92,8 @@ def feature_engineering(df: pd.DataFrame,
     df = grouping(df = df,
                   grouping_dict = grouping_dict,
                   grouping_column = grouping_column,
-                  grouping_new_name = grouping_new_name)
+                  grouping_new_name = grouping_new_name,
+                  unmapped = grouping_unmapped)
 
     logger.info("Animals are re-grouped into %i groups (%s).",
                 len(grouping_dict.keys()),
@@ -98,18 +109,175 @@ def feature_engineering(df: pd.DataFrame,
 
     return df
 
-def save_df(df: pd.DataFrame, output_path: str) -> None:
+@instrumented()
+def encode_data(df: pd.DataFrame, id_columns: List) -> Tuple[pd.DataFrame, Dict]:
+    """This function will replace every column but the id columns with small integer codes,
+    so that the later steps do not need to work on strings.
+
+    Args:
+        df (pd.DataFrame): output pandas df from feature_engineering
+        id_columns (List): columns that are kept as they are (e.g. the villager name)
+
+    Returns:
+        pd.DataFrame: the encoded df
+        Dict: the vocabulary of every encoded column
+    """
+    # check if the pass in value is a pd.dataframe
+    if not isinstance(df, pd.DataFrame):
+        logger.error("Provided argument `df` is not a Panda's DataFrame object")
+        raise TypeError("Provided argument `df` is not a Panda's DataFrame object")
+
+    columns = [col for col in df.columns if col not in id_columns]
+    df_encoded, vocabulary = encode_df(df, columns)
+    logger.info("%i columns are encoded, with %i values in total.",
+                len(columns), sum(len(values) for values in vocabulary.values()))
+
+    return df_encoded, vocabulary
+
+@instrumented(rows_out=None)
+def save_df(df: pd.DataFrame,
+            output_path: str,
+            compression: Optional[str] = None,
+            categorical: bool = False) -> None:
     """This function will save the preprocessed data to the output path location.
+    The format (csv, Parquet or Arrow IPC) is taken from the extension of the path.
 
     Args:
         df (pd.DataFrame): preprocessed data.
         output_path (str): intented location.
+        compression (str): compression codec for the columnar formats.
+        categorical (bool): store the string columns of the columnar formats as categorical columns.
     """
     # check if the readin is a pd.DataFrame
     if not isinstance(df, pd.DataFrame):
         logger.error("Provided argument `df` is not a Panda's DataFrame object")
         raise TypeError("Provided argument `df` is not a Panda's DataFrame object")
 
-    # save the df to csv
-    df.to_csv(output_path, index=False)
+    # save the df
+    write_table(df, output_path, compression=compression, categorical=categorical)
     logger.info("The preprocessed data is saved to %s", output_path)
+
+def iter_clean(filename: str,
+               chunksize: int,
+               features: List,
+               grouping_column: str,
+               grouping_dict: Dict,
+               grouping_new_name: str,
+               trim_column: str,
+               trim_by: int,
+               trim_new_name: str,
+               grouping_unmapped: str = "nan") -> Iterator[pd.DataFrame]:
+    """read the raw data chunk by chunk and clean every chunk like drop_cols and
+    feature_engineering do.
+
+    Args:
+        filename (str): The location of the raw data
+        chunksize (int): number of rows in a chunk
+        features (List): List of useful features
+        the other arguments are the ones of feature_engineering
+
+    Raises:
+        KeyError: if some features are not in the dataset
+
+    Yields:
+        pd.DataFrame: the cleaned chunks
+    """
+    for chunk in iter_table(filename, chunksize):
+        missing = [col for col in features if col not in chunk.columns]
+        if missing:
+            logger.error("Columns %s are not in the dataset.", str(missing))
+            raise KeyError("Some columns in the columns input is not in the dataset. Check again!")
+        chunk = chunk[features].copy()
+        chunk = grouping(df=chunk,
+                         grouping_dict=grouping_dict,
+                         grouping_column=grouping_column,
+                         grouping_new_name=grouping_new_name,
+                         unmapped=grouping_unmapped)
+        yield trimming(df=chunk, trim_column=trim_column, trim_by=trim_by, trim_new_name=trim_new_name)
+
+@instrumented(rows_in=None, rows_out=None)
+def preprocess_stream(raw_path: str,
+                      clean_path: str,
+                      encoded_path: str,
+                      features: List,
+                      id_columns: List,
+                      chunksize: int = 10000,
+                      compression: Optional[str] = None,
+                      categorical: bool = False,
+                      **engineering) -> Dict:
+    """clean and encode the raw data chunk by chunk, so that the memory used does not grow
+    with the number of rows, and write the same tables as drop_cols, feature_engineering,
+    encode_data and save_df. The vocabulary needs every value of the data, so the raw data
+    is read twice: once to collect the values of the columns, once to write the clean
+    table. The encoded table is then written from the clean one.
+
+    Args:
+        raw_path (str): The location of the raw data
+        clean_path (str): intented location of the cleaned data
+        encoded_path (str): intented location of the encoded data
+        features (List): List of useful features
+        id_columns (List): columns that are kept as they are (e.g. the villager name)
+        chunksize (int): number of rows in a chunk
+        compression (str): compression codec for the columnar formats.
+        categorical (bool): store the string columns of the columnar formats as categorical
+            columns. Arrow IPC files have one dictionary for the whole table, so the values
+            of the id columns are also collected for them, and that memory grows with the
+            number of distinct ids.
+        engineering: the arguments of feature_engineering
+
+    Raises:
+        ValueError: if chunksize is not positive
+
+    Returns:
+        Dict: the vocabulary of every encoded column
+    """
+    if chunksize < 1:
+        logger.error("Provided argument `chunksize` should be positive.")
+        raise ValueError("chunksize should be positive.")
+    # Parquet merges the dictionaries of the chunks of an id column by itself
+    collect_ids = categorical and "arrow" in (table_format(clean_path), table_format(encoded_path))
+
+    # first pass: the values of every string column in the order they first appear, and
+    # the categories of the categorical ones (a string column that is empty in a chunk
+    # is read as float, so the string columns are the ones that are strings in any chunk)
+    values = {}
+    categories = {}
+    strings = set()
+    n_rows = 0
+    for chunk in iter_clean(raw_path, chunksize, features, **engineering):
+        for col in chunk.columns:
+            if col in id_columns and not collect_ids:
+                continue
+            # a dict keeps the order of its keys
+            values.setdefault(col, {}).update(dict.fromkeys(chunk[col].dropna().unique().tolist()))
+            if isinstance(chunk[col].dtype, pd.CategoricalDtype):
+                known = categories.setdefault(col, {})
+                known.update(dict.fromkeys(chunk[col].cat.categories.tolist()))
+            elif chunk[col].dtype == object:
+                strings.add(col)
+        n_rows += len(chunk)
+    vocabulary = {col: sorted(col_values) for col, col_values in values.items() if col not in id_columns}
+
+    # second pass: give every chunk the categories the whole table would get
+    def fixed_categories(chunks: Iterator[pd.DataFrame], columns: List) -> Iterator[pd.DataFrame]:
+        for chunk in chunks:
+            for col in columns:
+                if col in categories:
+                    chunk[col] = chunk[col].cat.set_categories(list(categories[col]))
+                elif categorical and col in strings:
+                    chunk[col] = pd.Categorical(chunk[col], categories=list(values[col]))
+            yield chunk
+
+    write_chunks(fixed_categories(iter_clean(raw_path, chunksize, features, **engineering), list(values)),
+                 clean_path, compression=compression, categorical=categorical)
+    logger.info("The preprocessed data is saved to %s", clean_path)
+
+    # the other columns are replaced by their codes
+    ids = [col for col in id_columns if col in values]
+    encoded = (encode_df(chunk, list(vocabulary), vocabulary)[0]
+               for chunk in fixed_categories(iter_table(clean_path, chunksize), ids))
+    write_chunks(encoded, encoded_path, compression=compression, categorical=categorical)
+    logger.info("%i rows are cleaned and encoded in chunks of %i, %i columns with %i values in total.",
+                n_rows, chunksize, len(vocabulary), sum(len(col_values) for col_values in vocabulary.values()))
+    add_rows(rows_in=n_rows, rows_out=n_rows)
+    return vocabulary
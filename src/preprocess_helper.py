@@ -11,7 +11,8 @@ logger = logging.getLogger(__name__)
 def grouping(df:pd.DataFrame,
             grouping_dict: Dict,
             grouping_column: str,
-            grouping_new_name: str) -> pd.DataFrame:
+            grouping_new_name: str,
+            unmapped: str = "nan") -> pd.DataFrame:
     """regroup entries in a given column
 
     Args:
@@ -19,21 +20,41 @@ def grouping(df:pd.DataFrame,
         grouping_dict (Dict): The dictionary with the grouping key and value
         grouping_column (str): the column that will be regrouped
         grouping_new_name (str): the column name of the new column (after regroup)
+        unmapped (str): what to do with entries that are not in any group. "error" raises
+            a ValueError, "other" puts them in the "other" group and "nan" leaves them missing.
 
     Raises:
         KeyError: if grouping_column doesn't exist in the df.
+        ValueError: if unmapped is not a valid policy, or is "error" and some entries are not in any group.
 
     Returns:
-        pd.DataFrame: the dataframe with the new column.
+        pd.DataFrame: the dataframe with the new (categorical) column.
     """
 
     all_cols = df.columns.values.tolist()
     if grouping_column not in all_cols:
         logger.error("Can not find the column that user want to regroup.")
         raise KeyError("grouping_column is not in the dataset. Check again!")
-    for key in grouping_dict.keys():
-        lst = grouping_dict.get(key)
-        df.loc[df[grouping_column].isin(lst), grouping_new_name] = key
+    if unmapped not in ("error", "other", "nan"):
+        logger.error("Provided argument `unmapped` should be error, other or nan.")
+        raise ValueError("unmapped should be error, other or nan.")
+
+    # invert the grouping dict once, so that the column is mapped in a single pass
+    lookup = {item: key for key, lst in grouping_dict.items() for item in lst}
+    categories = list(grouping_dict.keys())
+    groups = df[grouping_column].map(lookup)
+
+    missing = groups.isna() & df[grouping_column].notna()
+    if missing.any():
+        if unmapped == "error":
+            logger.error("%s is not in any group.", str(df.loc[missing, grouping_column].unique().tolist()))
+            raise ValueError("Some entries are not in any group. Check the grouping dictionary!")
+        if unmapped == "other":
+            groups = groups.fillna("other")
+            if "other" not in categories:
+                categories.append("other")
+
+    df[grouping_new_name] = pd.Categorical(groups, categories=categories)
 
     return df
 
@@ -0,0 +1,194 @@
+"""
+This module includes an in-process read-through cache for the recommendation lookups
+of the web app. Entries are kept in LRU order and are dropped as soon as the version
+stamp of the recommendations table (written by ingest_rec) changes.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class RecommendationCache:
+    """LRU cache of recommendations keyed by villager name.
+
+    Args:
+        loader (Callable): function that returns the recommendations for a villager name
+        version_getter (Callable): function that returns the current version stamp of the
+            recommendations table (None if there is none)
+        max_size (int): maximum number of villagers kept in the cache
+        version_ttl (float): seconds between two checks of the version stamp
+        batch_loader (Callable): function that returns the recommendations for a list of
+            villager names as a dictionary, used by get_many. None calls loader per name.
+    """
+    def __init__(self, loader: Callable[[str], List],
+                 version_getter: Callable[[], Optional[str]],
+                 max_size: int = 1024,
+                 version_ttl: float = 30.0,
+                 batch_loader: Optional[Callable[[List[str]], Dict[str, List]]] = None):
+        if max_size < 1:
+            logger.error("The cache size should be at least 1.")
+            raise ValueError("max_size should be at least 1.")
+        self.loader = loader
+        self.batch_loader = batch_loader
+        self.version_getter = version_getter
+        self.max_size = max_size
+        self.version_ttl = version_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> List:
+        """Return the recommendations for a villager, from the cache if possible.
+
+        Args:
+            name (str): the villager name
+
+        Returns:
+            List: the recommendations for the villager
+        """
+        self._check_version()
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return self._entries[name]
+            self.misses += 1
+            version = self._version
+
+        result = self.loader(name)
+        self._store({name: result}, version)
+        return result
+
+    def get_many(self, names: List[str]) -> Dict[str, List]:
+        """Return the recommendations for several villagers. The villagers that are not
+        in the cache are loaded together with one call of the batch loader.
+
+        Args:
+            names (List): the villager names
+
+        Returns:
+            Dict: villager name -> recommendations, for every distinct name
+        """
+        self._check_version()
+        results, missing, version = self._cached(names)
+        if missing:
+            if self.batch_loader is not None:
+                loaded = self.batch_loader(missing)
+                loaded = {name: loaded.get(name, []) for name in missing}
+            else:
+                loaded = {name: self.loader(name) for name in missing}
+            self._store(loaded, version)
+            results.update(loaded)
+        return {name: results[name] for name in dict.fromkeys(names)}
+
+    def clear(self) -> None:
+        """Drop all the cached entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _store(self, results: Dict[str, List], version: Optional[str]) -> None:
+        """Add loaded results to the cache, evicting the least recently used ones."""
+        with self._lock:
+            # do not store results that were loaded under an outdated version
+            if version == self._version:
+                for name, result in results.items():
+                    self._entries[name] = result
+                    self._entries.move_to_end(name)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+    def _cached(self, names: List[str]):
+        """Split the distinct names into the cached results and the missing names, and
+        return them with the version the missing ones will be loaded under."""
+        results = {}
+        with self._lock:
+            for name in dict.fromkeys(names):
+                if name in self._entries:
+                    self._entries.move_to_end(name)
+                    self.hits += 1
+                    results[name] = self._entries[name]
+            missing = [name for name in dict.fromkeys(names) if name not in results]
+            self.misses += len(missing)
+            return results, missing, self._version
+
+    def _check_version(self) -> None:
+        """Look up the version stamp at most once every version_ttl seconds, and clear
+        the cache if it changed."""
+        if self._version_due():
+            self._set_version(self.version_getter())
+
+    def _version_due(self) -> bool:
+        """Whether version_ttl seconds passed since the last check of the version stamp."""
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.version_ttl:
+                return False
+            self._checked_at = now
+            return True
+
+    def _set_version(self, version: Optional[str]) -> None:
+        """Clear the cache if the version stamp changed."""
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    logger.info("Recommendation table version changed to %s, clearing %i cached entries.",
+                                version, len(self._entries))
+                self._entries.clear()
+                self._version = version
+
+class AsyncRecommendationCache(RecommendationCache):
+    """RecommendationCache for an event loop: the loaders and the version getter are
+    coroutine functions, and get and get_many have to be awaited.
+
+    Args:
+        loader (Callable): coroutine function that returns the recommendations for a villager name
+        version_getter (Callable): coroutine function that returns the current version stamp
+        max_size (int): maximum number of villagers kept in the cache
+        version_ttl (float): seconds between two checks of the version stamp
+        batch_loader (Callable): coroutine function that returns the recommendations for a
+            list of villager names as a dictionary. None awaits loader per name.
+    """
+    async def get(self, name: str) -> List:
+        """Return the recommendations for a villager, from the cache if possible.
+
+        Args:
+            name (str): the villager name
+
+        Returns:
+            List: the recommendations for the villager
+        """
+        found = await self.get_many([name])
+        return found[name]
+
+    async def get_many(self, names: List[str]) -> Dict[str, List]:
+        """Return the recommendations for several villagers, loading the ones that are
+        not in the cache with one call of the batch loader.
+
+        Args:
+            names (List): the villager names
+
+        Returns:
+            Dict: villager name -> recommendations, for every distinct name
+        """
+        # the lock is never held across an await, so the event loop does not block on it
+        if self._version_due():
+            self._set_version(await self.version_getter())
+        results, missing, version = self._cached(names)
+        if missing:
+            if self.batch_loader is not None:
+                loaded = await self.batch_loader(missing)
+                loaded = {name: loaded.get(name, []) for name in missing}
+            else:
+                loaded = {name: await self.loader(name) for name in missing}
+            self._store(loaded, version)
+            results.update(loaded)
+        return {name: results[name] for name in dict.fromkeys(names)}
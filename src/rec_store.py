@@ -0,0 +1,170 @@
+"""
+This module includes a read-only, memory-mapped store of the recommendation table for
+the web app. The rows are sorted by villager and rank and every column is integer coded,
+so the table is one fixed-width matrix; a json header holds the values of the codes and
+the offset and number of rows of every villager. A lookup is a dictionary access and a
+slice of the matrix, without a database, and the pages of the matrix are shared by all
+the processes that map the file.
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# first bytes of a store file
+MAGIC = b"RECSTORE"
+# the matrix starts at a multiple of this many bytes
+ALIGNMENT = 64
+
+def write_rec_store(rec: pd.DataFrame, path: str, key_column: str = "Name_villager",
+                    order_column: str = "Rank") -> str:
+    """write the recommendation table as a store file. The file is replaced atomically,
+    so a running app never maps a half written store.
+
+    Args:
+        rec (pd.DataFrame): the decoded recommendation table
+        path (str): the path of the store
+        key_column (str): the column the rows are looked up by
+        order_column (str): the column the rows of a villager are ordered by
+
+    Raises:
+        KeyError: if the key or the order column is missing
+
+    Returns:
+        str: the version of the store (a hash of its content)
+    """
+    for col in (key_column, order_column):
+        if col not in rec.columns:
+            logger.error("The recommendation table has no column %s.", col)
+            raise KeyError(f"{col} is not a column of the recommendation table.")
+    # categorical columns would sort by the order of their categories, not by value
+    rec = rec.astype({col: object for col in rec.columns if isinstance(rec[col].dtype, pd.CategoricalDtype)})
+    rec = rec.sort_values([key_column, order_column], kind="stable").reset_index(drop=True)
+
+    codes, values = [], {}
+    for col in rec.columns:
+        if pd.api.types.is_integer_dtype(rec[col].dtype):
+            codes.append(rec[col].to_numpy(dtype=np.int64))
+            values[col] = None
+        else:
+            categorical = pd.Categorical(rec[col].astype(object))
+            codes.append(categorical.codes.astype(np.int64))
+            values[col] = [str(value) for value in categorical.categories]
+    matrix = np.column_stack(codes) if codes else np.empty((0, 0), dtype=np.int64)
+    low, high = int(matrix.min(initial=0)), int(matrix.max(initial=0))
+    matrix = matrix.astype(next(dtype for dtype in (np.int16, np.int32, np.int64)
+                                if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max))
+
+    names, starts, counts = np.unique(rec[key_column].astype(str).to_numpy(),
+                                      return_index=True, return_counts=True)
+    version = hashlib.sha256(matrix.tobytes())
+    version.update(json.dumps(values, sort_keys=True).encode())
+    header = {"columns": rec.columns.tolist(),
+              "values": values,
+              "dtype": matrix.dtype.str,
+              "shape": list(matrix.shape),
+              "index": {name: [int(start), int(count)] for name, start, count in zip(names, starts, counts)},
+              "version": version.hexdigest()}
+    header_bytes = json.dumps(header).encode()
+    prefix = len(MAGIC) + 8 + len(header_bytes)
+    padding = b"\0" * (-prefix % ALIGNMENT)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header_bytes)) + header_bytes + padding)
+        f.write(np.ascontiguousarray(matrix).tobytes())
+    os.replace(tmp, path)
+    logger.info("The recommendation store with %i rows of %i villagers is written to %s",
+                matrix.shape[0], len(names), path)
+    return header["version"]
+
+class StoreState(NamedTuple):
+    """A mapped store file: the matrix, the values of the codes, the villager index, the
+    version and the (inode, modification time) of the file."""
+    rows: np.ndarray
+    columns: List
+    values: List
+    index: Dict
+    version: str
+    stat: Tuple
+
+class RecommendationStore:
+    """Recommendations of a store file written by write_rec_store. The app looks up from
+    several threads while get_version maps a replaced file again, so the mapped file is
+    kept in one StoreState that is swapped in a single assignment: a lookup always sees
+    the rows and the index of the same file.
+
+    Args:
+        path (str): the path of the store
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._state = self._open()
+
+    def lookup(self, name: str, limit: Optional[int] = None) -> List[Dict]:
+        """the recommendations of a villager
+
+        Args:
+            name (str): the villager name
+            limit (int): maximum number of rows. None returns all of them.
+
+        Returns:
+            List: the recommendations as dictionaries, ordered by rank (empty if the
+                villager is unknown)
+        """
+        state = self._state
+        start, count = state.index.get(name, (0, 0))
+        if limit is not None:
+            count = min(count, limit)
+        rows = state.rows[start:start + count].tolist()
+        return [{col: (code if values is None else (values[code] if code >= 0 else None))
+                 for col, values, code in zip(state.columns, state.values, row)} for row in rows]
+
+    def get_version(self) -> str:
+        """the version of the store. The file is mapped again if it was replaced since
+        it was opened, so a new recommendation stage is picked up.
+
+        Returns:
+            str: the version of the store
+        """
+        stat = os.stat(self.path)
+        state = self._state
+        if (stat.st_ino, stat.st_mtime_ns) != state.stat:
+            logger.info("The recommendation store %s changed and is mapped again.", self.path)
+            state = self._state = self._open()
+        return state.version
+
+    def _open(self) -> "StoreState":
+        """read the header and map the matrix of the store
+
+        Returns:
+            StoreState: the mapped file
+        """
+        with open(self.path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if f.read(len(MAGIC)) != MAGIC:
+                logger.error("%s is not a recommendation store.", self.path)
+                raise ValueError(f"{self.path} is not a recommendation store.")
+            header_length, = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_length))
+        prefix = len(MAGIC) + 8 + header_length
+        shape = tuple(header["shape"])
+        if shape[0] == 0:
+            rows = np.empty(shape, dtype=header["dtype"])
+        else:
+            rows = np.memmap(self.path, dtype=header["dtype"], mode="r",
+                             offset=prefix + (-prefix % ALIGNMENT), shape=shape)
+        return StoreState(rows=rows,
+                          columns=header["columns"],
+                          values=[header["values"][col] for col in header["columns"]],
+                          index=header["index"],
+                          version=header["version"],
+                          stat=(stat.st_ino, stat.st_mtime_ns))
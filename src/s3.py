@@ -2,15 +2,23 @@
 This file contains multiple functions that offers
 the functionality to interact with S3
 """
+import functools
+import hashlib
 import logging
+import os
 import re
 import sys
 
 import boto3
 import botocore
+from boto3.s3.transfer import TransferConfig
 
 logger = logging.getLogger(__name__)
 
+# boto3 defaults: files above the threshold are sent in parts of the chunk size
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
 
 def parse_s3(s3_path):
     """parse the S3 path to return bucket name and the S3 path
@@ -20,7 +28,7 @@ def parse_s3(s3_path):
         s3bucket (str): S3 bucket name
         s3_path (str): S3 path
     """
-    regex = r"s3://([\w._-]+)/([\w./_-]+)"
+    regex = r"s3://([\w._-]+)/([\w./_-]*)"
 
     match = re.match(regex, s3_path)
     s3bucket = match.group(1)
@@ -29,8 +37,65 @@ def parse_s3(s3_path):
     return s3bucket, s3_path
 
 
+@functools.lru_cache(maxsize=None)
+def s3_client():
+    """The S3 client of the process, created once. boto3 clients are thread-safe, so
+    concurrent transfers share it.
+    Returns:
+        the boto3 S3 client
+    """
+    return boto3.client("s3")
+
+
+def transfer_config(max_concurrency=4):
+    """The multipart settings of the transfers
+    Args:
+        max_concurrency (int): threads sending the parts of one file
+    Returns:
+        TransferConfig: the boto3 transfer configuration
+    """
+    return TransferConfig(multipart_threshold=MULTIPART_THRESHOLD,
+                          multipart_chunksize=MULTIPART_CHUNKSIZE,
+                          max_concurrency=max_concurrency)
+
+
+def file_etag(path, multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_CHUNKSIZE):
+    """The ETag S3 gives a file uploaded with these multipart settings: the md5 of the
+    file, or the md5 of the md5s of its parts followed by the number of parts
+    Args:
+        path (str): the path of the file
+        multipart_threshold (int): size in bytes above which the file is sent in parts
+        multipart_chunksize (int): size in bytes of a part
+    Returns:
+        str: the ETag, without quotes
+    """
+    digests = []
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(multipart_chunksize), b""):
+            digests.append(hashlib.md5(chunk).digest())
+    if os.path.getsize(path) < multipart_threshold:
+        return digests[0].hex() if digests else hashlib.md5(b"").hexdigest()
+    return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+def s3_etag(s3bucket, key):
+    """The ETag of an S3 object
+    Args:
+        s3bucket (str): the bucket
+        key (str): the key of the object
+    Returns:
+        str: the ETag without quotes, None if the object does not exist
+    """
+    try:
+        return s3_client().head_object(Bucket=s3bucket, Key=key)["ETag"].strip('"')
+    except botocore.exceptions.ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+
 def upload_file_to_s3(local_path, s3_path):
-    """Upload the file from the local path to s3
+    """Upload the file from the local path to s3, unless s3 has the same content
     Args:
         local_path (str): the path to the local data
         s3_path (str): the s3 path that the data will be uploaded to
@@ -39,11 +104,11 @@ def upload_file_to_s3(local_path, s3_path):
     """
     s3bucket, s3_just_path = parse_s3(s3_path)
 
-    s3 = boto3.resource("s3") # pylint: disable=invalid-name
-    bucket = s3.Bucket(s3bucket)
-
     try:
-        bucket.upload_file(local_path, s3_just_path)
+        if s3_etag(s3bucket, s3_just_path) == file_etag(local_path):
+            logger.info("%s is the same as %s, not uploaded", s3_path, local_path)
+            return
+        s3_client().upload_file(local_path, s3bucket, s3_just_path, Config=transfer_config())
     except botocore.exceptions.NoCredentialsError:
         logger.error("Please provide AWS credentials via AWS_ACCESS_KEY_ID "
                      "and AWS_SECRET_ACCESS_KEY env variables.")
@@ -53,7 +118,7 @@ def upload_file_to_s3(local_path, s3_path):
 
 
 def download_file_from_s3(local_path, s3_path):
-    """Download the file from s3 to the local path
+    """Download the file from s3 to the local path, unless the local file has the same content
     Args:
         local_path (str): the path to the local data
         s3_path (str): the s3 path that the data will be downloaded from
@@ -62,11 +127,11 @@ def download_file_from_s3(local_path, s3_path):
     """
     s3bucket, s3_just_path = parse_s3(s3_path)
 
-    s3 = boto3.resource("s3")# pylint: disable=invalid-name
-    bucket = s3.Bucket(s3bucket)
-
     try:
-        bucket.download_file(s3_just_path, local_path)
+        if os.path.isfile(local_path) and s3_etag(s3bucket, s3_just_path) == file_etag(local_path):
+            logger.info("%s is the same as %s, not downloaded", local_path, s3_path)
+            return
+        s3_client().download_file(s3bucket, s3_just_path, local_path, Config=transfer_config())
     except botocore.exceptions.NoCredentialsError:
         logger.error("Please provide AWS credentials via AWS_ACCESS_KEY_ID "
                      "and AWS_SECRET_ACCESS_KEY env variables.")
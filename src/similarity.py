@@ -0,0 +1,257 @@
+"""
+This module includes a similarity index over the categorical features of the villagers.
+Every villager is stored as a packed one-hot bit-vector, so the number of attributes two
+villagers share is the popcount of the AND of their vectors. The top_k most similar
+villagers of everyone, overall and within their cluster, are precomputed when the index
+is built; other queries are answered with one pass over the packed vectors.
+"""
+import logging
+from typing import Dict, List, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from src.artifacts import read_table
+from src.encoding import load_vocabulary, read_encoded
+
+logger = logging.getLogger(__name__)
+
+# number of set bits of every byte value
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+def pack_codes(codes: np.ndarray, n_values: np.ndarray) -> np.ndarray:
+    """one-hot encode integer codes and pack the bits into bytes
+
+    Args:
+        codes (np.ndarray): (n_rows, n_attrs) codes; negative (missing) codes set no bit
+        n_values (np.ndarray): number of distinct codes of every attribute
+
+    Returns:
+        np.ndarray: (n_rows, n_bytes) packed bit-vectors
+    """
+    offsets = np.concatenate([[0], np.cumsum(n_values)[:-1]])
+    bits = np.zeros((codes.shape[0], int(np.sum(n_values))), dtype=bool)
+    rows, attrs = np.nonzero((codes >= 0) & (codes < n_values))
+    bits[rows, offsets[attrs] + codes[rows, attrs]] = True
+    return np.packbits(bits, axis=1)
+
+def shared_attributes(packed: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """number of attributes every row shares with the query rows (popcount of the AND)
+
+    Args:
+        packed (np.ndarray): (n_rows, n_bytes) packed bit-vectors
+        query (np.ndarray): (n_queries, n_bytes) packed bit-vectors
+
+    Returns:
+        np.ndarray: (n_queries, n_rows) number of matching attributes
+    """
+    return POPCOUNT[query[:, None, :] & packed[None, :, :]].sum(axis=2, dtype=np.int16)
+
+def top_k(similarity: np.ndarray, k: int, candidates: Optional[np.ndarray] = None) -> np.ndarray:
+    """the k most similar rows, ties going to the smaller row index
+
+    Args:
+        similarity (np.ndarray): the similarity of every row
+        k (int): number of rows to return
+        candidates (np.ndarray): boolean mask of the rows that can be returned
+
+    Returns:
+        np.ndarray: the row indices, most similar first
+    """
+    n_rows = len(similarity)
+    # one integer key orders by similarity (descending), then by row index
+    key = (int(similarity.max(initial=0)) - similarity.astype(np.int64)) * n_rows + np.arange(n_rows)
+    if candidates is not None:
+        key = np.where(candidates, key, np.iinfo(np.int64).max)
+        k = min(k, int(candidates.sum()))
+    k = min(k, n_rows)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(key, k - 1)[:k] if k < n_rows else np.arange(n_rows)
+    return best[np.argsort(key[best])]
+
+def build_similarity_index(filename_model: str,
+                           filename_encoded: str,
+                           vocab_path: str,
+                           model_path: str,
+                           index_path: str,
+                           top_k: int = 20,
+                           id_column: str = "Name") -> "SimilarityIndex":
+    """build the similarity index of the villagers and save it next to the model
+
+    Args:
+        filename_model (str): input file path of the data used for modeling
+        filename_encoded (str): input file path of the encoded data (for the names)
+        vocab_path (str): the path of the vocabulary of the encoded data
+        model_path (str): the path of the fitted model (for the clusters)
+        index_path (str): the path to save the index
+        top_k (int): number of precomputed neighbors per villager
+        id_column (str): the column of the villager names
+
+    Returns:
+        SimilarityIndex: the index
+    """
+    # imported here, src.modeling pulls in the plotting libraries
+    from src.modeling import load_model
+    df_model = read_table(filename_model)
+    df_encoded = read_encoded(filename_encoded, load_vocabulary(vocab_path))
+    model = load_model(model_path, df_model)
+    index = SimilarityIndex.build(df_model, df_encoded[id_column], model.labels_, top_k=top_k)
+    index.save(index_path)
+    return index
+
+def _check_k(k: int) -> None:
+    """raise a ValueError if the number of villagers to return is smaller than 1"""
+    if k < 1:
+        logger.error("The number of similar villagers should be at least 1, not %i.", k)
+        raise ValueError("k should be a positive integer.")
+
+class SimilarityIndex:
+    """Top-k most similar villagers, by the number of shared categorical attributes.
+
+    Args:
+        names (np.ndarray): the villager names
+        packed (np.ndarray): the packed one-hot bit-vectors of the villagers
+        clusters (np.ndarray): the cluster of every villager
+        n_values (np.ndarray): number of distinct codes of every attribute
+        features (List): the attributes in the bit-vectors
+        top_k (int): number of precomputed neighbors per villager
+    """
+    def __init__(self, names: np.ndarray, packed: np.ndarray, clusters: np.ndarray,
+                 n_values: np.ndarray, features: List, top_k: int = 20):
+        self.names = np.asarray(names, dtype=object)
+        self.packed = packed
+        self.clusters = np.asarray(clusters)
+        self.n_values = np.asarray(n_values)
+        self.features = list(features)
+        self.top_k = top_k
+        self.neighbors, self.cluster_neighbors = self._precompute()
+        self._positions = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def build(cls, df_model: pd.DataFrame, names: pd.Series, clusters: np.ndarray,
+              top_k: int = 20) -> "SimilarityIndex":
+        """build the index from the integer coded data used for modeling
+
+        Args:
+            df_model (pd.DataFrame): the integer coded features of the villagers
+            names (pd.Series): the villager names, in the same order
+            clusters (np.ndarray): the cluster of every villager
+            top_k (int): number of precomputed neighbors per villager
+
+        Raises:
+            ValueError: if the lengths of the inputs differ
+
+        Returns:
+            SimilarityIndex: the index
+        """
+        if not len(df_model) == len(names) == len(clusters):
+            logger.error("The data, the names and the clusters should have the same length.")
+            raise ValueError("The lengths of df_model, names and clusters do not match.")
+        codes = df_model.to_numpy().astype(np.int64)
+        n_values = np.maximum(codes.max(axis=0, initial=-1) + 1, 1)
+        index = cls(np.asarray(names), pack_codes(codes, n_values), clusters, n_values,
+                    df_model.columns.tolist(), top_k=top_k)
+        logger.info("Similarity index built for %i villagers (%i bytes each).",
+                    len(names), index.packed.shape[1])
+        return index
+
+    def query(self, name: str, k: int = 10, same_cluster: bool = False) -> List[Dict]:
+        """the k villagers most similar to a villager
+
+        Args:
+            name (str): the villager name
+            k (int): number of villagers to return
+            same_cluster (bool): only return villagers from the same cluster
+
+        Raises:
+            ValueError: if k is smaller than 1
+            KeyError: if the villager is not in the index
+
+        Returns:
+            List: {"Name", "Cluster", "Similarity"} of every villager, most similar first
+        """
+        _check_k(k)
+        if name not in self._positions:
+            logger.error("%s is not in the similarity index.", name)
+            raise KeyError(f"{name} is not in the similarity index.")
+        position = self._positions[name]
+        precomputed = self.cluster_neighbors if same_cluster else self.neighbors
+        if k <= self.top_k:
+            rows = precomputed[position][:k]
+            rows = rows[rows >= 0]
+        else:
+            candidates = np.ones(len(self.names), dtype=bool)
+            if same_cluster:
+                candidates = self.clusters == self.clusters[position]
+            candidates[position] = False
+            similarity = shared_attributes(self.packed, self.packed[position:position + 1])[0]
+            rows = top_k(similarity, k, candidates)
+        return self._rows(rows, self.packed[position:position + 1])
+
+    def query_codes(self, codes: np.ndarray, k: int = 10, cluster: Optional[int] = None) -> List[Dict]:
+        """the k villagers most similar to a villager that is not in the index
+
+        Args:
+            codes (np.ndarray): the integer codes of the features of the villager
+            k (int): number of villagers to return
+            cluster (int): only return villagers from this cluster
+
+        Raises:
+            ValueError: if k is smaller than 1
+
+        Returns:
+            List: {"Name", "Cluster", "Similarity"} of every villager, most similar first
+        """
+        _check_k(k)
+        query = pack_codes(np.asarray(codes, dtype=np.int64).reshape(1, -1), self.n_values)
+        similarity = shared_attributes(self.packed, query)[0]
+        candidates = None if cluster is None else self.clusters == cluster
+        return self._rows(top_k(similarity, k, candidates), query)
+
+    def save(self, path: str) -> None:
+        """save the index, e.g. next to the model
+
+        Args:
+            path (str): the path of the index
+        """
+        joblib.dump(self, path)
+        logger.info("The similarity index is saved to %s", path)
+
+    @staticmethod
+    def load(path: str) -> "SimilarityIndex":
+        """load a saved index
+
+        Args:
+            path (str): the path of the index
+
+        Returns:
+            SimilarityIndex: the index
+        """
+        return joblib.load(path)
+
+    def _precompute(self, block_size: int = 256):
+        """the top_k neighbors of every villager, overall and within its cluster; -1 pads
+        the rows of villagers with fewer cluster-mates"""
+        n_rows = len(self.names)
+        neighbors = np.full((n_rows, self.top_k), -1, dtype=np.int32)
+        cluster_neighbors = np.full((n_rows, self.top_k), -1, dtype=np.int32)
+        for start in range(0, n_rows, block_size):
+            similarity = shared_attributes(self.packed, self.packed[start:start + block_size])
+            for offset, row_similarity in enumerate(similarity):
+                position = start + offset
+                candidates = np.ones(n_rows, dtype=bool)
+                candidates[position] = False
+                rows = top_k(row_similarity, self.top_k, candidates)
+                neighbors[position, :len(rows)] = rows
+                candidates &= self.clusters == self.clusters[position]
+                rows = top_k(row_similarity, self.top_k, candidates)
+                cluster_neighbors[position, :len(rows)] = rows
+        return neighbors, cluster_neighbors
+
+    def _rows(self, rows: np.ndarray, query: np.ndarray) -> List[Dict]:
+        """the result rows of a query"""
+        similarity = shared_attributes(self.packed[rows], query)[0] if len(rows) else []
+        return [{"Name": self.names[row], "Cluster": int(self.clusters[row]), "Similarity": int(sim)}
+                for row, sim in zip(rows, similarity)]
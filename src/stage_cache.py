@@ -0,0 +1,201 @@
+"""
+This module includes a content-addressed cache for the outputs of the run.py stages.
+A stage is fingerprinted by the hashes of its input files, the part of the configuration
+it uses, the path of the configuration file and the source code of the src package and
+of run.py. When the same fingerprint was seen
+before, the stored outputs are copied back instead of running the stage again.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# name of the file describing a cache entry
+MANIFEST = "manifest.json"
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """sha256 of the content of a file
+
+    Args:
+        path (str): the path of the file
+        chunk_size (int): number of bytes read at a time
+
+    Raises:
+        FileNotFoundError: if the file does not exist
+
+    Returns:
+        str: the hex digest
+    """
+    if not os.path.isfile(path):
+        logger.error("The input file %s of the stage does not exist.", path)
+        raise FileNotFoundError(f"{path} does not exist.")
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def code_version(package_dir: str = "src", code_files: Optional[List[str]] = None) -> str:
+    """sha256 over the paths and contents of the python files of a package and of
+    other source files, e.g. the entrypoint
+
+    Args:
+        package_dir (str): the directory of the package
+        code_files (List): other source files; missing ones are skipped
+
+    Returns:
+        str: the hex digest
+    """
+    digest = hashlib.sha256()
+    for path in sorted(Path(package_dir).rglob("*.py")):
+        digest.update(path.relative_to(package_dir).as_posix().encode())
+        digest.update(path.read_bytes())
+    for path in map(Path, code_files or []):
+        if path.is_file():
+            digest.update(path.name.encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+class StageCache:
+    """Size-bounded cache of stage outputs keyed by the fingerprint of the stage.
+
+    Args:
+        cache_dir (str): the directory of the cache entries
+        max_size_mb (float): the total size kept in the cache; the least recently used
+            entries are evicted above it
+        package_dir (str): the package whose source code is part of every fingerprint
+        code_files (List): other source files in every fingerprint, by default run.py
+    """
+    def __init__(self, cache_dir: str = ".stage_cache",
+                 max_size_mb: float = 512,
+                 package_dir: str = "src",
+                 code_files: Optional[List[str]] = None):
+        if max_size_mb <= 0:
+            logger.error("The size of the stage cache should be positive.")
+            raise ValueError("max_size_mb should be positive.")
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.package_dir = package_dir
+        self.code_files = ["run.py"] if code_files is None else list(code_files)
+        self._code_version = None
+
+    def key(self, stage: str, inputs: List[str], config: Dict, config_path: Optional[str] = None) -> str:
+        """fingerprint of a stage
+
+        Args:
+            stage (str): the name of the stage
+            inputs (List): the paths of the input files of the stage
+            config (Dict): the configuration used by the stage
+            config_path (str): the path of the configuration file
+
+        Returns:
+            str: the hex digest identifying the stage run
+        """
+        if self._code_version is None:
+            self._code_version = code_version(self.package_dir, self.code_files)
+        fingerprint = {"stage": stage,
+                       "code": self._code_version,
+                       "config": config,
+                       "config_path": config_path,
+                       "inputs": [file_digest(path) for path in inputs]}
+        # inputs are hashed by content only, so renaming a file keeps the cache valid
+        payload = json.dumps(fingerprint, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def restore(self, key: str, outputs: List[str]) -> bool:
+        """copy the outputs of a cached stage run to their paths
+
+        Args:
+            key (str): the fingerprint of the stage
+            outputs (List): the paths the outputs should be written to
+
+        Returns:
+            bool: True if the outputs were restored, False if the entry is missing
+        """
+        entry = self.cache_dir / key
+        manifest = self._read_manifest(entry)
+        if manifest is None or len(manifest["files"]) != len(outputs):
+            return False
+        if not all((entry / name).is_file() for name in manifest["files"]):
+            logger.warning("The cache entry %s is incomplete and is ignored.", key)
+            return False
+        for name, path in zip(manifest["files"], outputs):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            shutil.copyfile(entry / name, path)
+        manifest["used_at"] = time.time()
+        self._write_manifest(entry, manifest)
+        logger.info("Stage %s restored from the cache (%s).", manifest["stage"], key[:12])
+        return True
+
+    def store(self, key: str, stage: str, outputs: List[str]):
+        """copy the outputs of a stage run into the cache and evict old entries. Outputs
+        larger than the cache are not stored.
+
+        Args:
+            key (str): the fingerprint of the stage
+            stage (str): the name of the stage
+            outputs (List): the paths of the outputs of the stage
+        """
+        size = sum(os.path.getsize(path) for path in outputs)
+        if size > self.max_bytes:
+            logger.warning("The outputs of stage %s (%i bytes) are larger than the cache "
+                           "and are not stored.", stage, size)
+            return
+        entry = self.cache_dir / key
+        tmp = self.cache_dir / f".{key}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        files = []
+        for i, path in enumerate(outputs):
+            name = f"{i}_{os.path.basename(path)}"
+            shutil.copyfile(path, tmp / name)
+            files.append(name)
+        self._write_manifest(tmp, {"stage": stage, "files": files, "used_at": time.time()})
+        # the entry only shows up once it is complete
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+        logger.info("Outputs of stage %s stored in the cache (%s).", stage, key[:12])
+        self.evict(keep=key)
+
+    def evict(self, keep: Optional[str] = None):
+        """remove the least recently used entries until the cache fits in its size
+
+        Args:
+            keep (str): the fingerprint of an entry that is never evicted, e.g. the one
+                just stored
+        """
+        entries = []
+        for entry in self.cache_dir.iterdir():
+            manifest = self._read_manifest(entry)
+            if manifest is None:
+                continue
+            size = sum(f.stat().st_size for f in entry.iterdir())
+            entries.append((manifest["used_at"], size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if entry.name == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            logger.info("Cache entry %s evicted.", entry.name[:12])
+
+    @staticmethod
+    def _read_manifest(entry: Path) -> Optional[Dict]:
+        try:
+            with open(entry / MANIFEST, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_manifest(entry: Path, manifest: Dict):
+        with open(entry / MANIFEST, "w") as f:
+            json.dump(manifest, f)
@@ -0,0 +1,210 @@
+## This is the unit testing file for the ingestion and migration functions in the animal_manager module.
+
+## import packages
+import pandas as pd
+import pytest
+import sqlalchemy
+
+import src.animal_manager
+
+def make_session():
+    """create a session on an in-memory sqlite database with all the tables"""
+    engine = sqlalchemy.create_engine("sqlite://")
+    src.animal_manager.Base.metadata.create_all(engine)
+    return sqlalchemy.orm.sessionmaker(bind=engine)()
+
+def make_rec_csv(path, names):
+    """write a small recommendation csv with one row per name"""
+    df = pd.DataFrame({"Name_villager": "a", "Name": names, "Species": "Cat", "Gender": "Male",
+                       "Personality": "Lazy", "Hobby": "Nature", "Birthday": "1-Jan",
+                       "Style_1": "Cool", "Style_2": "Cool", "Color_1": "Red", "Color_2": "Blue",
+                       "Rank": range(1, len(names) + 1), "Unique_id": range(len(names))})
+    df.to_csv(path, index=False)
+
+def test_bulk_ingest_replace(tmp_path):
+    """happy path for bulk_ingest. Re-ingesting replaces the table instead of failing on duplicates.
+    """
+    session = make_session()
+    table = src.animal_manager.Recommendations.__table__
+    make_rec_csv(tmp_path / "rec.csv", ["b", "c", "d"])
+
+    n_first = src.animal_manager.bulk_ingest(session, table, tmp_path / "rec.csv", chunksize=2)
+    n_second = src.animal_manager.bulk_ingest(session, table, tmp_path / "rec.csv", chunksize=2)
+
+    assert n_first == n_second == 3
+    assert session.query(src.animal_manager.Recommendations).count() == 3
+
+def test_bulk_ingest_upsert(tmp_path):
+    """happy path for bulk_ingest. Upserting updates the existing rows and keeps the others.
+    """
+    session = make_session()
+    table = src.animal_manager.Recommendations.__table__
+    make_rec_csv(tmp_path / "rec.csv", ["b", "c", "d"])
+    src.animal_manager.bulk_ingest(session, table, tmp_path / "rec.csv")
+    make_rec_csv(tmp_path / "rec.csv", ["e"])
+    src.animal_manager.bulk_ingest(session, table, tmp_path / "rec.csv", mode="upsert")
+
+    names = [rec.Name for rec in session.query(src.animal_manager.Recommendations)
+             .order_by(src.animal_manager.Recommendations.Rank)]
+    assert names == ["e", "c", "d"]
+
+def test_bulk_ingest_wrong_mode(tmp_path):
+    """unhappy path for bulk_ingest. Only replace and upsert are supported.
+    """
+    session = make_session()
+    make_rec_csv(tmp_path / "rec.csv", ["b"])
+    with pytest.raises(ValueError):
+        src.animal_manager.bulk_ingest(session, src.animal_manager.Recommendations.__table__,
+                                       tmp_path / "rec.csv", mode="append")
+
+def test_ingest_chunks_replace_failure(tmp_path):
+    """unhappy path for ingest_chunks. A failure in the middle of a replace keeps the old
+    rows, nothing of the new chunks is committed.
+    """
+    session = make_session()
+    table = src.animal_manager.Recommendations.__table__
+    make_rec_csv(tmp_path / "rec.csv", ["b", "c", "d"])
+    src.animal_manager.bulk_ingest(session, table, tmp_path / "rec.csv")
+    make_rec_csv(tmp_path / "new.csv", ["e", "f"])
+
+    def chunks():
+        yield pd.read_csv(tmp_path / "new.csv")
+        raise OSError("the file can not be read")
+
+    with pytest.raises(OSError):
+        src.animal_manager.ingest_chunks(session, table, chunks())
+    names = [rec.Name for rec in session.query(src.animal_manager.Recommendations)]
+    assert sorted(names) == ["b", "c", "d"]
+
+def test_bulk_ingest_replace_insert_failure(tmp_path):
+    """unhappy path for bulk_ingest. The insert of a later chunk fails on a duplicate key,
+    and the table still holds the old rows, not the chunks inserted before the failure.
+    """
+    session = make_session()
+    table = src.animal_manager.Recommendations.__table__
+    make_rec_csv(tmp_path / "rec.csv", ["b", "c", "d"])
+    src.animal_manager.bulk_ingest(session, table, tmp_path / "rec.csv")
+    make_rec_csv(tmp_path / "new.csv", ["e", "f", "g", "h", "i"])
+    new = pd.read_csv(tmp_path / "new.csv")
+    new.loc[4, "Unique_id"] = 0
+    new.to_csv(tmp_path / "new.csv", index=False)
+
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        src.animal_manager.bulk_ingest(session, table, tmp_path / "new.csv", chunksize=2)
+    names = [rec.Name for rec in session.query(src.animal_manager.Recommendations)]
+    assert sorted(names) == ["b", "c", "d"]
+
+def test_replace_rows(tmp_path):
+    """happy path for replace_rows. The rows of the given villagers are replaced and
+    the rows of the other villagers are kept.
+    """
+    session = make_session()
+    table = src.animal_manager.Recommendations.__table__
+    make_rec_csv(tmp_path / "rec.csv", ["b", "c"])
+    src.animal_manager.bulk_ingest(session, table, tmp_path / "rec.csv")
+    other = pd.read_csv(tmp_path / "rec.csv").assign(Name_villager="z", Unique_id=[10, 11])
+    session.execute(table.insert(), other.to_dict(orient="records"))
+    new_rows = pd.read_csv(tmp_path / "rec.csv").assign(Name=["n", "b"], Unique_id=[20, 21])
+
+    n_rows = src.animal_manager.replace_rows(session, table, new_rows, "Name_villager", chunksize=1)
+    session.commit()
+
+    query = session.query(src.animal_manager.Recommendations).order_by(src.animal_manager.Recommendations.Rank)
+    assert n_rows == 2
+    assert [rec.Name for rec in query.filter_by(Name_villager="a")] == ["n", "b"]
+    assert query.filter_by(Name_villager="z").count() == 2
+
+def test_migrate_db(tmp_path, caplog):
+    """happy path for migrate_db. An old recommendations table gets the Rank column and its
+    index, and its rows are flagged for a new ingestion.
+    """
+    engine_string = f"sqlite:///{tmp_path / 'old.db'}"
+    engine = sqlalchemy.create_engine(engine_string)
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text("CREATE TABLE recommendations "
+                                     "(Name_villager VARCHAR(100), Unique_id VARCHAR(100) PRIMARY KEY)"))
+        conn.execute(sqlalchemy.text("INSERT INTO recommendations VALUES ('a', '0')"))
+
+    src.animal_manager.migrate_db(engine_string)
+
+    inspector = sqlalchemy.inspect(engine)
+    columns = [col["name"] for col in inspector.get_columns("recommendations")]
+    indexes = [index["name"] for index in inspector.get_indexes("recommendations")]
+    assert "Rank" in columns
+    assert "ix_recommendations_name_villager_rank" in indexes
+    assert "recommendation_version" in inspector.get_table_names()
+    assert "ingest the recommendations again" in caplog.text.lower()
+
+def test_async_engine_url():
+    """happy path for async_engine_url. The driver is swapped and the rest is kept."""
+    url = src.animal_manager.async_engine_url("mysql+pymysql://user:pw@host:3306/db")
+
+    assert url.drivername == "mysql+aiomysql"
+    assert (url.username, url.password, url.host, url.port, url.database) == ("user", "pw", "host", 3306, "db")
+    assert src.animal_manager.async_engine_url("sqlite:///data/a.db").drivername == "sqlite+aiosqlite"
+
+def test_async_engine_url_unknown_dialect():
+    """unhappy path for async_engine_url. Dialects without an async driver raise a ValueError."""
+    with pytest.raises(ValueError):
+        src.animal_manager.async_engine_url("oracle://user:pw@host/db")
+
+def test_engine_options():
+    """happy path for engine_options. SQLite only gets the pre-ping and recycle settings."""
+    options = src.animal_manager.engine_options("mysql+pymysql://user:pw@host/db", pool_size=3)
+    sqlite_options = src.animal_manager.engine_options("sqlite:///data/a.db", pool_size=3)
+
+    assert options == {"pool_size": 3, "max_overflow": 10, "pool_pre_ping": True, "pool_recycle": 1800}
+    assert sqlite_options == {"pool_pre_ping": True, "pool_recycle": 1800}
+    assert src.animal_manager.pool_options({"DB_POOL_SIZE": 2, "DEBUG": True}) == {"pool_size": 2}
+
+def lost_connection():
+    """the error SQLAlchemy raises when the server closed the connection"""
+    return sqlalchemy.exc.OperationalError("SELECT 1", {}, Exception("server has gone away"),
+                                           connection_invalidated=True)
+
+def test_retry_on_disconnect():
+    """happy path for retry_on_disconnect. A lost connection is retried."""
+    calls = []
+    def func():
+        calls.append(1)
+        if len(calls) < 3:
+            raise lost_connection()
+        return "rows"
+
+    assert src.animal_manager.retry_on_disconnect(make_session(), func, retries=3, backoff=0) == "rows"
+    assert len(calls) == 3
+
+def test_retry_on_disconnect_gives_up():
+    """unhappy path for retry_on_disconnect. Other errors are not retried and the retries
+    are bounded.
+    """
+    calls = []
+    def func():
+        calls.append(1)
+        raise lost_connection()
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        src.animal_manager.retry_on_disconnect(make_session(), func, retries=2, backoff=0)
+    assert len(calls) == 3
+
+    def missing_table():
+        calls.append(1)
+        raise sqlalchemy.exc.OperationalError("SELECT 1", {}, Exception("no such table"))
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        src.animal_manager.retry_on_disconnect(make_session(), missing_table, retries=2, backoff=0)
+    assert len(calls) == 4
+
+def test_get_recommendations_many(tmp_path):
+    """happy path for get_recommendations_many. One query returns the ranked rows of
+    every villager found, cut at the limit.
+    """
+    engine_string = f"sqlite:///{tmp_path / 'rec.db'}"
+    src.animal_manager.create_db(engine_string)
+    make_rec_csv(tmp_path / "rec.csv", ["b", "c", "d"])
+    manager = src.animal_manager.RecommendationManager(engine_string=engine_string)
+    manager.bulk_ingest_from_csv_rec(str(tmp_path / "rec.csv"))
+
+    found = manager.get_recommendations_many(["a", "z"], limit=2)
+    manager.close()
+
+    assert list(found) == ["a"]
+    assert [row["Name"] for row in found["a"]] == ["b", "c"]
@@ -0,0 +1,41 @@
+## This is the unit testing file for the api module.
+
+## import packages
+import pytest
+
+import src.api
+
+def test_parse_batch_request():
+    """happy path for parse_batch_request. The limit defaults to and is capped at max_rows."""
+    assert src.api.parse_batch_request({"names": ["a", "b"]}, 5, 10) == (["a", "b"], 10)
+    assert src.api.parse_batch_request({"names": ["a"], "limit": 3}, 5, 10) == (["a"], 3)
+    assert src.api.parse_batch_request({"names": [], "limit": 30}, 5, 10) == ([], 10)
+
+@pytest.mark.parametrize("payload", [None, ["a"], {"names": "a"}, {"names": ["a", 1]},
+                                     {"names": ["a"] * 6}, {"names": ["a"], "limit": 0},
+                                     {"names": ["a"], "limit": "3"}, {"names": ["a"], "limit": True}])
+def test_parse_batch_request_invalid(payload):
+    """unhappy path for parse_batch_request. Invalid bodies raise a ValueError."""
+    with pytest.raises(ValueError):
+        src.api.parse_batch_request(payload, 5, 10)
+
+def test_parse_k():
+    """happy path for parse_k. A missing k gives the default."""
+    assert src.api.parse_k(None, 10) == 10
+    assert src.api.parse_k("3", 10) == 3
+
+@pytest.mark.parametrize("value", ["", "a", "2.5", "0", "-1", "-5"])
+def test_parse_k_invalid(value):
+    """unhappy path for parse_k. Empty, non-integer and non-positive values raise a ValueError."""
+    with pytest.raises(ValueError):
+        src.api.parse_k(value, 10)
+
+def test_batch_response():
+    """happy path for batch_response. The rows are cut at the limit and empty results
+    are listed as not found.
+    """
+    response = src.api.batch_response({"a": [1, 2, 3], "b": []}, 2)
+
+    assert response == {"results": [{"name": "a", "recommendations": [1, 2]},
+                                    {"name": "b", "recommendations": []}],
+                        "not_found": ["b"]}
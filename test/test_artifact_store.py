@@ -0,0 +1,111 @@
+## This is the unit testing file for the artifact_store module.
+
+## import packages
+import hashlib
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+import src.artifact_store
+import src.s3
+
+def make_outputs(root):
+    """write a small tree of stage outputs"""
+    (root / "models").mkdir(parents=True)
+    (root / "models" / "model.joblib").write_bytes(b"model")
+    (root / "figures").mkdir()
+    (root / "figures" / "plot.png").write_bytes(b"plot")
+
+def make_store(tmp_path, **options):
+    """an artifact store on a directory, with its cache in tmp_path"""
+    backend = src.artifact_store.LocalBackend(str(tmp_path / "remote"))
+    return src.artifact_store.ArtifactStore(backend, cache_dir=str(tmp_path / "cache"), **options)
+
+def test_file_etag(tmp_path):
+    """happy path for file_etag. Small files get their md5, larger ones the md5 of the
+    md5s of their parts and the number of parts, like S3."""
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"abcdefghij")
+
+    parts = [hashlib.md5(part).digest() for part in (b"abcd", b"efgh", b"ij")]
+    assert src.s3.file_etag(str(path)) == hashlib.md5(b"abcdefghij").hexdigest()
+    assert src.s3.file_etag(str(path), multipart_threshold=8, multipart_chunksize=4) == \
+        hashlib.md5(b"".join(parts)).hexdigest() + "-3"
+
+def test_push_skips_unchanged(tmp_path, monkeypatch):
+    """happy path for push. Only new or changed files are uploaded."""
+    monkeypatch.chdir(tmp_path)
+    make_outputs(tmp_path)
+    store = make_store(tmp_path)
+
+    first = store.push(["models", "figures/plot.png"])
+    (tmp_path / "models" / "model.joblib").write_bytes(b"refitted model")
+    second = store.push(["models", "figures/plot.png"])
+
+    assert first == {"models/model.joblib": "uploaded", "figures/plot.png": "uploaded"}
+    assert second == {"models/model.joblib": "uploaded", "figures/plot.png": "skipped"}
+    assert (tmp_path / "remote" / "models" / "model.joblib").read_bytes() == b"refitted model"
+
+def test_pull_uses_cache(tmp_path, monkeypatch):
+    """happy path for pull. Files are downloaded once, taken from the cache when they
+    are missing again, and skipped when they are already there."""
+    monkeypatch.chdir(tmp_path)
+    make_outputs(tmp_path)
+    store = make_store(tmp_path)
+    store.push(["models", "figures"])
+    (tmp_path / "models" / "model.joblib").unlink()
+
+    assert store.pull(["models"]) == {"models/model.joblib": "downloaded"}
+    (tmp_path / "models" / "model.joblib").unlink()
+    assert store.pull(["models"]) == {"models/model.joblib": "cached"}
+    assert store.pull(["models", "figures"]) == {"models/model.joblib": "skipped",
+                                                 "figures/plot.png": "skipped"}
+    assert (tmp_path / "models" / "model.joblib").read_bytes() == b"model"
+
+def test_cache_eviction(tmp_path, monkeypatch):
+    """happy path for evict. The cache is cut down to its size."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "a.bin").write_bytes(b"0" * 600 * 1024)
+    (tmp_path / "data" / "b.bin").write_bytes(b"1" * 600 * 1024)
+    store = make_store(tmp_path, max_size_mb=1)
+    store.push(["data"])
+    for path in (tmp_path / "data").iterdir():
+        path.unlink()
+
+    store.pull(["data"])
+
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+def test_artifact_store_missing(tmp_path, monkeypatch):
+    """unhappy path for push and pull. Missing local paths and empty remote paths raise
+    a FileNotFoundError, and the store needs workers."""
+    monkeypatch.chdir(tmp_path)
+    store = make_store(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        store.push(["models"])
+    with pytest.raises(FileNotFoundError):
+        store.pull(["models"])
+    with pytest.raises(ValueError):
+        make_store(tmp_path, max_workers=0)
+
+def test_backend_from_uri(tmp_path):
+    """happy path for backend_from_uri. Directories and file:// URIs get the local backend."""
+    backend = src.artifact_store.backend_from_uri(f"file://{tmp_path}")
+
+    assert isinstance(backend, src.artifact_store.LocalBackend)
+    assert backend.root == tmp_path
+    assert src.s3.parse_s3("s3://bucket/") == ("bucket", "")
+
+def test_s3_backend_list():
+    """happy path for S3Backend.list. The keys are relative to the prefix of the store and
+    a directory does not match a longer name."""
+    client = boto3.client("s3", region_name="us-east-1", aws_access_key_id="test", aws_secret_access_key="test")
+    backend = src.artifact_store.S3Backend("bucket", "artifacts", client=client)
+    with Stubber(client) as stubber:
+        stubber.add_response("list_objects_v2",
+                             {"Contents": [{"Key": "artifacts/models/model.joblib", "ETag": '"abc"'},
+                                           {"Key": "artifacts/models_old/model.joblib", "ETag": '"def"'}]},
+                             {"Bucket": "bucket", "Prefix": "artifacts/models"})
+        assert backend.list("models") == {"models/model.joblib": "abc"}
@@ -0,0 +1,98 @@
+## This is the unit testing file for all the functions in the artifacts module.
+
+## import packages
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.artifacts
+
+def make_df():
+    """a small table with a string, a categorical and a code column"""
+    return pd.DataFrame({"Name": ["a", "b", "c"],
+                         "group": pd.Categorical(["x", "y", "x"]),
+                         "code": np.array([1, 0, 2], dtype=np.int8)})
+
+@pytest.mark.parametrize("extension", [".parquet", ".arrow"])
+def test_write_read_table(tmp_path, extension):
+    """happy path for write_table and read_table. The columnar formats keep the column types.
+    """
+    df_in = make_df()
+    path = tmp_path / ("table" + extension)
+    src.artifacts.write_table(df_in, path, compression="zstd")
+
+    df_test = src.artifacts.read_table(path)
+
+    pd.testing.assert_frame_equal(df_in, df_test)
+
+def test_iter_table(tmp_path):
+    """happy path for iter_table. The chunks add up to the whole table.
+    """
+    df_in = make_df()
+    path = tmp_path / "table.arrow"
+    src.artifacts.write_table(df_in, path)
+
+    chunks = list(src.artifacts.iter_table(path, chunksize=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert pd.concat(chunks, ignore_index=True)["Name"].tolist() == ["a", "b", "c"]
+
+def test_iter_table_record_batches(tmp_path):
+    """happy path for iter_table. The record batches of an Arrow IPC file are read one at
+    a time and cut to the chunk size.
+    """
+    path = tmp_path / "table.arrow"
+    src.artifacts.write_chunks((pd.DataFrame({"code": range(start, start + 3)}) for start in (0, 3)), path)
+
+    chunks = list(src.artifacts.iter_table(path, chunksize=2))
+
+    assert [chunk["code"].tolist() for chunk in chunks] == [[0, 1], [2], [3, 4], [5]]
+
+@pytest.mark.parametrize("extension", [".csv", ".parquet", ".arrow"])
+def test_table_columns(tmp_path, extension):
+    """happy path for table_columns. The columns are read without the rows.
+    """
+    path = tmp_path / ("table" + extension)
+    src.artifacts.write_table(make_df(), path)
+
+    assert src.artifacts.table_columns(path) == ["Name", "group", "code"]
+
+@pytest.mark.parametrize("extension", [".csv", ".parquet", ".arrow"])
+def test_write_chunks(tmp_path, extension):
+    """happy path for write_chunks. The chunks are written as one table.
+    """
+    df_in = make_df()[["Name", "code"]]
+    path = tmp_path / ("table" + extension)
+
+    n_rows = src.artifacts.write_chunks((df_in.iloc[i:i + 2] for i in range(0, 3, 2)), path)
+
+    assert n_rows == 3
+    pd.testing.assert_frame_equal(src.artifacts.read_table(path, dtype={"code": np.int8}), df_in)
+
+def test_write_chunks_empty(tmp_path):
+    """unhappy path for write_chunks. There is no chunk to write.
+    """
+    with pytest.raises(ValueError):
+        src.artifacts.write_chunks([], tmp_path / "table.parquet")
+
+def test_artifact_path():
+    """happy path for artifact_path. The extension follows the format.
+    """
+    assert src.artifacts.artifact_path("data/interim/clean.csv", "parquet") == "data/interim/clean.parquet"
+    assert src.artifacts.artifact_path("data/interim/clean.csv", None) == "data/interim/clean.csv"
+
+def test_table_format_unknown():
+    """unhappy path for table_format. The extension should be one of the supported formats.
+    """
+    with pytest.raises(ValueError):
+        src.artifacts.table_format("data/interim/clean.xlsx")
+
+def test_write_chunks_empty_column(tmp_path):
+    """happy path for write_chunks. A string column that is empty in a chunk (and read as
+    float) is cast to the type of the first chunk."""
+    path = tmp_path / "table.parquet"
+    chunks = [pd.DataFrame({"name": ["a", "b"]}), pd.DataFrame({"name": [np.nan]})]
+
+    src.artifacts.write_chunks(chunks, str(path))
+
+    assert src.artifacts.read_table(str(path))["name"].tolist() == ["a", "b", None]
@@ -0,0 +1,46 @@
+## This is the unit testing file for all the functions in the encoding module.
+
+## import packages
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.encoding
+
+def test_encode_df():
+    """happy path for encode_df. Codes follow the sorted values and use small integers.
+    """
+    df_in = pd.DataFrame({"Name": ["a", "b", "c"],
+                          "col1": ["z", "x", "z"],
+                          "col2": ["m", "n", None]})
+    df_true = pd.DataFrame({"Name": ["a", "b", "c"],
+                            "col1": np.array([1, 0, 1], dtype=np.int8),
+                            "col2": np.array([0, 1, -1], dtype=np.int8)})
+    vocabulary_true = {"col1": ["x", "z"], "col2": ["m", "n"]}
+
+    df_test, vocabulary_test = src.encoding.encode_df(df_in, ["col1", "col2"])
+
+    pd.testing.assert_frame_equal(df_true, df_test)
+    assert vocabulary_true == vocabulary_test
+
+def test_encode_df_no_col():
+    """unhappy path for encode_df. The columns to encode should be in the df.
+    """
+    df_in = pd.DataFrame({"Name": ["a", "b"], "col1": ["z", "x"]})
+    with pytest.raises(KeyError):
+        src.encoding.encode_df(df_in, ["col1", "wrong_col"])
+
+def test_decode_df():
+    """happy path for decode_df. Suffixed columns are decoded with the same vocabulary.
+    """
+    df_in = pd.DataFrame({"Name": ["a", "b"],
+                          "col1": [1, 0],
+                          "col1_villager": [0, 0]})
+    vocabulary = {"col1": ["x", "z"]}
+    df_true = pd.DataFrame({"Name": ["a", "b"],
+                            "col1": ["z", "x"],
+                            "col1_villager": ["x", "x"]})
+
+    df_test = src.encoding.decode_df(df_in, vocabulary, suffix="_villager")
+
+    pd.testing.assert_frame_equal(df_true, df_test)
@@ -0,0 +1,56 @@
+## This is the unit testing file for the incremental module.
+
+## import packages
+import numpy as np
+import pandas as pd
+
+import src.incremental
+import src.kmodes_engine
+
+def test_extend_vocabulary():
+    """happy path for extend_vocabulary. New values are added and the vocabulary stays
+    sorted.
+    """
+    vocabulary = {"Hobby": ["Music", "Nature"], "Gender": ["Female", "Male"]}
+    df_in = pd.DataFrame({"Hobby": ["Play", "Music", "Fashion"], "Gender": ["Male", "Male", None]})
+
+    vocabulary_test = src.incremental.extend_vocabulary(vocabulary, df_in)
+
+    assert vocabulary_test == {"Hobby": ["Fashion", "Music", "Nature", "Play"],
+                               "Gender": ["Female", "Male"]}
+
+def test_recode():
+    """happy path for code_maps, recode and recode_model. The old codes are mapped to
+    the codes of the extended vocabulary, missing values stay missing and the columns
+    whose codes did not change are left alone.
+    """
+    vocabulary = {"Hobby": ["Music", "Nature"], "Gender": ["Female", "Male"]}
+    extended = {"Hobby": ["Fashion", "Music", "Nature", "Play"], "Gender": ["Female", "Male"]}
+    df_in = pd.DataFrame({"Hobby": [0, 1, -1], "Gender": [1, 0, 1]}, dtype=np.int8)
+    model = src.kmodes_engine.NumpyKModes(n_clusters=2, n_init=1, random_state=42).fit(df_in)
+    centroids = np.asarray(model.cluster_centroids_).copy()
+
+    maps = src.incremental.code_maps(vocabulary, extended)
+    df_test = src.incremental.recode(df_in, maps, extended)
+    src.incremental.recode_model(model, ["Hobby", "Gender"], maps)
+
+    assert list(maps) == ["Hobby"]
+    assert df_test["Hobby"].tolist() == [1, 2, -1]
+    assert df_test["Gender"].tolist() == [1, 0, 1]
+    assert model.cluster_centroids_[:, 1].tolist() == centroids[:, 1].tolist()
+    assert model.cluster_centroids_[:, 0].tolist() == [{0: 1, 1: 2, -1: -1}[code]
+                                                       for code in centroids[:, 0]]
+
+def test_assign_clusters():
+    """happy path for assign_clusters. New rows join the closest mode, and the labels
+    and the cost of the model grow with them.
+    """
+    codes = pd.DataFrame({"col1": [0, 0, 1, 1], "col2": [0, 0, 2, 2]}, dtype=np.int8)
+    model = src.kmodes_engine.NumpyKModes(n_clusters=2, n_init=2, random_state=42).fit(codes)
+    new_rows = pd.DataFrame({"col1": [1, 0], "col2": [3, 0]}, dtype=np.int8)
+
+    clusters = src.incremental.assign_clusters(model, new_rows)
+
+    assert clusters.tolist() == [model.labels_[2], model.labels_[0]]
+    assert len(model.labels_) == 6
+    assert model.cost_ == 1
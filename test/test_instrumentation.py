@@ -0,0 +1,82 @@
+## This is the unit testing file for the instrumentation module.
+
+## import packages
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.instrumentation
+
+@src.instrumentation.instrumented()
+def head(df, n):
+    """a function recorded as a stage"""
+    return df.head(n)
+
+def test_instrumented_stages(tmp_path):
+    """happy path for the instrumentation. Nested stages are recorded with their path,
+    rows, timings and memory, and written to the run report.
+    """
+    recorder = src.instrumentation.enable()
+    try:
+        with src.instrumentation.stage("train", k=3):
+            head(pd.DataFrame({"a": range(10)}), 4)
+            src.instrumentation.add_rows(rows_in=10)
+            src.instrumentation.add_record("fit", 0.5, 0.4, k=3, restarts=2)
+        report = src.instrumentation.write_report(str(tmp_path / "run.json"), command="train")
+    finally:
+        src.instrumentation.disable()
+
+    train, inner, fit = recorder.records
+    assert [record["stage"] for record in recorder.records] == ["train", "train/head", "train/fit"]
+    assert (train["k"], train["rows_in"], train["depth"]) == (3, 10, 0)
+    assert (inner["rows_in"], inner["rows_out"], inner["depth"]) == (10, 4, 1)
+    assert inner["wall_s"] <= train["wall_s"]
+    assert "peak_rss_mb" in inner
+    assert (fit["wall_s"], fit["restarts"]) == (0.5, 2)
+    with open(tmp_path / "run.json", "r") as f:
+        assert json.load(f) == report
+    assert report["command"] == "train"
+
+def test_instrumented_tracemalloc():
+    """happy path for the tracemalloc mode. The peak of a stage includes the peaks of
+    the stages nested in it."""
+    recorder = src.instrumentation.enable(memory="tracemalloc")
+    try:
+        with src.instrumentation.stage("outer"):
+            with src.instrumentation.stage("inner"):
+                block = np.ones(2 ** 20)
+                del block
+    finally:
+        src.instrumentation.disable()
+
+    outer, inner = recorder.records
+    assert inner["traced_peak_mb"] >= 8
+    assert outer["traced_peak_mb"] >= inner["traced_peak_mb"]
+
+def test_instrumentation_off():
+    """happy path for the instrumentation while it is off. Nothing is recorded."""
+    src.instrumentation.disable()
+    with src.instrumentation.stage("train") as record:
+        result = head(pd.DataFrame({"a": range(10)}), 4)
+
+    assert record is None
+    assert len(result) == 4
+    assert src.instrumentation.write_report("unused.json") is None
+
+def test_instrumented_error():
+    """unhappy path for the instrumentation. A stage that raises is recorded with the
+    error, and an unknown memory mode raises a ValueError.
+    """
+    recorder = src.instrumentation.enable()
+    try:
+        with pytest.raises(KeyError):
+            with src.instrumentation.stage("train"):
+                raise KeyError("k")
+    finally:
+        src.instrumentation.disable()
+    assert recorder.records[0]["error"] == "KeyError"
+
+    with pytest.raises(ValueError):
+        src.instrumentation.enable(memory="perf")
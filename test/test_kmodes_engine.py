@@ -0,0 +1,99 @@
+## This is the unit testing file for the kmodes_engine module.
+
+## import packages
+import numpy as np
+import pandas as pd
+import pytest
+from kmodes.kmodes import KModes
+
+import src.artifacts
+import src.kmodes_engine
+import src.modeling_helper
+
+df_in = pd.DataFrame({"col1": ["a", "a", "a", "b", "b", "b", "c", "c"],
+                      "col2": ["x", "x", "x", "y", "y", "y", "z", "z"],
+                      "col3": ["m", "m", "n", "n", "n", "n", "m", "m"]})
+
+def test_mismatch():
+    """happy path for mismatch. Every entry counts the attributes that differ."""
+    codes = np.array([[0, 1], [1, 1], [2, 0]])
+    centroids = np.array([[0, 1], [2, 2]])
+    mismatch_true = np.array([[0, 2], [1, 2], [2, 1]])
+    assert (src.kmodes_engine.mismatch(codes, centroids) == mismatch_true).all()
+
+def test_cluster_modes():
+    """happy path for cluster_modes. Ties go to the smallest code."""
+    codes = np.array([[0, 1], [1, 1], [1, 0], [2, 0]])
+    labels = np.array([0, 0, 1, 1])
+    modes, sizes = src.kmodes_engine.cluster_modes(codes, labels, 3, np.array([3, 2]))
+    assert modes[:2].tolist() == [[0, 1], [1, 0]]
+    assert sizes.tolist() == [2, 2, 0]
+
+def test_numpy_kmodes_matches_kmodes():
+    """happy path for NumpyKModes. On well separated data it finds the same clusters
+    and cost as KModes, and predict gives back the labels.
+    """
+    model_true = KModes(n_clusters=3, init="random", n_init=5, random_state=42).fit(df_in)
+    model_test = src.kmodes_engine.NumpyKModes(n_clusters=3, init="random", n_init=5,
+                                               random_state=42).fit(df_in)
+    assert model_test.cost_ == model_true.cost_
+    assert len(set(zip(model_test.labels_, model_true.labels_))) == 3
+    assert (model_test.predict(df_in) == model_test.labels_).all()
+    assert set(map(tuple, model_test.cluster_centroids_)) == set(map(tuple, model_true.cluster_centroids_))
+
+def test_parallel_sweep_numpy():
+    """happy path for the numpy engine of parallel_sweep. The costs are the ones of
+    NumpyKModes for each k.
+    """
+    k_list = [1, 2, 3]
+    cost_true = [src.kmodes_engine.NumpyKModes(n_clusters=k, init="random", n_init=3,
+                                               random_state=42).fit(df_in).cost_
+                 for k in k_list]
+    cost_test = src.modeling_helper.parallel_sweep(df_in, k_list, init="random", n_init=3,
+                                                   random_state=42, n_jobs=1, engine="numpy")
+    assert cost_test == cost_true
+
+def test_minibatch_kmodes_chunks():
+    """happy path for MiniBatchKModes. Fitting on a function returning the chunks gives
+    the same model as fitting on the array split in batches of the same size.
+    """
+    codes = np.column_stack([np.unique(df_in[col], return_inverse=True)[1] for col in df_in.columns])
+    model_true = src.kmodes_engine.MiniBatchKModes(n_clusters=3, n_init=5, batch_size=3,
+                                                   random_state=42).fit(codes)
+    model_test = src.kmodes_engine.MiniBatchKModes(n_clusters=3, n_init=5, random_state=42).fit(
+        lambda: (codes[start:start + 3] for start in range(0, len(codes), 3)))
+    assert model_test.cost_ == model_true.cost_
+    assert (model_test.labels_ == model_true.labels_).all()
+    assert (model_test.predict(codes) == model_test.labels_).all()
+    assert model_true.cost_ <= src.kmodes_engine.MiniBatchKModes(n_clusters=1).fit(codes).cost_
+
+def test_minibatch_kmodes_not_codes():
+    """unhappy path for MiniBatchKModes. The data is not integer coded.
+    """
+    with pytest.raises(TypeError):
+        src.kmodes_engine.MiniBatchKModes(n_clusters=2).fit(df_in)
+
+def test_make_model_unknown_engine():
+    """unhappy path for make_model. The engine is not supported."""
+    with pytest.raises(ValueError):
+        src.kmodes_engine.make_model("torch", n_clusters=2, init="random", n_init=1, random_state=42)
+
+def test_get_metric_minibatch_streams(tmp_path, monkeypatch):
+    """happy path for get_metric with the minibatch engine. The data used for modeling is
+    checked against the model in batches, without reading the whole table.
+    """
+    import src.modeling
+    codes = pd.DataFrame({col: np.unique(df_in[col], return_inverse=True)[1].astype(np.int8)
+                          for col in df_in.columns})
+    path = str(tmp_path / "for_model.arrow")
+    src.artifacts.write_chunks((codes.iloc[start:start + 3] for start in range(0, len(codes), 3)), path)
+    options = {"batch_size": 2}
+    src.modeling.form_final_model(3, "random", 5, 42, str(tmp_path / "model.joblib"), path,
+                                  engine="minibatch", engine_options=options)
+    monkeypatch.setattr(src.modeling, "read_table", lambda *args, **kwargs: pytest.fail("read whole"))
+
+    src.modeling.get_metric(path, 3, str(tmp_path / "model.joblib"), str(tmp_path / "metric.csv"),
+                            engine="minibatch", engine_options=options)
+
+    model = src.modeling.joblib.load(tmp_path / "model.joblib")["model"]
+    assert pd.read_csv(tmp_path / "metric.csv")["cost"].tolist() == [model.cost_]
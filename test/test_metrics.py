@@ -0,0 +1,69 @@
+## This is the unit testing file for the metrics module.
+
+## import packages
+import pytest
+
+import src.metrics
+import src.rec_cache
+
+def test_histogram_samples():
+    """happy path for Histogram. The buckets are cumulative and end with +Inf, followed
+    by the sum and count."""
+    histogram = src.metrics.Histogram("latency_seconds", "Latency.", ["phase"], buckets=[0.1, 1.0])
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, phase="lookup")
+
+    samples = histogram.samples()
+    assert [(name, labels["le"], value) for name, labels, value in samples[:3]] == \
+        [("latency_seconds_bucket", "0.1", 2), ("latency_seconds_bucket", "1.0", 3),
+         ("latency_seconds_bucket", "+Inf", 4)]
+    assert samples[3] == ("latency_seconds_sum", {"phase": "lookup"}, pytest.approx(3.65))
+    assert samples[4] == ("latency_seconds_count", {"phase": "lookup"}, 4)
+
+def test_registry_expose():
+    """happy path for Registry.expose. Every metric has its help and type lines and the
+    label values are escaped."""
+    registry = src.metrics.Registry()
+    counter = registry.register(src.metrics.Counter("requests_total", "Requests.", ["name"]))
+    registry.register(src.metrics.CallbackMetric("entries", "Entries.", lambda: 3))
+    counter.inc(name='say "hi"')
+    counter.inc(2, name='say "hi"')
+
+    assert registry.expose() == ('# HELP requests_total Requests.\n'
+                                 '# TYPE requests_total counter\n'
+                                 'requests_total{name="say \\"hi\\""} 3.0\n'
+                                 '# HELP entries Entries.\n'
+                                 '# TYPE entries gauge\n'
+                                 'entries 3.0\n')
+
+def test_metrics_invalid():
+    """unhappy path for the metrics. Wrong labels, negative increments and duplicate
+    names raise a ValueError."""
+    registry = src.metrics.Registry()
+    counter = registry.register(src.metrics.Counter("requests_total", "Requests.", ["endpoint"]))
+    with pytest.raises(ValueError):
+        counter.inc(status=200)
+    with pytest.raises(ValueError):
+        counter.inc(-1, endpoint="data")
+    with pytest.raises(ValueError):
+        registry.register(src.metrics.Counter("requests_total", "Requests again."))
+
+def test_serving_metrics():
+    """happy path for ServingMetrics. Requests, phases, outcomes and the cache hit
+    ratio are exposed."""
+    cache = src.rec_cache.RecommendationCache(lambda name: [name], lambda: "v1")
+    metrics = src.metrics.ServingMetrics(cache)
+    cache.get("a")
+    cache.get("a")
+    with metrics.phase("data", "lookup"):
+        pass
+    metrics.count("data", "found")
+    metrics.count("data", "not_found", 0)
+    metrics.observe_request(None, 404, 0.002)
+
+    text = metrics.expose()
+    assert 'recommender_phase_seconds_count{endpoint="data",phase="lookup"} 1.0' in text
+    assert 'recommender_lookups_total{endpoint="data",outcome="found"} 1.0' in text
+    assert 'outcome="not_found"' not in text
+    assert 'recommender_responses_total{endpoint="unknown",status="404"} 1.0' in text
+    assert "recommender_cache_hit_ratio 0.5" in text
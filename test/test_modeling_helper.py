@@ -1,9 +1,10 @@
-## This is the unit testing file for the create_rec_table function in the modeling_helper module.
+## This is the unit testing file for the functions in the modeling_helper module.
 
 ## import packages
 import pandas as pd
 import numpy as np
 import pytest
+from kmodes.kmodes import KModes
 
 import src.modeling_helper
 
@@ -21,10 +22,10 @@ def test_create_rec_table():
     cluster_in = np.array([2,2,4])
     drop_list_in = ["col1_villager", "col2_villager", "col3_villager", "col4_villager", "Cluster"]
     # create df_true
-    df_true_value = [["a", "b", 4, 4, 7, 6, 0],
-                     ["b", "a", 2, 2, 2, 1, 1]]
-    df_true_col= ["Name_villager", "Name", "col1", "col2", "col3", "col4", "Unique_id"]
-    df_true_index = [1, 2]
+    df_true_value = [["a", "b", 4, 4, 7, 6, 1, 0],
+                     ["b", "a", 2, 2, 2, 1, 1, 1]]
+    df_true_col= ["Name_villager", "Name", "col1", "col2", "col3", "col4", "Rank", "Unique_id"]
+    df_true_index = [0, 1]
 
     df_true = pd.DataFrame(df_true_value, index=df_true_index, columns=df_true_col)
     df_test = src.modeling_helper.create_rec_table(df_in, cluster_in, drop_list_in)
@@ -32,6 +33,50 @@ def test_create_rec_table():
     # Test that the true and test are the same
     pd.testing.assert_frame_equal(df_true, df_test, check_column_type = False)
 
+def test_create_rec_table_categorical_name():
+    """happy path for create_rec_table. Names read from a categorical table give the same
+    table as string names.
+    """
+    df_in = pd.DataFrame({"Name": ["c", "a", "b"], "col1": [1, 1, 2], "col2": [0, 1, 0]})
+    cluster_in = np.array([0, 0, 0])
+    df_categorical = df_in.assign(Name=pd.Categorical(df_in["Name"], categories=["b", "c", "a"]))
+
+    df_true = src.modeling_helper.create_rec_table(df_in, cluster_in, ["Cluster"])
+    df_test = src.modeling_helper.create_rec_table(df_categorical, cluster_in, ["Cluster"])
+
+    pd.testing.assert_frame_equal(df_true, df_test)
+
+def test_create_rec_table_top_n():
+    """happy path for create_rec_table with top_n.
+       Only the most similar villagers in the same cluster are kept, ranked by similarity.
+    """
+    # create df_in
+    df_in_values = [["a", 1, 1, 1],
+                    ["b", 2, 2, 2],
+                    ["c", 1, 1, 2],
+                    ["d", 1, 2, 2],
+                    ["e", 1, 1, 1]]
+    df_in_col = ["Name", "col1", "col2", "col3"]
+    df_in = pd.DataFrame(df_in_values, columns=df_in_col)
+    # create cluster_in and drop_list
+    cluster_in = np.array([0, 0, 0, 0, 1])
+    drop_list_in = ["col1_villager", "col2_villager", "col3_villager", "Cluster"]
+    # create df_true
+    df_true_value = [["a", "c", 1, 1, 2, 1, 0],
+                     ["a", "d", 1, 2, 2, 2, 1],
+                     ["b", "d", 1, 2, 2, 1, 2],
+                     ["b", "c", 1, 1, 2, 2, 3],
+                     ["c", "a", 1, 1, 1, 1, 4],
+                     ["c", "d", 1, 2, 2, 2, 5],
+                     ["d", "b", 2, 2, 2, 1, 6],
+                     ["d", "c", 1, 1, 2, 2, 7]]
+    df_true_col= ["Name_villager", "Name", "col1", "col2", "col3", "Rank", "Unique_id"]
+    df_true = pd.DataFrame(df_true_value, columns=df_true_col)
+    df_test = src.modeling_helper.create_rec_table(df_in, cluster_in, drop_list_in, top_n=2)
+
+    # Test that the true and test are the same
+    pd.testing.assert_frame_equal(df_true, df_test, check_column_type = False, check_dtype = False)
+
 def test_create_rec_table_nrow_notmatch():
     """unhappy path for create_rec_table.
        Here, the number of rows are not matched with the length of the cluster array.
@@ -48,3 +93,84 @@ def test_create_rec_table_nrow_notmatch():
     drop_list_in = ["col1_villager", "col2_villager", "col3_villager", "col4_villager", "Cluster"]
     with pytest.raises(ValueError):
         src.modeling_helper.create_rec_table(df_in, cluster_in, drop_list_in)
+
+def test_parallel_sweep():
+    """happy path for parallel_sweep. The costs should match fitting KModes for each k.
+    """
+    df_in = pd.DataFrame({"col1": ["a", "a", "b", "b", "c", "c"],
+                          "col2": ["x", "y", "x", "y", "x", "x"],
+                          "col3": ["m", "m", "n", "n", "m", "n"]})
+    k_list = [1, 2, 3]
+    cost_true = []
+    for num_clusters in k_list:
+        kmode = KModes(n_clusters=num_clusters, init="random", n_init=3, random_state=42)
+        kmode.fit(df_in)
+        cost_true.append(kmode.cost_)
+
+    cost_test = src.modeling_helper.parallel_sweep(df_in, k_list, init="random", n_init=3,
+                                                   random_state=42, n_jobs=2)
+
+    assert cost_true == cost_test
+
+def test_parallel_sweep_zero_jobs():
+    """unhappy path for parallel_sweep. n_jobs can not be 0.
+    """
+    df_in = pd.DataFrame({"col1": ["a", "a", "b"], "col2": ["x", "y", "x"]})
+    with pytest.raises(ValueError):
+        src.modeling_helper.parallel_sweep(df_in, [1, 2], init="random", n_init=3,
+                                           random_state=42, n_jobs=0)
+
+def test_find_knee():
+    """happy path for find_knee. The knee is where the cost stops dropping quickly,
+    and candidates restrict the choice.
+    """
+    k_list = [1, 2, 3, 4, 5, 6]
+    cost = [100, 60, 30, 25, 22, 20]
+    assert src.modeling_helper.find_knee(k_list, cost) == 3
+    assert src.modeling_helper.find_knee(k_list, cost, candidates=[5, 6]) == 5
+
+def test_find_knee_no_candidate():
+    """unhappy path for find_knee. None of the candidates is in k_list.
+    """
+    with pytest.raises(ValueError):
+        src.modeling_helper.find_knee([1, 2, 3], [3, 2, 1], candidates=[7])
+
+def test_adaptive_sweep():
+    """happy path for adaptive_sweep. The refined k have the full restarts, the others
+    the coarse ones, and exactly one refined k is selected.
+    """
+    df_in = pd.DataFrame({"col1": ["a", "a", "b", "b", "c", "c", "d", "d"],
+                          "col2": ["x", "y", "x", "y", "x", "x", "y", "y"],
+                          "col3": ["m", "m", "n", "n", "m", "n", "m", "m"]})
+    result = src.modeling_helper.adaptive_sweep(df_in, 1, 7, init="random", n_init=4,
+                                                random_state=42, n_jobs=1,
+                                                coarse_n_init=1, coarse_step=2, refine_width=1)
+    assert result["K"].tolist()[0] == 1 and result["K"].tolist()[-1] == 6
+    assert set(result["n_init"]) <= {1, 4}
+    assert result["selected"].sum() == 1
+    assert result.loc[result["selected"], "n_init"].iloc[0] == 4
+
+def test_adaptive_sweep_empty_range():
+    """unhappy path for adaptive_sweep. k_end is not larger than k_start.
+    """
+    df_in = pd.DataFrame({"col1": ["a", "a", "b"], "col2": ["x", "y", "x"]})
+    with pytest.raises(ValueError):
+        src.modeling_helper.adaptive_sweep(df_in, 3, 3, init="random", n_init=2,
+                                           random_state=42, n_jobs=1)
+
+def test_chunks_checksum():
+    """happy path for chunks_checksum. It is the data_checksum of the whole table.
+    """
+    df_in = pd.DataFrame({"col1": [1, 2, 3, 4, 5], "col2": ["a", "b", "c", "d", "e"]})
+    chunks = [df_in.iloc[:2], df_in.iloc[2:]]
+    assert src.modeling_helper.chunks_checksum(chunks) == src.modeling_helper.data_checksum(df_in)
+
+def test_data_checksum():
+    """happy path for data_checksum. Same data gives the same checksum, changed data does not.
+    """
+    df_in = pd.DataFrame({"col1": ["a", "b"], "col2": ["x", "y"]})
+    df_same = pd.DataFrame({"col1": ["a", "b"], "col2": ["x", "y"]}, index=[5, 6])
+    df_changed = pd.DataFrame({"col1": ["a", "b"], "col2": ["x", "x"]})
+
+    assert src.modeling_helper.data_checksum(df_in) == src.modeling_helper.data_checksum(df_same)
+    assert src.modeling_helper.data_checksum(df_in) != src.modeling_helper.data_checksum(df_changed)
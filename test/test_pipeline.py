@@ -0,0 +1,84 @@
+## This is the unit testing file for the pipeline module.
+
+## import packages
+import logging
+import os
+
+import pytest
+import yaml
+
+import src.modeling
+import src.pipeline
+
+def small_config():
+    """the model configuration with a short elbow sweep"""
+    with open("config/model_config.yaml", "r") as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    config["modeling"]["kmodes_modeling"].update(k_start=1, k_end=3, n_init=1, n_jobs=1)
+    config["modeling"]["form_final_model"].update(final_n_cluster=3, n_init=1)
+    return config
+
+def pipeline_paths(tmp_path):
+    """the paths of the pipeline files in tmp_path"""
+    return {"raw": "data/raw/villagers.csv",
+            "clean": str(tmp_path / "clean.parquet"),
+            "encoded": str(tmp_path / "encoded.parquet"),
+            "vocab": str(tmp_path / "vocabulary.json"),
+            "df_model": str(tmp_path / "for_model.parquet"),
+            "png": str(tmp_path / "cost.png"),
+            "result": str(tmp_path / "result.csv"),
+            "model": str(tmp_path / "kmodes.joblib"),
+            "rec": str(tmp_path / "recommendation.arrow"),
+            "store": str(tmp_path / "recommendation.store"),
+            "index": str(tmp_path / "similarity_index.joblib"),
+            "metric": str(tmp_path / "metric.csv")}
+
+def test_stage_range():
+    """happy path for the stage range. Both ends are included."""
+    assert src.pipeline.stage_range("train", "get_metric") == ["train", "recommendation",
+                                                               "similarity_index", "get_metric"]
+    assert src.pipeline.stage_range("train", "train") == ["train"]
+
+def test_stage_range_reversed():
+    """unhappy path for the stage range. The start comes after the end."""
+    with pytest.raises(ValueError):
+        src.pipeline.stage_range("get_metric", "preprocess")
+
+def test_stage_range_unknown():
+    """unhappy path for the stage range. The stage does not exist."""
+    with pytest.raises(ValueError):
+        src.pipeline.stage_range("download", "train")
+
+def test_run_pipeline_then_stage(tmp_path, caplog):
+    """happy path for run_pipeline. A standalone stage run afterwards reuses the saved
+    model instead of refitting it, also when a later pipeline run without save_artifacts
+    trained on other features.
+    """
+    config = small_config()
+    paths = pipeline_paths(tmp_path)
+    src.pipeline.run_pipeline(config, paths, save_artifacts=True)
+    assert os.path.isfile(paths["index"]) and os.path.isfile(paths["store"])
+    saved = os.path.getmtime(paths["model"])
+    other = small_config()
+    other["modeling"]["kmodes_modeling"]["feature_not_used"].append("Hobby")
+    src.pipeline.run_pipeline(other, paths, end="similarity_index")
+
+    with caplog.at_level(logging.WARNING):
+        src.modeling.recommendation(**config["modeling"]["recommendation"],
+                                    filename_model=paths["df_model"],
+                                    filename_encoded=paths["encoded"],
+                                    vocab_path=paths["vocab"],
+                                    model_path=paths["model"],
+                                    recommendation_path=paths["rec"])
+    assert "Refitting" not in caplog.text
+    assert os.path.getmtime(paths["model"]) == saved
+
+def test_run_pipeline_no_artifacts(tmp_path):
+    """happy path for run_pipeline. Without save_artifacts only the plot and the
+    deliverables are written, not the model, the store or the index.
+    """
+    paths = pipeline_paths(tmp_path)
+    src.pipeline.run_pipeline(small_config(), paths)
+    assert os.path.isfile(paths["metric"]) and os.path.isfile(paths["result"])
+    for key in ["df_model", "model", "rec", "store", "index"]:
+        assert not os.path.exists(paths[key])
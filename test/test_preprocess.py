@@ -50,3 +50,53 @@ def test_drop_cols_no_col():
 
     with pytest.raises(KeyError):
         src.preprocess.drop_cols(df_in, features)
+
+ENGINEERING = {"grouping_column": "Species",
+               "grouping_dict": {"large": ["Bull", "Horse"], "small": ["Cat"]},
+               "grouping_new_name": "Species_group",
+               "grouping_unmapped": "other",
+               "trim_column": "Birthday",
+               "trim_by": -3,
+               "trim_new_name": "Birthday_month"}
+
+@pytest.mark.parametrize("extension, options", [(".parquet", {"categorical": True}),
+                                                (".arrow", {"categorical": True}),
+                                                (".csv", {})])
+def test_preprocess_stream(tmp_path, extension, options):
+    """happy path for preprocess_stream. The tables and the vocabulary are the ones of
+    the batch functions, whatever the chunks are."""
+    raw = pd.DataFrame({"Name": ["d", "b", "g", "a", "f", "c", "e"],
+                        "Species": ["Cat", "Bull", "Cat", "Duck", "Horse", "Cat", "Bull"],
+                        "Birthday": ["1-Jan", "2-Feb", "3-Jan", "4-Mar", "5-Feb", "6-Jan", "7-Jan"],
+                        "Hobby": ["Play", "Nature", None, None, "Play", "Music", "Play"],
+                        "Unused": [1, 2, 3, 4, 5, 6, 7]})
+    raw.to_csv(tmp_path / "raw.csv", index=False)
+    features = ["Name", "Species", "Birthday", "Hobby"]
+
+    cleaned = src.preprocess.feature_engineering(src.preprocess.drop_cols(raw, features), **ENGINEERING)
+    encoded, vocabulary = src.preprocess.encode_data(cleaned, ["Name"])
+    src.preprocess.save_df(cleaned, str(tmp_path / f"clean{extension}"), **options)
+    src.preprocess.save_df(encoded, str(tmp_path / f"encoded{extension}"), **options)
+    # the third chunk has no hobby and no unmapped species
+    vocabulary_stream = src.preprocess.preprocess_stream(str(tmp_path / "raw.csv"),
+                                                         str(tmp_path / f"clean_stream{extension}"),
+                                                         str(tmp_path / f"encoded_stream{extension}"),
+                                                         features, ["Name"], chunksize=2,
+                                                         **options, **ENGINEERING)
+
+    assert vocabulary_stream == vocabulary
+    for name in ("clean", "encoded"):
+        batch = src.preprocess.read_table(str(tmp_path / f"{name}{extension}"))
+        stream = src.preprocess.read_table(str(tmp_path / f"{name}_stream{extension}"))
+        pd.testing.assert_frame_equal(batch, stream)
+
+def test_preprocess_stream_invalid(tmp_path):
+    """unhappy path for preprocess_stream. Missing columns raise a KeyError and chunks
+    need rows."""
+    pd.DataFrame({"Name": ["a"], "Species": ["Cat"]}).to_csv(tmp_path / "raw.csv", index=False)
+    paths = [str(tmp_path / "raw.csv"), str(tmp_path / "clean.csv"), str(tmp_path / "encoded.csv")]
+
+    with pytest.raises(KeyError):
+        src.preprocess.preprocess_stream(*paths, ["Name", "Species", "Birthday"], ["Name"], **ENGINEERING)
+    with pytest.raises(ValueError):
+        src.preprocess.preprocess_stream(*paths, ["Name", "Species"], ["Name"], chunksize=0, **ENGINEERING)
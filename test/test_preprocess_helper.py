@@ -29,6 +29,7 @@ def test_grouping():
     df_true_index = [0, 1, 2, 3]
     df_true_col = ["Name", "col1", "col2", "group_name"]
     df_true = pd.DataFrame(df_true_values, index=df_true_index, columns=df_true_col)
+    df_true["group_name"] = pd.Categorical(df_true["group_name"], categories=["a", "g"])
 
     df_test = src.preprocess_helper.grouping(df_in, grouping_dict, grouping_column, grouping_new_name)
 
@@ -53,6 +54,27 @@ def test_grouping_no_column():
     with pytest.raises(KeyError):
         src.preprocess_helper.grouping(df_in, grouping_dict, grouping_column, grouping_new_name)
 
+def test_grouping_unmapped_other():
+    """This is the happy path to the grouping function with entries that are not in any group
+    """
+    df_in = pd.DataFrame({"Name": ["g1", "a1", "x1"]})
+    grouping_dict = {"a":["a1"], "g": ["g1"]}
+    df_true = pd.DataFrame({"Name": ["g1", "a1", "x1"],
+                            "group_name": pd.Categorical(["g", "a", "other"], categories=["a", "g", "other"])})
+
+    df_test = src.preprocess_helper.grouping(df_in, grouping_dict, "Name", "group_name", unmapped="other")
+
+    # Test that the true and test are the same
+    pd.testing.assert_frame_equal(df_true, df_test)
+
+def test_grouping_unmapped_error():
+    """This is the unhappy path to the grouping function with entries that are not in any group
+    """
+    df_in = pd.DataFrame({"Name": ["g1", "a1", "x1"]})
+    grouping_dict = {"a":["a1"], "g": ["g1"]}
+    with pytest.raises(ValueError):
+        src.preprocess_helper.grouping(df_in, grouping_dict, "Name", "group_name", unmapped="error")
+
 def test_trimming():
     """This is the happy path for the trimming function
     """
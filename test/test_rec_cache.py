@@ -0,0 +1,97 @@
+## This is the unit testing file for the RecommendationCache class in the rec_cache module.
+
+## import packages
+import asyncio
+
+import pytest
+
+import src.rec_cache
+
+def test_cache_lru():
+    """happy path for the cache. Hits are served without the loader and the least
+    recently used villager is evicted first.
+    """
+    calls = []
+    def loader(name):
+        calls.append(name)
+        return [name + "_rec"]
+
+    cache = src.rec_cache.RecommendationCache(loader, lambda: "v1", max_size=2)
+    assert cache.get("a") == ["a_rec"]
+    assert cache.get("b") == ["b_rec"]
+    assert cache.get("a") == ["a_rec"]
+    # "b" is the least recently used one and gets evicted
+    cache.get("c")
+    cache.get("b")
+
+    assert calls == ["a", "b", "c", "b"]
+    assert cache.hits == 1
+    assert cache.misses == 4
+    assert len(cache) == 2
+
+def test_cache_version_change():
+    """happy path for the cache. A new version stamp clears the cached entries.
+    """
+    calls = []
+    versions = ["v1"]
+    def loader(name):
+        calls.append(name)
+        return [name + "_rec"]
+
+    cache = src.rec_cache.RecommendationCache(loader, lambda: versions[0], version_ttl=0)
+    cache.get("a")
+    cache.get("a")
+    versions[0] = "v2"
+    cache.get("a")
+
+    assert calls == ["a", "a"]
+
+def test_cache_size_zero():
+    """unhappy path for the cache. The cache size should be at least 1.
+    """
+    with pytest.raises(ValueError):
+        src.rec_cache.RecommendationCache(lambda name: [], lambda: None, max_size=0)
+
+def test_cache_get_many():
+    """happy path for get_many. Cached villagers are served from the cache and the
+    others are loaded with one call of the batch loader.
+    """
+    batches = []
+    def batch_loader(names):
+        batches.append(names)
+        return {name: [name + "_rec"] for name in names if name != "z"}
+
+    cache = src.rec_cache.RecommendationCache(lambda name: [name + "_rec"], lambda: "v1",
+                                              batch_loader=batch_loader)
+    cache.get("a")
+    results = cache.get_many(["b", "a", "z", "b"])
+
+    assert results == {"b": ["b_rec"], "a": ["a_rec"], "z": []}
+    assert list(results) == ["b", "a", "z"]
+    assert batches == [["b", "z"]]
+    assert cache.get_many(["z"]) == {"z": []}
+    assert batches == [["b", "z"]]
+
+def test_async_cache_get_many():
+    """happy path for the async cache. Misses are loaded with one awaited batch call
+    and a new version stamp clears the cache.
+    """
+    batches = []
+    versions = ["v1"]
+    async def batch_loader(names):
+        batches.append(names)
+        return {name: [name + "_rec"] for name in names}
+    async def loader(name):
+        return [name + "_rec"]
+    async def version_getter():
+        return versions[0]
+
+    cache = src.rec_cache.AsyncRecommendationCache(loader, version_getter, version_ttl=0,
+                                                   batch_loader=batch_loader)
+    assert asyncio.run(cache.get("a")) == ["a_rec"]
+    assert asyncio.run(cache.get_many(["a", "b"])) == {"a": ["a_rec"], "b": ["b_rec"]}
+    versions[0] = "v2"
+    asyncio.run(cache.get("a"))
+
+    assert batches == [["a"], ["b"], ["a"]]
+    assert cache.hits == 1
@@ -0,0 +1,98 @@
+## This is the unit testing file for the rec_store module.
+
+## import packages
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+import src.rec_store
+
+rec = pd.DataFrame({"Name_villager": ["b", "a", "a", "b", "a"],
+                    "Name": ["a", "c", "b", "c", None],
+                    "Species": pd.Categorical(["Cat", "Dog", "Cat", "Dog", "Cat"]),
+                    "Rank": [1, 2, 1, 2, 3],
+                    "Unique_id": [0, 1, 2, 3, 4]})
+
+def test_lookup(tmp_path):
+    """happy path for write_rec_store and RecommendationStore. The rows of a villager
+    come back decoded and ordered by rank.
+    """
+    path = str(tmp_path / "rec.store")
+    src.rec_store.write_rec_store(rec, path)
+    store = src.rec_store.RecommendationStore(path)
+
+    assert store.lookup("a", limit=2) == [
+        {"Name_villager": "a", "Name": "b", "Species": "Cat", "Rank": 1, "Unique_id": 2},
+        {"Name_villager": "a", "Name": "c", "Species": "Dog", "Rank": 2, "Unique_id": 1}]
+    assert store.lookup("a")[2]["Name"] is None
+    assert [row["Rank"] for row in store.lookup("b")] == [1, 2]
+    assert store.lookup("z") == []
+
+def test_get_version(tmp_path):
+    """happy path for get_version. A replaced store is mapped again."""
+    path = str(tmp_path / "rec.store")
+    version = src.rec_store.write_rec_store(rec, path)
+    store = src.rec_store.RecommendationStore(path)
+    assert store.get_version() == version
+
+    new_version = src.rec_store.write_rec_store(rec[rec["Name_villager"] == "b"], path)
+    os.utime(path, ns=(0, 0))
+
+    assert store.get_version() == new_version != version
+    assert store.lookup("a") == []
+
+def test_write_categorical(tmp_path):
+    """happy path for write_rec_store. Categorical columns give the same file as string
+    columns, whatever the order of their categories.
+    """
+    categorical = rec.assign(Name_villager=pd.Categorical(rec["Name_villager"], categories=["b", "a"]))
+    src.rec_store.write_rec_store(rec, str(tmp_path / "strings.store"))
+    src.rec_store.write_rec_store(categorical, str(tmp_path / "categories.store"))
+
+    assert (tmp_path / "strings.store").read_bytes() == (tmp_path / "categories.store").read_bytes()
+
+def test_write_missing_column(tmp_path):
+    """unhappy path for write_rec_store. The table needs the key and the order column."""
+    with pytest.raises(KeyError):
+        src.rec_store.write_rec_store(rec.drop(columns="Rank"), str(tmp_path / "rec.store"))
+
+def test_open_wrong_file(tmp_path):
+    """unhappy path for RecommendationStore. Other files are rejected."""
+    path = tmp_path / "rec.arrow"
+    path.write_bytes(b"not a store")
+    with pytest.raises(ValueError):
+        src.rec_store.RecommendationStore(str(path))
+
+def test_lookup_during_reload(tmp_path):
+    """happy path for lookup while another thread maps replaced stores. Every lookup
+    returns the rows of one of the two files, never the index of one with the rows of
+    the other."""
+    path = str(tmp_path / "rec.store")
+    tables = [rec, rec[rec["Name_villager"] == "b"]]
+    expected = []
+    for table in tables:
+        src.rec_store.write_rec_store(table, path)
+        expected.append(src.rec_store.RecommendationStore(path).lookup("b"))
+    store = src.rec_store.RecommendationStore(path)
+    stop = threading.Event()
+    results = []
+
+    def reload():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            src.rec_store.write_rec_store(tables[i % 2], path)
+            store.get_version()
+
+    thread = threading.Thread(target=reload)
+    thread.start()
+    try:
+        for _ in range(20000):
+            results.append(store.lookup("b"))
+    finally:
+        stop.set()
+        thread.join()
+
+    assert all(result in expected for result in results)
@@ -0,0 +1,69 @@
+## This is the unit testing file for the similarity module.
+
+## import packages
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.similarity
+
+def _index(top_k=2):
+    df_model = pd.DataFrame({"col1": [0, 0, 1, 1, 0],
+                             "col2": [0, 0, 2, 2, 1],
+                             "col3": [1, 1, 0, 1, 1]}, dtype=np.int8)
+    names = pd.Series(["a", "b", "c", "d", "e"])
+    return src.similarity.SimilarityIndex.build(df_model, names, np.array([0, 0, 1, 1, 1]), top_k=top_k)
+
+def test_shared_attributes():
+    """happy path for shared_attributes. The popcount of the packed one-hot vectors is
+    the number of equal codes.
+    """
+    rng = np.random.RandomState(0)
+    codes = rng.randint(0, 5, size=(50, 7))
+    n_values = np.full(7, 5)
+    packed = src.similarity.pack_codes(codes, n_values)
+
+    shared = src.similarity.shared_attributes(packed, packed[:3])
+
+    np.testing.assert_array_equal(shared, (codes[:3, None, :] == codes[None, :, :]).sum(axis=2))
+
+def test_query():
+    """happy path for query. The precomputed neighbors are ordered by similarity, then
+    by position, and agree with a query over more than top_k villagers.
+    """
+    index = _index()
+
+    assert index.query("a", k=2) == [{"Name": "b", "Cluster": 0, "Similarity": 3},
+                                     {"Name": "e", "Cluster": 1, "Similarity": 2}]
+    assert index.query("a", k=2, same_cluster=True) == [{"Name": "b", "Cluster": 0, "Similarity": 3}]
+    assert index.query("a", k=3)[:2] == index.query("a", k=2)
+    assert [row["Name"] for row in index.query("c", k=4, same_cluster=True)] == ["d", "e"]
+
+def test_query_codes():
+    """happy path for query_codes. Unseen codes match nothing."""
+    index = _index()
+
+    rows = index.query_codes(np.array([1, 2, 7]), k=2, cluster=1)
+
+    assert rows == [{"Name": "c", "Cluster": 1, "Similarity": 2},
+                    {"Name": "d", "Cluster": 1, "Similarity": 2}]
+
+def test_query_unknown_name():
+    """unhappy path for query. A name outside of the index raises a KeyError."""
+    with pytest.raises(KeyError):
+        _index().query("z")
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_query_k_not_positive(k):
+    """unhappy path for query and query_codes. k should be at least 1."""
+    index = _index()
+    with pytest.raises(ValueError):
+        index.query("a", k=k)
+    with pytest.raises(ValueError):
+        index.query_codes(np.array([1, 2, 0]), k=k)
+
+def test_build_length_mismatch():
+    """unhappy path for build. The names and the clusters must align with the data."""
+    df_model = pd.DataFrame({"col1": [0, 1]})
+    with pytest.raises(ValueError):
+        src.similarity.SimilarityIndex.build(df_model, pd.Series(["a"]), np.array([0, 1]))
@@ -0,0 +1,81 @@
+## This is the unit testing file for the stage_cache module.
+
+## import packages
+import pytest
+
+import src.stage_cache
+
+def test_stage_cache_restore(tmp_path):
+    """happy path for the stage cache. Stored outputs are copied back for the same
+    inputs and config, and a changed input misses.
+    """
+    package = tmp_path / "pkg"
+    package.mkdir()
+    (package / "mod.py").write_text("x = 1\n")
+    data = tmp_path / "input.csv"
+    data.write_text("a,b\n1,2\n")
+    output = tmp_path / "out" / "result.csv"
+    output.parent.mkdir()
+    output.write_text("result\n")
+
+    cache = src.stage_cache.StageCache(str(tmp_path / "cache"), package_dir=str(package))
+    key = cache.key("train", [str(data)], {"k": 3})
+    assert not cache.restore(key, [str(output)])
+    cache.store(key, "train", [str(output)])
+    output.unlink()
+    assert cache.restore(key, [str(output)])
+    assert output.read_text() == "result\n"
+
+    data.write_text("a,b\n1,3\n")
+    assert cache.key("train", [str(data)], {"k": 3}) != key
+    assert cache.key("train", [str(tmp_path / "input.csv")], {"k": 4}) != key
+
+def test_stage_cache_code_files(tmp_path):
+    """happy path for the fingerprint. The entrypoint and the path of the configuration
+    file are part of it.
+    """
+    entrypoint = tmp_path / "run.py"
+    entrypoint.write_text("main()\n")
+    data = tmp_path / "input.csv"
+    data.write_text("a,b\n1,2\n")
+    cache = src.stage_cache.StageCache(str(tmp_path / "cache"), package_dir=str(tmp_path / "pkg"),
+                                       code_files=[str(entrypoint)])
+    key = cache.key("train", [str(data)], {"k": 3}, config_path="config/model_config.yaml")
+    assert cache.key("train", [str(data)], {"k": 3}, config_path="config/other.yaml") != key
+
+    entrypoint.write_text("main(fast=True)\n")
+    changed = src.stage_cache.StageCache(str(tmp_path / "cache"), package_dir=str(tmp_path / "pkg"),
+                                         code_files=[str(entrypoint)])
+    assert changed.key("train", [str(data)], {"k": 3}, config_path="config/model_config.yaml") != key
+
+def test_stage_cache_evict(tmp_path):
+    """happy path for the eviction. The least recently used entry is removed first."""
+    output = tmp_path / "result.bin"
+    output.write_bytes(b"0" * 600 * 1024)
+    cache = src.stage_cache.StageCache(str(tmp_path / "cache"), max_size_mb=1,
+                                       package_dir=str(tmp_path))
+    cache.store("old", "train", [str(output)])
+    cache.store("new", "train", [str(output)])
+    assert not cache.restore("old", [str(output)])
+    assert cache.restore("new", [str(output)])
+
+def test_stage_cache_missing_input(tmp_path):
+    """unhappy path for the stage cache. An input file does not exist."""
+    cache = src.stage_cache.StageCache(str(tmp_path / "cache"), package_dir=str(tmp_path))
+    with pytest.raises(FileNotFoundError):
+        cache.key("train", [str(tmp_path / "missing.csv")], {})
+
+def test_stage_cache_too_large(tmp_path):
+    """unhappy path for the stage cache. Outputs larger than the cache are not stored,
+    and the entries already in the cache are kept.
+    """
+    small = tmp_path / "small.bin"
+    small.write_bytes(b"0" * 1024)
+    large = tmp_path / "large.bin"
+    large.write_bytes(b"0" * 2 * 1024 * 1024)
+    cache = src.stage_cache.StageCache(str(tmp_path / "cache"), max_size_mb=1,
+                                       package_dir=str(tmp_path))
+    cache.store("small", "train", [str(small)])
+    cache.store("large", "train", [str(large)])
+    assert not cache.restore("large", [str(large)])
+    assert cache.restore("small", [str(small)])